@@ -0,0 +1,79 @@
+# Пропускная способность checkout (OrderService.create_order) для корзин из 1, 10 и 100 позиций.
+#
+# Нужна база из .env. Скрипт сам создает пользователя, категорию и товары.
+# Запуск: python -m benchmarks.bench_checkout --orders 200
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import insert
+
+from src.database import engine, async_session_maker
+from src.catalog.models import CategoryModel, ProductModel, CartItemModel
+from src.catalog.service import OrderService
+from src.users.models import UserModel
+
+
+async def prepare(max_items: int) -> tuple[uuid.UUID, list[int]]:
+    suffix = uuid.uuid4().hex[:8]
+    async with async_session_maker() as session:
+        user_id = await session.scalar(
+            insert(UserModel).values(
+                email=f"bench-{suffix}@example.com", hashed_password="-", fio="bench",
+                is_verified=True
+            ).returning(UserModel.id)
+        )
+        category_id = await session.scalar(
+            insert(CategoryModel).values(name=f"bench-{suffix}").returning(CategoryModel.id)
+        )
+        product_ids = (await session.scalars(
+            insert(ProductModel).returning(ProductModel.id),
+            [
+                {"sku": f"bench-{suffix}-{i}", "name": f"Product {i}", "price": 100.0,
+                 "discount_price": 0.0, "stock": 1_000_000_000, "category_id": category_id}
+                for i in range(max_items)
+            ]
+        )).all()
+        await session.commit()
+    return user_id, list(product_ids)
+
+
+async def fill_cart(user_id: uuid.UUID, product_ids: list[int]):
+    async with async_session_maker() as session:
+        await session.execute(
+            insert(CartItemModel),
+            [{"user_uuid": user_id, "product_id": product_id, "quantity": 2, "price": 100.0}
+             for product_id in product_ids]
+        )
+        await session.commit()
+
+
+async def bench(user_id: uuid.UUID, product_ids: list[int], orders: int):
+    elapsed = 0.0
+    for _ in range(orders):
+        await fill_cart(user_id, product_ids)
+        async with async_session_maker() as session:
+            started = time.perf_counter()
+            await OrderService.create_order(session, user_id)
+            elapsed += time.perf_counter() - started
+    print(
+        f"cart_items={len(product_ids):<4} checkouts/sec={orders / elapsed:8.1f} "
+        f"ms/checkout={elapsed / orders * 1000:7.2f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+
+    user_id, product_ids = await prepare(max(args.sizes))
+    for size in args.sizes:
+        await bench(user_id, product_ids[:size], args.orders)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+# Выгрузка каталога (ProductExportService): скорость и пиковый RSS процесса.
+#
+# Нужна база из .env с заполненной таблицей products. Для наполнения:
+#   python -m benchmarks.bench_export --seed 1000000
+# Запуск: python -m benchmarks.bench_export --format csv --with-category-path
+import argparse
+import asyncio
+import resource
+import time
+
+from sqlalchemy import text
+
+from src.database import engine, async_session_maker
+from src.catalog.exporter import ProductExportService
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в килобайтах на Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def seed(rows: int):
+    async with async_session_maker() as session:
+        category_id = await session.scalar(text(
+            "INSERT INTO categories (name) VALUES ('bench-export') "
+            "ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name RETURNING id"
+        ))
+        await session.execute(text(
+            "INSERT INTO products (sku, name, description, price, discount_price, stock, category_id) "
+            "SELECT 'bench-export-' || g, 'Product ' || g, 'Description of product ' || g, "
+            "(random() * 10000)::numeric(10, 2), 0, 10, :category_id "
+            "FROM generate_series(1, :rows) AS g ON CONFLICT (sku) DO NOTHING"
+        ), {"rows": rows, "category_id": category_id})
+        await session.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="ndjson")
+    parser.add_argument("--with-category-path", action="store_true")
+    args = parser.parse_args()
+
+    if args.seed:
+        await seed(args.seed)
+
+    before = peak_rss_mb()
+    started = time.perf_counter()
+    chunks = size = 0
+    async for chunk in ProductExportService.export_products(
+            args.format, with_category_path=args.with_category_path):
+        chunks += 1
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    print(
+        f"format={args.format} chunks={chunks} MB={size / 2**20:.1f} seconds={elapsed:.1f} "
+        f"MB/sec={size / 2**20 / elapsed:.1f} peak RSS before={before:.0f} MB after={peak_rss_mb():.0f} MB"
+    )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
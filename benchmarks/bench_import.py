@@ -0,0 +1,65 @@
+# Скорость массового импорта товаров (ProductImportService) в строках в секунду.
+#
+# Нужна база из .env. Скрипт создает категорию и прогоняет один и тот же фид трижды:
+# новые товары (insert), тот же фид (ничего не меняется) и фид с новыми ценами (update).
+# Запуск: python -m benchmarks.bench_import --rows 100000 --format csv
+import argparse
+import asyncio
+import json
+import resource
+import time
+import uuid
+
+from sqlalchemy import insert
+
+from src.database import engine, async_session_maker
+from src.catalog.models import CategoryModel
+from src.catalog.importer import ProductImportService
+
+
+async def feed(fmt: str, prefix: str, rows: int, category_id: int, price: float, chunk_rows: int = 1000):
+    # Фид генерируется на лету кусками, как тело HTTP-запроса
+    if fmt == "csv":
+        yield b"sku,name,description,price,discount_price,stock,category_id\n"
+    for start in range(0, rows, chunk_rows):
+        lines = []
+        for i in range(start, min(start + chunk_rows, rows)):
+            if fmt == "csv":
+                lines.append(f'{prefix}-{i},Product {i},"Description, {i}",{price},,{i % 100},{category_id}\n')
+            else:
+                lines.append(json.dumps({
+                    "sku": f"{prefix}-{i}", "name": f"Product {i}", "description": f"Description, {i}",
+                    "price": price, "stock": i % 100, "category_id": category_id
+                }) + "\n")
+        yield "".join(lines).encode()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    async with async_session_maker() as session:
+        category_id = await session.scalar(
+            insert(CategoryModel).values(name=prefix).returning(CategoryModel.id))
+        await session.commit()
+
+    for run, price in (("insert", 100.0), ("unchanged", 100.0), ("update", 120.0)):
+        started = time.perf_counter()
+        report = await ProductImportService.import_products(
+            feed(args.format, prefix, args.rows, category_id, price), args.format, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{run:<10} rows={report.rows} inserted={report.inserted} updated={report.updated} "
+            f"unchanged={report.unchanged} rows/sec={report.rows / elapsed:10.0f}"
+        )
+    # ru_maxrss в килобайтах на Linux
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+# Задержка /catalog/products, пока /auth/login нагружен логинами.
+#
+# Сервер должен быть запущен отдельно (uvicorn src.main:app --port 5000),
+# в базе должен быть пользователь с указанными email/паролем.
+#
+# Запуск: python -m benchmarks.bench_login_storm --url http://localhost:5000 \
+#             --email admin@mail.ru --password 123 --logins 64 --duration 20
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+async def login_storm(client: httpx.AsyncClient, email: str, password: str, stop: asyncio.Event, statuses: dict):
+    while not stop.is_set():
+        response = await client.post("/auth/login", data={"username": email, "password": password})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def catalog_reader(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/catalog/products", params={"limit": 25})
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def measure(args, logins: int) -> tuple[list[float], dict]:
+    stop = asyncio.Event()
+    latencies: list[float] = []
+    statuses: dict = {}
+    limits = httpx.Limits(max_connections=logins + 4)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        tasks = [asyncio.create_task(login_storm(client, args.email, args.password, stop, statuses))
+                 for _ in range(logins)]
+        tasks += [asyncio.create_task(catalog_reader(client, stop, latencies))
+                  for _ in range(args.readers)]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+    return latencies, statuses
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--logins", type=int, default=64, help="параллельных логинов")
+    parser.add_argument("--readers", type=int, default=4, help="параллельных читателей каталога")
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    for logins in (0, args.logins):
+        latencies, statuses = await measure(args, logins)
+        print(
+            f"logins={logins:<4} catalog requests={len(latencies)} "
+            f"p50={statistics.median(latencies):.1f}ms p99={percentile(latencies, 0.99):.1f}ms "
+            f"login statuses={statuses}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+# Задержка страницы каталога: OFFSET/LIMIT против keyset-курсора на глубине 0 и 1M.
+#
+# Нужна база из .env с заполненной таблицей products. Для наполнения:
+#   python -m benchmarks.bench_pagination --seed 1100000
+# Запуск: python -m benchmarks.bench_pagination --depth 0 --depth 1000000
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import select, text
+
+from src.database import engine, async_session_maker
+from src.catalog.dao import ProductDAO
+from src.catalog.models import ProductModel
+from src.pagination import encode_cursor
+
+PAGE_SIZE = 25
+
+
+async def seed(rows: int):
+    async with async_session_maker() as session:
+        category_id = await session.scalar(text(
+            "INSERT INTO categories (name) VALUES ('bench') "
+            "ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name RETURNING id"
+        ))
+        await session.execute(text(
+            "INSERT INTO products (sku, name, price, discount_price, stock, category_id) "
+            "SELECT 'bench-' || g, 'Product ' || g, (random() * 10000)::numeric(10, 2), 0, 10, :category_id "
+            "FROM generate_series(1, :rows) AS g ON CONFLICT (sku) DO NOTHING"
+        ), {"rows": rows, "category_id": category_id})
+        await session.commit()
+        await session.execute(text("ANALYZE products"))
+
+
+async def timed(coro_factory, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await coro_factory()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+async def bench(depth: int, repeat: int):
+    order_by = (ProductModel.price, ProductModel.id)
+    async with async_session_maker() as session:
+        # Курсор, указывающий на строку перед нужной глубиной
+        cursor = None
+        if depth > 0:
+            row = (await session.execute(
+                select(ProductModel.price, ProductModel.id)
+                .order_by(*order_by).offset(depth - 1).limit(1)
+            )).one()
+            cursor = encode_cursor(order_by, list(row))
+
+        offset_ms = await timed(
+            lambda: ProductDAO.find_page(session, order_by=order_by, offset=depth, limit=PAGE_SIZE), repeat)
+        keyset_ms = await timed(
+            lambda: ProductDAO.find_page(session, order_by=order_by, cursor=cursor, limit=PAGE_SIZE), repeat)
+    print(f"depth={depth:<9} offset={offset_ms:8.2f}ms keyset={keyset_ms:8.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--depth", type=int, action="append")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.seed:
+        await seed(args.seed)
+    for depth in args.depth or [0, 1_000_000]:
+        await bench(depth, args.repeat)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
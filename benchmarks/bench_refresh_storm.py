@@ -0,0 +1,111 @@
+# Шторм refresh-запросов: AuthService.refresh_token из многих корутин сразу,
+# refresh/s и p50/p99 для хранилища сессий postgres или redis.
+# Для postgres дополнительно - время очистки --expired просроченных сессий sweeper-ом.
+#
+# Нужна база из .env с миграциями, для redis - REDIS_URL.
+# Запуск: python -m benchmarks.bench_refresh_storm --backend postgres --clients 64 --duration 10 --expired 200000
+#         python -m benchmarks.bench_refresh_storm --backend redis --clients 64 --duration 10
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from redis import asyncio as aioredis
+from sqlalchemy import insert, text
+
+from src.config import settings
+from src.database import engine, async_session_maker
+from src.users.models import UserModel
+from src.users.service import AuthService
+from src.users.session_store import postgres_session_store, redis_session_store
+
+
+async def create_users(count: int) -> list[UserModel]:
+    async with async_session_maker() as session:
+        users = (await session.scalars(
+            insert(UserModel).returning(UserModel),
+            [{"id": uuid.uuid4(), "email": f"bench-refresh-{uuid.uuid4()}@example.com",
+              "hashed_password": "-", "fio": "bench"} for _ in range(count)]
+        )).all()
+        await session.commit()
+    return list(users)
+
+
+async def client(user: UserModel, stop: asyncio.Event, latencies: list[float], errors: list):
+    async with async_session_maker() as session:
+        token = (await AuthService.create_token(session, user)).refresh_token
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                token = (await AuthService.refresh_token(session, token)).refresh_token
+            except Exception as e:
+                errors.append(e)
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def storm(clients: int, duration: float):
+    users = await create_users(clients)
+    stop = asyncio.Event()
+    latencies: list[float] = []
+    errors: list = []
+    tasks = [asyncio.create_task(client(user, stop, latencies, errors)) for user in users]
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    latencies.sort()
+    print(
+        f"backend={settings.REFRESH_SESSION_BACKEND} clients={clients} "
+        f"refresh/s={len(latencies) / duration:9.1f} p50={statistics.median(latencies):7.2f} ms "
+        f"p99={latencies[int(len(latencies) * 0.99) - 1]:7.2f} ms errors={len(errors)}"
+    )
+
+
+async def sweep(expired: int, batch_size: int):
+    (user,) = await create_users(1)
+    async with async_session_maker() as session:
+        await session.execute(text(
+            "INSERT INTO refresh_sessions (refresh_token, expires_in, expires_at, user_id) "
+            "SELECT gen_random_uuid(), 60, now() - interval '1 hour', :user_id FROM generate_series(1, :rows)"
+        ), {"rows": expired, "user_id": user.id})
+        await session.commit()
+
+    started = time.perf_counter()
+    batches = deleted = 0
+    while True:
+        swept = await postgres_session_store.sweep_expired(batch_size)
+        deleted += swept
+        batches += 1
+        if swept < batch_size:
+            break
+    print(f"sweep: {deleted} expired sessions in {batches} batches, {time.perf_counter() - started:.2f} s")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["postgres", "redis"], default="postgres")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--expired", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=settings.REFRESH_SESSION_SWEEP_BATCH_SIZE)
+    args = parser.parse_args()
+
+    settings.REFRESH_SESSION_BACKEND = args.backend
+    redis = None
+    if args.backend == "redis":
+        redis = aioredis.from_url(settings.REDIS_URL)
+        await redis_session_store.connect(redis)
+
+    await storm(args.clients, args.duration)
+    if args.expired and args.backend == "postgres":
+        await sweep(args.expired, args.batch_size)
+
+    if redis is not None:
+        await redis.close()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
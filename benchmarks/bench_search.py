@@ -0,0 +1,79 @@
+# Задержка поиска по товарам (ProductService.search_products): p50/p99 по набору запросов.
+#
+# Нужна база из .env с миграциями (search_vector, pg_trgm). Для наполнения 1M товаров:
+#   python -m benchmarks.bench_search --seed 1000000
+# Запуск: python -m benchmarks.bench_search --repeat 50
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+
+from src.database import engine, async_session_maker
+from src.catalog.service import ProductService
+
+WORDS = [
+    "ноутбук", "телефон", "сумка", "чехол", "кабель", "зарядка", "наушники", "колонка",
+    "монитор", "клавиатура", "мышь", "планшет", "часы", "камера", "роутер", "принтер",
+]
+ADJECTIVES = ["черный", "белый", "легкий", "игровой", "беспроводной", "компактный", "новый", "мощный"]
+
+QUERIES = ["ноутбук", "черный телефон", "беспроводные наушники", "клавиатур", "bench-12345", "моник"]
+
+
+async def seed(rows: int):
+    async with async_session_maker() as session:
+        category_id = await session.scalar(text(
+            "INSERT INTO categories (name) VALUES ('bench-search') "
+            "ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name RETURNING id"
+        ))
+        await session.execute(text(
+            "WITH dictionary AS (SELECT CAST(:words AS text[]) AS words, CAST(:adjectives AS text[]) AS adjectives) "
+            "INSERT INTO products (sku, name, description, price, discount_price, stock, category_id) "
+            "SELECT 'bench-' || g, "
+            "initcap(adjectives[1 + g % 8]) || ' ' || words[1 + (g / 8) % 16] || ' ' || g, "
+            "'Отличный ' || words[1 + (g / 3) % 16] || ' для дома и работы, ' || adjectives[1 + g % 5], "
+            "(random() * 10000)::numeric(10, 2), 0, 10, :category_id "
+            "FROM generate_series(1, :rows) AS g, dictionary ON CONFLICT (sku) DO NOTHING"
+        ), {"rows": rows, "category_id": category_id, "words": WORDS, "adjectives": ADJECTIVES})
+        await session.commit()
+        await session.execute(text("ANALYZE products"))
+
+
+async def bench(query: str, repeat: int, pages: int):
+    samples = []
+    async with async_session_maker() as session:
+        for _ in range(repeat):
+            cursor = None
+            for _ in range(pages):
+                started = time.perf_counter()
+                page = await ProductService.search_products(session, query, limit=25, cursor=cursor)
+                samples.append((time.perf_counter() - started) * 1000)
+                cursor = page.next_cursor
+                if cursor is None:
+                    break
+    samples.sort()
+    print(
+        f"q={query!r:<26} p50={statistics.median(samples):8.2f} ms "
+        f"p99={samples[int(len(samples) * 0.99) - 1]:8.2f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--query", action="append", default=None)
+    args = parser.parse_args()
+
+    if args.seed:
+        await seed(args.seed)
+    for query in args.query or QUERIES:
+        await bench(query, args.repeat, args.pages)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+# Сколько соединений из пула забирает один авторизованный запрос.
+#
+# "before" - прежняя схема: отдельная сессия в get_current_user и отдельная
+# сессия в каждом вызове сервиса. "after" - одна сессия на запрос
+# из get_async_session.
+#
+# Запуск (нужна база из .env): python -m benchmarks.bench_session_checkouts --requests 200 --concurrency 10
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import event
+
+from src.database import engine, async_session_maker, get_async_session
+from src.users.dao import UserDAO
+from src.catalog.dao import CartDAO, ProductDAO
+from src.catalog.models import CartItemModel
+
+
+class CheckoutCounter:
+    def __init__(self):
+        self.checkouts = 0
+        self.in_use = 0
+        self.max_in_use = 0
+
+    def on_checkout(self, *args):
+        self.checkouts += 1
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def on_checkin(self, *args):
+        self.in_use -= 1
+
+
+async def request_before(user_id: uuid.UUID):
+    # get_current_user -> UserService.get_user
+    async with async_session_maker() as session:
+        await UserDAO.find_one_or_none(session, id=user_id)
+    # CartService.get_cart_items
+    async with async_session_maker() as session:
+        await CartDAO.find_all(session, CartItemModel.user_uuid == user_id)
+    # ProductService.get_products
+    async with async_session_maker() as session:
+        await ProductDAO.find_all(session, limit=25)
+
+
+async def request_after(user_id: uuid.UUID):
+    sessions = get_async_session()
+    session = await anext(sessions)
+    try:
+        await UserDAO.find_one_or_none(session, id=user_id)
+        await CartDAO.find_all(session, CartItemModel.user_uuid == user_id)
+        await ProductDAO.find_all(session, limit=25)
+    finally:
+        await sessions.aclose()
+
+
+async def run(name, handler, requests: int, concurrency: int):
+    counter = CheckoutCounter()
+    pool = engine.sync_engine.pool
+    event.listen(pool, "checkout", counter.on_checkout)
+    event.listen(pool, "checkin", counter.on_checkin)
+
+    user_id = uuid.uuid4()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    event.remove(pool, "checkout", counter.on_checkout)
+    event.remove(pool, "checkin", counter.on_checkin)
+    print(
+        f"{name:<7} checkouts/request={counter.checkouts / requests:.2f} "
+        f"max_in_use={counter.max_in_use} rps={requests / elapsed:.0f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    await run("before", request_before, args.requests, args.concurrency)
+    await run("after", request_after, args.requests, args.concurrency)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
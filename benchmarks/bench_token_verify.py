@@ -0,0 +1,72 @@
+# Проверка access-токенов в одном процессе (одно ядро): tokens/s для python-jose
+# и для TokenCodec без кэша и с кэшем проверенных токенов.
+# --tokens - сколько разных токенов предъявляется по кругу (сколько активных пользователей).
+# RS256/EdDSA генерируют ключи на лету и требуют cryptography.
+#
+# Запуск: python -m benchmarks.bench_token_verify --algorithm HS256 --tokens 1000 --duration 3
+import argparse
+import time
+import uuid
+
+from jose import jwt
+
+from src.users.token_codec import TokenCodec
+
+
+def generate_keys(algorithm: str) -> tuple[str, str]:
+    if algorithm.startswith("HS"):
+        return "bench-secret", "bench-secret"
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if algorithm == "RS256":
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    return private_pem, public_pem
+
+
+def measure(name: str, decode, tokens: list[str], duration: float) -> None:
+    verified = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        for token in tokens:
+            decode(token)
+        verified += len(tokens)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<14} tokens/s per core={verified / elapsed:12.0f}  us/token={elapsed / verified * 1e6:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--algorithm", choices=["HS256", "HS384", "HS512", "RS256", "EdDSA"], default="HS256")
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--duration", type=float, default=3)
+    args = parser.parse_args()
+
+    private_key, public_key = generate_keys(args.algorithm)
+    issuer = TokenCodec(args.algorithm, private_key, public_key)
+    claims = [{"sub": str(uuid.uuid4()), "exp": int(time.time()) + 3600, "is_active": True,
+               "is_verified": True, "is_superuser": False} for _ in range(args.tokens)]
+    tokens = [issuer.encode(payload) for payload in claims]
+
+    print(f"algorithm={args.algorithm} distinct tokens={args.tokens} cache size={args.cache_size}")
+    # EdDSA python-jose не поддерживает
+    if args.algorithm != "EdDSA":
+        measure("python-jose", lambda token: jwt.decode(token, public_key, algorithms=[args.algorithm]),
+                tokens, args.duration)
+    # Проверяющая сторона знает только открытый ключ (для HS* - общий секрет)
+    verify_key = public_key if args.algorithm.startswith("HS") else ""
+    measure("codec", TokenCodec(args.algorithm, verify_key, public_key).decode, tokens, args.duration)
+    measure("codec+cache", TokenCodec(args.algorithm, verify_key, public_key, args.cache_size).decode,
+            tokens, args.duration)
+
+
+if __name__ == "__main__":
+    main()
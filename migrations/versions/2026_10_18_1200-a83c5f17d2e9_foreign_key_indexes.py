@@ -0,0 +1,41 @@
+"""foreign_key_indexes
+
+Revision ID: a83c5f17d2e9
+Revises: e61f0a8d3b25
+Create Date: 2026-10-18 12:00:03.771942
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a83c5f17d2e9'
+down_revision: Union[str, None] = 'e61f0a8d3b25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# cart_items.user_uuid покрыт cart_items_user_uuid_product_id_idx,
+# categories.parent_id и products.category_id - миграцией 91a19181a0fc
+INDEXES = (
+    ('orders_user_uuid_idx', 'orders', ['user_uuid']),
+    ('order_items_order_id_idx', 'order_items', ['order_id']),
+    ('order_items_product_id_idx', 'order_items', ['product_id']),
+    ('refresh_sessions_user_id_idx', 'refresh_sessions', ['user_id']),
+)
+
+
+def upgrade() -> None:
+    # CONCURRENTLY не блокирует запись в таблицы, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
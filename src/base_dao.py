@@ -1,12 +1,16 @@
-from typing import Any, Dict, Generic, List, Optional, TypeVar, Union
+import functools
+from typing import Any, Dict, Generic, List, Optional, Sequence, Tuple, TypeVar, Union
 
-from sqlalchemy import select, insert, update, delete
+from sqlalchemy import select, insert, update, delete, tuple_, literal
 from sqlalchemy.sql import func
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
+from loguru import logger as log
 
 from .database import async_session_maker, Base
+from .pagination import encode_cursor, decode_cursor
+from .query_monitor import query_source
 # from .logger import logger
 
 
@@ -15,16 +19,27 @@ CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+def _tracked(method):
+    # Запросы метода подписываются в отчете монитора запросов как ProductDAO.find_all и т.п.
+    @functools.wraps(method)
+    async def wrapper(cls, *args, **kwargs):
+        with query_source(f"{cls.__name__}.{method.__name__}"):
+            return await method(cls, *args, **kwargs)
+    return wrapper
+
+
 class BaseDAO(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     model = None
 
     @classmethod
+    @_tracked
     async def find_one_or_none(cls, session: AsyncSession, *filter, **filter_by) -> Optional[ModelType]:
         stmt = select(cls.model).filter(*filter).filter_by(**filter_by)
         result = await session.execute(stmt)
         return result.scalars().one_or_none()
 
     @classmethod
+    @_tracked
     async def find_all(
         cls,
         session: AsyncSession,
@@ -44,6 +59,46 @@ class BaseDAO(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         return result.scalars().all()
 
     @classmethod
+    @_tracked
+    async def find_page(
+        cls,
+        session: AsyncSession,
+        *filter,
+        order_by: Optional[Sequence[Any]] = None,
+        cursor: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 100,
+        **filter_by
+    ) -> Tuple[List[ModelType], Optional[str]]:
+        # Keyset-пагинация: order_by должен быть уникальным и индексированным,
+        # например (id,) или (price, id). Без курсора работает как offset/limit
+        order_by = tuple(order_by or (cls.model.id,))
+        stmt = (
+            select(cls.model)
+            .filter(*filter)
+            .filter_by(**filter_by)
+            .order_by(*order_by)
+        )
+        if cursor:
+            values = decode_cursor(order_by, cursor)
+            stmt = stmt.where(
+                tuple_(*order_by) > tuple_(*(literal(value, column.type) for column, value in zip(order_by, values)))
+            )
+        else:
+            stmt = stmt.offset(offset)
+        # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+        result = await session.execute(stmt.limit(limit + 1))
+        items = result.scalars().all()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            next_cursor = encode_cursor(order_by, [getattr(last, column.key) for column in order_by])
+        return items, next_cursor
+
+    @classmethod
+    @_tracked
     async def add(
         cls,
         session: AsyncSession,
@@ -70,11 +125,13 @@ class BaseDAO(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             return None
 
     @classmethod
+    @_tracked
     async def delete(cls, session: AsyncSession, *filter, **filter_by) -> None:
         stmt = delete(cls.model).filter(*filter).filter_by(**filter_by)
         await session.execute(stmt)
 
     @classmethod
+    @_tracked
     async def update(
         cls,
         session: AsyncSession,
@@ -98,6 +155,7 @@ class BaseDAO(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         return result.scalars().one()
 
     @classmethod
+    @_tracked
     async def add_bulk(cls, session: AsyncSession, data: List[Dict[str, Any]]):
         try:
             result = await session.execute(
@@ -105,33 +163,22 @@ class BaseDAO(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                 data
             )
             return result.scalars().all()
-        except (SQLAlchemyError, Exception) as e:
-            msg = ''
-            if isinstance(e, SQLAlchemyError):
-                msg = "Database Exc"
-            elif isinstance(e, Exception):
-                msg = "Unknown Exc"
-            msg += ": Cannot bulk insert data into table"
-
-            # logger.error(msg, extra={"table": cls.model.__tablename__}, exc_info=True)
-            return None
+        except SQLAlchemyError:
+            # Молча возвращать None нельзя: вызывающий не отличит ошибку от пустой вставки
+            log.exception("Database Exc: Cannot bulk insert data into table {}", cls.model.__tablename__)
+            raise
 
     @classmethod
+    @_tracked
     async def update_bulk(cls, session: AsyncSession, data: List[Dict[str, Any]]):
         try:
-            stmt = update(cls.model)
             await session.execute(update(cls.model), data)
-        except (SQLAlchemyError, Exception) as e:
-            msg = ''
-            if isinstance(e, SQLAlchemyError):
-                msg = "Database Exc"
-            elif isinstance(e, Exception):
-                msg = "Unknown Exc"
-            msg += ": Cannot bulk update data into table"
-            # logger.error(msg, extra={"table": cls.model.__tablename__}, exc_info=True)
-            return None
+        except SQLAlchemyError:
+            log.exception("Database Exc: Cannot bulk update data into table {}", cls.model.__tablename__)
+            raise
 
     @classmethod
+    @_tracked
     async def count(cls, session: AsyncSession, *filter, **filter_by):
         stmt = select(func.count()).select_from(
             cls.model).filter(*filter).filter_by(**filter_by)
@@ -0,0 +1,416 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, Type, TypeVar
+from urllib.parse import urlencode
+
+from fastapi_cache import FastAPICache
+from loguru import logger as log
+from pydantic import BaseModel
+from redis.exceptions import WatchError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .config import settings
+from .database import async_session_maker
+
+
+class TTLCache:
+    # Ограниченный LRU-кэш в памяти процесса с временем жизни записей.
+    # Рассчитан на работу внутри одного event loop, поэтому без блокировок
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Кэш ответов с инвалидацией по тегам. У каждого тега есть версия в бэкенде кэша,
+# версии тегов входят в ключ ответа. Инвалидация меняет версию, и старые ключи
+# больше не читаются, а сами протухают по expire
+def _tag_key(tag: str) -> str:
+    return f"{FastAPICache.get_prefix()}:tag:{tag}"
+
+
+async def _tag_version(tag: str) -> str:
+    version = await FastAPICache.get_backend().get(_tag_key(tag))
+    if version is None:
+        return "0"
+    return version.decode() if isinstance(version, bytes) else str(version)
+
+
+def tagged_key_builder(*tags: str) -> Callable:
+    # Теги могут ссылаться на path-параметры: "product:{product_id}"
+    async def key_builder(
+            func: Callable,
+            namespace: str = "",
+            *,
+            request: Optional[Request] = None,
+            response: Optional[Response] = None,
+            args: tuple = (),
+            kwargs: Optional[dict] = None,
+    ) -> str:
+        path_params = request.path_params if request else {}
+        versions = [await _tag_version(tag.format(**path_params)) for tag in tags]
+        if request is not None:
+            query = urlencode(sorted(request.query_params.multi_items()))
+            target = f"{request.url.path}?{query}"
+        else:
+            target = f"{func.__module__}.{func.__name__}:{sorted((kwargs or {}).items())}"
+        return f"{namespace}:{target}:{'.'.join(versions)}"
+
+    return key_builder
+
+
+async def invalidate_tags(*tags: str) -> None:
+    if not FastAPICache._init:
+        return
+    version = str(time.time_ns()).encode()
+    # Версия тега должна жить дольше любого ответа, закэшированного под старой версией
+    expire = settings.CACHE_EXPIRE_SECONDS * 2
+    backend = FastAPICache.get_backend()
+    for tag in tags:
+        await backend.set(_tag_key(tag), version, expire)
+
+
+class InvalidationBus:
+    # Рассылка инвалидаций всем воркерам через redis pub/sub.
+    # Пока redis не подключен (тесты, CACHE_BACKEND=memory) сообщения
+    # доставляются только подписчикам текущего процесса
+    def __init__(self, channel: str):
+        self.channel = channel
+        self._handlers: List[Callable[[str], None]] = []
+        self._redis = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    def subscribe(self, handler: Callable[[str], None]) -> None:
+        self._handlers.append(handler)
+
+    async def connect(self, redis) -> None:
+        self._redis = redis
+        self._pubsub = redis.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.close()
+            self._pubsub = None
+        self._redis = None
+
+    async def publish(self, message: str) -> None:
+        if self._redis is None:
+            self._dispatch(message)
+        else:
+            await self._redis.publish(self.channel, message)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Invalidation bus connection error")
+                await asyncio.sleep(1)
+                continue
+            if message is not None:
+                data = message["data"]
+                self._dispatch(data.decode() if isinstance(data, bytes) else data)
+
+    def _dispatch(self, message: str) -> None:
+        for handler in self._handlers:
+            try:
+                handler(message)
+            except Exception:
+                log.exception("Invalidation handler failed for {}", message)
+
+
+invalidation_bus = InvalidationBus("cache-invalidation")
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.l2_hits = 0
+        self.loads = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+SchemaType = TypeVar("SchemaType", bound=BaseModel)
+
+
+class TwoTierCache(Generic[SchemaType]):
+    # L1 - ограниченный LRU в памяти воркера, L2 - общий redis.
+    # Одновременные промахи по одному ключу грузят значение из базы один раз.
+    # У ключа L2 есть версия, которую увеличивает каждая инвалидация: загрузка пишет
+    # в L2, только если версия не поменялась с момента, когда она начала читать
+    registry: Dict[str, "TwoTierCache"] = {}
+    l2 = None
+
+    def __init__(
+            self,
+            name: str,
+            schema: Type[SchemaType],
+            load: Callable[[AsyncSession, Any], Awaitable[Optional[Any]]],
+            maxsize: int = settings.L1_CACHE_MAX_SIZE,
+            ttl: float = settings.L1_CACHE_TTL_SECONDS,
+            stale_ttl: float = settings.L1_CACHE_STALE_SECONDS,
+            l2_ttl: int = settings.L2_CACHE_TTL_SECONDS,
+    ):
+        self.name = name
+        self.schema = schema
+        self.load = load
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.l2_ttl = l2_ttl
+        self.stats = CacheStats()
+        self._l1: OrderedDict[str, tuple[float, SchemaType]] = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        # Меняется при каждой инвалидации: загрузка, начатая до нее, не попадет в L1
+        self._epoch = 0
+        TwoTierCache.registry[name] = self
+
+    async def get(self, session: AsyncSession, key: Any) -> Optional[SchemaType]:
+        key = str(key)
+        entry = self._l1.get(key)
+        if entry is not None:
+            loaded_at, value = entry
+            age = time.monotonic() - loaded_at
+            if age < self.ttl:
+                self.stats.hits += 1
+                self._l1.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stats.stale_hits += 1
+                self._refresh_in_background(key)
+                return value
+            del self._l1[key]
+        self.stats.misses += 1
+        return await self._load(session, key)
+
+    async def invalidate(self, key: Any) -> None:
+        key = str(key)
+        self.drop_local(key)
+        await self._invalidate_l2([key])
+        await invalidation_bus.publish(f"{self.name}:{key}")
+
+    async def invalidate_many(self, keys: List[Any]) -> None:
+        # Для массовых изменений: одно удаление в L2 и одно сообщение,
+        # по которому остальные воркеры сбрасывают L1 целиком
+        if not keys:
+            return
+        keys = [str(key) for key in keys]
+        for key in keys:
+            self.drop_local(key)
+        await self._invalidate_l2(keys)
+        await invalidation_bus.publish(f"{self.name}:*")
+
+    def drop_local(self, key: str) -> None:
+        self._epoch += 1
+        self._l1.pop(key, None)
+
+    def clear_local(self) -> None:
+        self._epoch += 1
+        self._l1.clear()
+
+    def _l2_key(self, key: str) -> str:
+        return f"entity-cache:{self.name}:{key}"
+
+    def _l2_version_key(self, key: str) -> str:
+        return f"entity-cache-version:{self.name}:{key}"
+
+    async def _invalidate_l2(self, keys: List[str]) -> None:
+        if TwoTierCache.l2 is None:
+            return
+        async with TwoTierCache.l2.pipeline(transaction=True) as pipe:
+            for key in keys:
+                pipe.delete(self._l2_key(key))
+                pipe.incr(self._l2_version_key(key))
+                # Версия должна пережить загрузки, начатые до инвалидации
+                pipe.expire(self._l2_version_key(key), self.l2_ttl)
+            await pipe.execute()
+
+    async def _load(self, session: AsyncSession, key: str) -> Optional[SchemaType]:
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Отменили запрос, начавший загрузку (клиент отключился), а не нас:
+                # грузим сами, а не отдаем чужую отмену
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await self._load(session, key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        epoch = self._epoch
+        try:
+            value, version = await self._read_l2(key)
+            if value is None:
+                self.stats.loads += 1
+                loaded = await self.load(session, key)
+                if loaded is not None:
+                    value = self.schema.model_validate(loaded, from_attributes=True)
+                    await self._write_l2(key, value, version, epoch)
+            if value is not None:
+                self._store(key, value, epoch)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим, само future никто может не читать
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _store(self, key: str, value: SchemaType, epoch: int) -> None:
+        if epoch != self._epoch:
+            return
+        self._l1[key] = (time.monotonic(), value)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.maxsize:
+            self._l1.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def _read_l2(self, key: str) -> tuple[Optional[SchemaType], Optional[bytes]]:
+        # Значение и версия ключа одним MGET
+        if TwoTierCache.l2 is None:
+            return None, None
+        try:
+            raw, version = await TwoTierCache.l2.mget(self._l2_key(key), self._l2_version_key(key))
+        except Exception:
+            log.warning("L2 cache read failed for {}:{}", self.name, key)
+            return None, None
+        if raw is None:
+            return None, version
+        self.stats.l2_hits += 1
+        return self.schema.model_validate_json(raw), version
+
+    async def _read_l2_version(self, key: str) -> Optional[bytes]:
+        if TwoTierCache.l2 is None:
+            return None
+        try:
+            return await TwoTierCache.l2.get(self._l2_version_key(key))
+        except Exception:
+            log.warning("L2 cache read failed for {}:{}", self.name, key)
+            return None
+
+    async def _write_l2(self, key: str, value: SchemaType, version: Optional[bytes], epoch: int) -> None:
+        # Инвалидация во время загрузки: в этом воркере видна по epoch, в других - по версии
+        if TwoTierCache.l2 is None or epoch != self._epoch:
+            return
+        version_key = self._l2_version_key(key)
+        try:
+            async with TwoTierCache.l2.pipeline(transaction=True) as pipe:
+                await pipe.watch(version_key)
+                if await pipe.get(version_key) != version:
+                    return
+                pipe.multi()
+                pipe.set(self._l2_key(key), value.model_dump_json(), ex=self.l2_ttl)
+                await pipe.execute()
+        except WatchError:
+            pass
+        except Exception:
+            log.warning("L2 cache write failed for {}:{}", self.name, key)
+
+    def _refresh_in_background(self, key: str) -> None:
+        if key in self._inflight or key in self._refreshing:
+            return
+        epoch = self._epoch
+
+        async def refresh():
+            # Сессия запроса к этому моменту может быть уже закрыта - берем свою
+            version = await self._read_l2_version(key)
+            async with async_session_maker() as session:
+                try:
+                    # L2 мог протухнуть не одновременно с L1, поэтому грузим из базы
+                    self.stats.loads += 1
+                    loaded = await self.load(session, key)
+                except Exception:
+                    log.exception("Background refresh failed for {}:{}", self.name, key)
+                    return
+            if loaded is None:
+                self._l1.pop(key, None)
+                return
+            value = self.schema.model_validate(loaded, from_attributes=True)
+            self._store(key, value, epoch)
+            await self._write_l2(key, value, version, epoch)
+
+        task = asyncio.create_task(refresh())
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+
+def _on_entity_invalidation(message: str) -> None:
+    name, _, key = message.partition(":")
+    cache = TwoTierCache.registry.get(name)
+    if cache is None:
+        return
+    if key == "*":
+        cache.clear_local()
+    else:
+        cache.drop_local(key)
+
+
+invalidation_bus.subscribe(_on_entity_invalidation)
+
+
+async def init_entity_caches(redis=None) -> None:
+    TwoTierCache.l2 = redis
+    if redis is not None:
+        await invalidation_bus.connect(redis)
+
+
+async def close_entity_caches() -> None:
+    await invalidation_bus.close()
+    TwoTierCache.l2 = None
@@ -0,0 +1,231 @@
+import asyncio
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger as log
+from redis.exceptions import ResponseError, WatchError
+from sqlalchemy import delete, insert, select, func, any_, literal, ARRAY, UUID, Integer, Float
+
+from .models import CartItemModel, ProductModel
+from .schemas import CartItem
+from ..config import settings
+from ..database import async_session_maker
+from ..users.models import UserModel
+
+
+class RedisCartStore:
+    # Корзина пользователя - один hash: q:<product_id> - количество, p:<product_id> - цена,
+    # v:<product_id> - price_version товара. В этом режиме id строки корзины равен product_id
+    dirty_key = "cart-dirty"
+
+    def __init__(self, prefix: str = "cart"):
+        self.prefix = prefix
+        self.redis = None
+        self._write_behind: Optional[asyncio.Task] = None
+
+    def _key(self, user_id) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    @staticmethod
+    def _items(user_id, data: dict) -> List[CartItem]:
+        prices = {}
+        versions = {}
+        quantities = {}
+        for field, value in data.items():
+            kind, _, product_id = (field.decode() if isinstance(field, bytes) else field).partition(":")
+            if kind == "q":
+                quantities[int(product_id)] = int(value)
+            elif kind == "p":
+                prices[int(product_id)] = float(value)
+            elif kind == "v":
+                versions[int(product_id)] = int(value)
+        return [
+            CartItem(id=product_id, user_uuid=user_id, product_id=product_id, quantity=quantity,
+                     price=prices.get(product_id, 0.0), price_version=versions.get(product_id, 0))
+            for product_id, quantity in sorted(quantities.items()) if quantity > 0
+        ]
+
+    def _touch(self, pipe, user_id) -> None:
+        pipe.expire(self._key(user_id), settings.CART_TTL_SECONDS)
+        if settings.CART_WRITE_BEHIND:
+            pipe.sadd(self.dirty_key, str(user_id))
+
+    async def get(self, user_id) -> List[CartItem]:
+        return self._items(user_id, await self.redis.hgetall(self._key(user_id)))
+
+    async def add(self, user_id, product_id: int, quantity: int, price: float, price_version: int) -> CartItem:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(self._key(user_id), f"q:{product_id}", quantity)
+            pipe.hset(self._key(user_id), mapping={f"p:{product_id}": price, f"v:{product_id}": price_version})
+            self._touch(pipe, user_id)
+            total, *_ = await pipe.execute()
+        return CartItem(id=product_id, user_uuid=user_id, product_id=product_id, quantity=total,
+                        price=price, price_version=price_version)
+
+    async def replace(self, user_id, items: List[CartItem]) -> List[CartItem]:
+        key = self._key(user_id)
+        fields = {}
+        for item in items:
+            fields[f"q:{item.product_id}"] = item.quantity
+            fields[f"p:{item.product_id}"] = item.price
+            fields[f"v:{item.product_id}"] = item.price_version
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if fields:
+                pipe.hset(key, mapping=fields)
+            self._touch(pipe, user_id)
+            await pipe.execute()
+        return items
+
+    async def set_prices(self, user_id, prices: Dict[int, Tuple[float, int]]) -> None:
+        # Новый снимок цен для строк, которые еще есть в корзине
+        key = self._key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    fields = {}
+                    for product_id, (price, price_version) in prices.items():
+                        if await pipe.hexists(key, f"q:{product_id}"):
+                            fields[f"p:{product_id}"] = price
+                            fields[f"v:{product_id}"] = price_version
+                    pipe.multi()
+                    if fields:
+                        pipe.hset(key, mapping=fields)
+                    self._touch(pipe, user_id)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    async def set_quantity(self, user_id, product_id: int, quantity: int) -> Optional[CartItem]:
+        key = self._key(user_id)
+        # Оптимистичная транзакция: количество меняется, только если строка еще есть
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    price, price_version = await pipe.hmget(key, f"p:{product_id}", f"v:{product_id}")
+                    if not await pipe.hexists(key, f"q:{product_id}"):
+                        return None
+                    pipe.multi()
+                    pipe.hset(key, f"q:{product_id}", quantity)
+                    self._touch(pipe, user_id)
+                    await pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        return CartItem(id=product_id, user_uuid=user_id, product_id=product_id, quantity=quantity,
+                        price=float(price or 0), price_version=int(price_version or 0))
+
+    async def remove(self, user_id, product_id: int) -> bool:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._key(user_id), f"q:{product_id}", f"p:{product_id}", f"v:{product_id}")
+            self._touch(pipe, user_id)
+            removed, *_ = await pipe.execute()
+        return removed > 0
+
+    async def take(self, user_id) -> Tuple[str, List[CartItem]]:
+        # Корзина атомарно переименовывается: добавления во время checkout
+        # попадут в новую корзину, а повторный checkout увидит пустую
+        checkout_key = f"{self._key(user_id)}:checkout:{uuid.uuid4().hex}"
+        try:
+            await self.redis.rename(self._key(user_id), checkout_key)
+        except ResponseError:
+            return checkout_key, []
+        return checkout_key, self._items(user_id, await self.redis.hgetall(checkout_key))
+
+    async def restore(self, user_id, checkout_key: str, items: List[CartItem]) -> None:
+        # Checkout не удался - возвращаем строки, не затирая то, что добавили за это время
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for item in items:
+                pipe.hincrby(self._key(user_id), f"q:{item.product_id}", item.quantity)
+                pipe.hsetnx(self._key(user_id), f"p:{item.product_id}", item.price)
+                pipe.hsetnx(self._key(user_id), f"v:{item.product_id}", item.price_version)
+            pipe.delete(checkout_key)
+            self._touch(pipe, user_id)
+            await pipe.execute()
+
+    async def discard(self, user_id, checkout_key: str) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(checkout_key)
+            if settings.CART_WRITE_BEHIND:
+                pipe.sadd(self.dirty_key, str(user_id))
+            await pipe.execute()
+
+    async def flush_dirty(self, batch_size: int) -> int:
+        # Write-behind: копия измененных корзин в cart_items, пачкой пользователей за транзакцию
+        user_ids = await self.redis.spop(self.dirty_key, batch_size)
+        if not user_ids:
+            return 0
+        user_ids = [uuid.UUID(user_id.decode() if isinstance(user_id, bytes) else user_id)
+                    for user_id in user_ids]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(self._key(user_id))
+            carts = await pipe.execute()
+
+        items = [item for user_id, data in zip(user_ids, carts) for item in self._items(user_id, data)]
+        # Товар или пользователь могли быть удалены после того, как строка попала в redis:
+        # такие строки отбрасываются join-ом, иначе FK уронил бы всю пачку
+        lines = select(
+            func.unnest(literal([item.user_uuid for item in items], ARRAY(UUID))).label("user_uuid"),
+            func.unnest(literal([item.product_id for item in items], ARRAY(Integer))).label("product_id"),
+            func.unnest(literal([item.quantity for item in items], ARRAY(Integer))).label("quantity"),
+            func.unnest(literal([item.price for item in items], ARRAY(Float))).label("price"),
+            func.unnest(literal([item.price_version for item in items], ARRAY(Integer))).label("price_version"),
+        ).cte("lines")
+        try:
+            async with async_session_maker() as session:
+                await session.execute(
+                    delete(CartItemModel)
+                    .where(CartItemModel.user_uuid == any_(literal(user_ids, ARRAY(UUID))))
+                )
+                if items:
+                    await session.execute(
+                        insert(CartItemModel).from_select(
+                            ["user_uuid", "product_id", "quantity", "price", "price_version"],
+                            select(lines.c.user_uuid, lines.c.product_id, lines.c.quantity,
+                                   lines.c.price, lines.c.price_version)
+                            .join(ProductModel, ProductModel.id == lines.c.product_id)
+                            .join(UserModel, UserModel.id == lines.c.user_uuid)
+                        )
+                    )
+                await session.commit()
+        except Exception:
+            # Не потеряем изменения: пользователи снова помечаются к записи
+            await self.redis.sadd(self.dirty_key, *(str(user_id) for user_id in user_ids))
+            raise
+        return len(user_ids)
+
+    async def _run_write_behind(self) -> None:
+        while True:
+            try:
+                while await self.flush_dirty(settings.CART_WRITE_BEHIND_BATCH_SIZE) == \
+                        settings.CART_WRITE_BEHIND_BATCH_SIZE:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Cart write-behind failed")
+            await asyncio.sleep(settings.CART_WRITE_BEHIND_INTERVAL_SECONDS)
+
+    async def connect(self, redis) -> None:
+        self.redis = redis
+        if settings.CART_WRITE_BEHIND:
+            self._write_behind = asyncio.create_task(self._run_write_behind())
+
+    async def close(self) -> None:
+        if self._write_behind is not None:
+            self._write_behind.cancel()
+            self._write_behind = None
+            # Последняя запись перед остановкой воркера
+            try:
+                while await self.flush_dirty(settings.CART_WRITE_BEHIND_BATCH_SIZE):
+                    pass
+            except Exception:
+                log.exception("Cart write-behind failed on shutdown")
+        self.redis = None
+
+
+cart_store = RedisCartStore()
@@ -0,0 +1,10 @@
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .loaders import ProductLoader
+from ..database import get_async_session
+
+
+async def get_product_loader(session: AsyncSession = Depends(get_async_session)) -> ProductLoader:
+    # FastAPI кэширует зависимость в пределах запроса - один загрузчик на запрос
+    return ProductLoader(session)
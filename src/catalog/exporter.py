@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, Literal, Optional
+
+from sqlalchemy import select, any_, literal, ARRAY, Integer
+
+from .models import ProductModel
+from .tree import category_tree
+from ..config import settings
+from ..database import async_session_maker
+
+
+ExportFormat = Literal["csv", "ndjson"]
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+EXPORT_COLUMNS = ("id", "sku", "name", "description", "price", "discount_price", "stock", "category_id")
+
+
+class ProductExportService:
+    @classmethod
+    async def export_products(
+            cls,
+            format: ExportFormat,
+            category_id: Optional[int] = None,
+            with_category_path: bool = False,
+    ) -> AsyncIterator[bytes]:
+        # Генератор отдается в StreamingResponse, поэтому сессию открывает сам:
+        # сессия из Depends закрывается раньше, чем начнется отправка тела
+        tree = category_tree.tree
+        if (category_id is not None or with_category_path) and tree is None:
+            tree = await category_tree.reload()
+
+        # Только колонки таблицы, без ORM-объектов и identity map
+        query = select(*(ProductModel.__table__.c[column] for column in EXPORT_COLUMNS)).order_by(ProductModel.id)
+        if category_id is not None:
+            query = query.where(ProductModel.category_id == any_(
+                literal(sorted(tree.descendant_ids(category_id)), ARRAY(Integer))))
+
+        columns = EXPORT_COLUMNS + (("category_path",) if with_category_path else ())
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue().encode()
+
+        async with async_session_maker() as session:
+            # Серверный курсор: из базы за раз приходит EXPORT_CHUNK_ROWS строк,
+            # каждая пачка сразу кодируется в один кусок ответа
+            result = await session.stream(
+                query.execution_options(yield_per=settings.EXPORT_CHUNK_ROWS))
+            async for rows in result.partitions():
+                if with_category_path:
+                    rows = [(*row, tree.path_names(row.category_id)) for row in rows]
+                if format == "csv":
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows(rows)
+                    yield buffer.getvalue().encode()
+                else:
+                    yield "".join(
+                        json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+                    ).encode()
@@ -0,0 +1,232 @@
+from bisect import bisect_right
+from collections import Counter
+from types import SimpleNamespace
+from typing import Optional
+
+from sqlalchemy import (select, delete, func, literal, literal_column, and_, true, tuple_, text, any_,
+                        ARRAY, Integer, Float, JSON)
+from sqlalchemy.dialects.postgresql import insert as pg_insert, aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import ProductModel, ProductFacetCountModel
+from .schemas import (Product, ProductFacetFilter, FacetedProductsPage, ProductFacets,
+                      PriceBucketFacet, CategoryFacet)
+from .tree import category_tree
+from ..config import settings
+from ..constants import PRICE_BUCKETS
+from ..database import async_session_maker
+from ..pagination import encode_cursor, decode_cursor
+
+
+def _price_bucket(price):
+    return func.width_bucket(price, literal(list(PRICE_BUCKETS), ARRAY(Float)))
+
+
+def facet_key(product) -> tuple:
+    # Тот же ключ, что считает _price_bucket и live-запрос фасетов
+    return (
+        product.category_id,
+        bisect_right(PRICE_BUCKETS, product.price),
+        product.stock > 0,
+        (product.discount_price or 0) > 0,
+    )
+
+
+class FacetService:
+    @classmethod
+    async def get_faceted_products(
+            cls,
+            session: AsyncSession,
+            filters: ProductFacetFilter,
+            limit: int = 25,
+            cursor: Optional[str] = None,
+    ) -> FacetedProductsPage:
+        tree = category_tree.tree or await category_tree.reload()
+        category_ids = None
+        if filters.category_id is not None:
+            category_ids = literal(sorted(tree.descendant_ids(filters.category_id)), ARRAY(Integer))
+
+        price_ok = true()
+        if filters.price_min is not None:
+            price_ok = and_(price_ok, ProductModel.price >= filters.price_min)
+        if filters.price_max is not None:
+            price_ok = and_(price_ok, ProductModel.price <= filters.price_max)
+        in_stock = ProductModel.stock > 0
+        has_discount = func.coalesce(ProductModel.discount_price, 0) > 0
+
+        # Страница товаров со всеми фильтрами, keyset по id
+        order_by = (ProductModel.id,)
+        page = select(
+            ProductModel.id, ProductModel.sku, ProductModel.name, ProductModel.description,
+            ProductModel.price, ProductModel.discount_price, ProductModel.stock, ProductModel.category_id
+        ).where(price_ok)
+        if filters.in_stock:
+            page = page.where(in_stock)
+        if filters.has_discount:
+            page = page.where(has_discount)
+        if category_ids is not None:
+            page = page.where(ProductModel.category_id == any_(category_ids))
+        if cursor:
+            page = page.where(ProductModel.id > decode_cursor(order_by, cursor)[0])
+        page = page.order_by(ProductModel.id).limit(limit + 1).cte("page")
+
+        # Источник счетчиков: по строке на товар или готовые счетчики из product_facet_counts
+        if settings.FACET_COUNTS_ENABLED and filters.price_min is None and filters.price_max is None:
+            scope = select(
+                ProductFacetCountModel.category_id,
+                ProductFacetCountModel.price_bucket,
+                ProductFacetCountModel.in_stock,
+                ProductFacetCountModel.has_discount,
+                ProductFacetCountModel.product_count.label("n"),
+                true().label("price_ok"),
+            )
+            scope_category = ProductFacetCountModel.category_id
+        else:
+            scope = select(
+                ProductModel.category_id,
+                _price_bucket(ProductModel.price).label("price_bucket"),
+                in_stock.label("in_stock"),
+                has_discount.label("has_discount"),
+                literal(1).label("n"),
+                price_ok.label("price_ok"),
+            )
+            scope_category = ProductModel.category_id
+        if category_ids is not None:
+            scope = scope.where(scope_category == any_(category_ids))
+        scope = scope.cte("scope")
+
+        # Все фасеты одним проходом: GROUPING SETS по категории и ценовой корзине,
+        # а фильтры, которые фасет не должен учитывать, снимаются через FILTER
+        stock_ok = scope.c.in_stock if filters.in_stock else true()
+        discount_ok = scope.c.has_discount if filters.has_discount else true()
+        counts = (
+            select(
+                scope.c.category_id,
+                scope.c.price_bucket,
+                func.grouping(scope.c.category_id, scope.c.price_bucket).label("level"),
+                func.sum(scope.c.n).filter(and_(scope.c.price_ok, stock_ok, discount_ok)).label("total"),
+                func.sum(scope.c.n).filter(and_(stock_ok, discount_ok)).label("by_price"),
+                func.sum(scope.c.n).filter(and_(scope.c.price_ok, discount_ok, scope.c.in_stock)).label("in_stock"),
+                func.sum(scope.c.n).filter(and_(scope.c.price_ok, stock_ok, scope.c.has_discount)).label("has_discount"),
+            )
+            .group_by(func.grouping_sets(scope.c.category_id, scope.c.price_bucket, tuple_()))
+            .cte("counts")
+        )
+
+        query = select(
+            select(func.coalesce(
+                func.json_agg(aggregate_order_by(literal_column("page"), page.c.id)),
+                text("'[]'::json"),
+                type_=JSON
+            )).select_from(page).scalar_subquery(),
+            select(func.coalesce(
+                func.json_agg(literal_column("counts")),
+                text("'[]'::json"),
+                type_=JSON
+            )).select_from(counts).scalar_subquery(),
+        )
+        items, counts = (await session.execute(query)).one()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(order_by, [items[-1]["id"]])
+        return FacetedProductsPage(
+            items=[Product.model_validate(item) for item in items],
+            next_cursor=next_cursor,
+            total=next((row["total"] or 0 for row in counts if row["level"] == 3), 0),
+            facets=cls._build_facets(tree, filters, counts),
+        )
+
+    @staticmethod
+    def _build_facets(tree, filters: ProductFacetFilter, counts: list[dict]) -> ProductFacets:
+        # level - битовая маска grouping(): 1 - строка по категории, 2 - по корзине, 3 - общий итог
+        by_category = {row["category_id"]: row["total"] or 0 for row in counts if row["level"] == 1}
+        by_bucket = {row["price_bucket"]: row["by_price"] or 0 for row in counts if row["level"] == 2}
+        overall = next((row for row in counts if row["level"] == 3), {})
+
+        bounds = (None, *PRICE_BUCKETS, None)
+        price = [
+            PriceBucketFacet(price_min=bounds[bucket], price_max=bounds[bucket + 1], count=count)
+            for bucket, count in sorted(by_bucket.items()) if count
+        ]
+
+        # Категории следующего уровня с товарами всего их поддерева
+        parent = tree.nodes.get(filters.category_id) if filters.category_id is not None else None
+        categories = []
+        for category_id in (parent.children if parent is not None else tree.roots):
+            count = sum(by_category.get(id, 0) for id in tree.descendant_ids(category_id))
+            if count:
+                categories.append(CategoryFacet(id=category_id, name=tree.nodes[category_id].name, count=count))
+
+        return ProductFacets(
+            price=price,
+            categories=categories,
+            in_stock=overall.get("in_stock") or 0,
+            has_discount=overall.get("has_discount") or 0,
+        )
+
+    @classmethod
+    async def record_product_change(cls, session: AsyncSession, old=None, new=None) -> None:
+        # Инкрементальное обновление счетчиков в транзакции, меняющей товар
+        if not settings.FACET_COUNTS_ENABLED:
+            return
+        deltas = Counter()
+        if old is not None:
+            deltas[facet_key(old)] -= 1
+        if new is not None:
+            deltas[facet_key(new)] += 1
+        await cls._apply_deltas(session, deltas)
+
+    @classmethod
+    async def record_stock_changes(cls, session: AsyncSession, changes: list[dict]) -> None:
+        # Остатки, списанные checkout-ом: строки reserved с остатком до и после списания
+        if not settings.FACET_COUNTS_ENABLED:
+            return
+        deltas = Counter()
+        for change in changes:
+            product = SimpleNamespace(**change)
+            deltas[facet_key(product)] += 1
+            product.stock = change["old_stock"]
+            deltas[facet_key(product)] -= 1
+        await cls._apply_deltas(session, deltas)
+
+    @staticmethod
+    async def _apply_deltas(session: AsyncSession, deltas: Counter) -> None:
+        rows = [
+            {"category_id": key[0], "price_bucket": key[1], "in_stock": key[2],
+             "has_discount": key[3], "product_count": delta}
+            for key, delta in deltas.items() if delta
+        ]
+        if not rows:
+            return
+        stmt = pg_insert(ProductFacetCountModel).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                ProductFacetCountModel.category_id, ProductFacetCountModel.price_bucket,
+                ProductFacetCountModel.in_stock, ProductFacetCountModel.has_discount
+            ],
+            set_={"product_count": ProductFacetCountModel.product_count + stmt.excluded.product_count}
+        )
+        await session.execute(stmt)
+
+    @classmethod
+    async def rebuild_counts(cls) -> None:
+        # Полный пересчет после массовых изменений (импорт). Блокировка не дает
+        # параллельным инкрементам потеряться между DELETE и INSERT
+        if not settings.FACET_COUNTS_ENABLED:
+            return
+        async with async_session_maker() as session:
+            await session.execute(text("LOCK TABLE product_facet_counts IN EXCLUSIVE MODE"))
+            await session.execute(delete(ProductFacetCountModel))
+            bucket = _price_bucket(ProductModel.price)
+            in_stock = ProductModel.stock > 0
+            has_discount = func.coalesce(ProductModel.discount_price, 0) > 0
+            await session.execute(
+                pg_insert(ProductFacetCountModel).from_select(
+                    ["category_id", "price_bucket", "in_stock", "has_discount", "product_count"],
+                    select(ProductModel.category_id, bucket, in_stock, has_discount, func.count())
+                    .group_by(ProductModel.category_id, bucket, in_stock, has_discount)
+                )
+            )
+            await session.commit()
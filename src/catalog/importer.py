@@ -0,0 +1,229 @@
+import codecs
+import csv
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Tuple, Union
+
+from loguru import logger as log
+from pydantic import ValidationError
+from sqlalchemy import (Table, MetaData, Column, Integer, String, Float,
+                        select, exists, text, tuple_, literal_column)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .models import ProductModel, CategoryModel, next_price_version
+from .schemas import ProductImportRow, ImportRowError, ImportReport
+from .service import product_cache
+from .facets import FacetService
+from ..cache import invalidate_tags
+from ..config import settings
+from ..database import engine
+from ..exceptions import InvalidImportFileException
+
+
+ImportFormat = Literal["csv", "ndjson"]
+
+PRODUCT_COLUMNS = ("sku", "name", "description", "price", "discount_price", "stock", "category_id")
+UPDATE_COLUMNS = PRODUCT_COLUMNS[1:]
+
+# Временная таблица живет столько же, сколько соединение импорта.
+# Строки в нее заливаются через COPY, а в products попадают одним upsert
+staging = Table(
+    "products_import",
+    MetaData(),
+    Column("line", Integer),
+    Column("sku", String),
+    Column("name", String),
+    Column("description", String),
+    Column("price", Float),
+    Column("discount_price", Float),
+    Column("stock", Integer),
+    Column("category_id", Integer),
+    prefixes=["TEMPORARY"],
+)
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    # Тело запроса читается по кускам, в памяти держим только недочитанную строку
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    tail = ""
+    number = 0
+    async for chunk in chunks:
+        parts = (tail + decoder.decode(chunk)).split("\n")
+        tail = parts.pop()
+        if len(tail) > settings.IMPORT_MAX_LINE_LENGTH:
+            raise InvalidImportFileException(f"line {number + 1} is too long")
+        for line in parts:
+            number += 1
+            yield number, line.rstrip("\r")
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield number + 1, tail.rstrip("\r")
+
+
+async def _ndjson_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Union[Dict[str, Any], str]]]:
+    async for number, line in _lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        yield number, row if isinstance(row, dict) else "Row must be a JSON object"
+
+
+async def _csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Union[Dict[str, Any], str]]]:
+    header: Optional[List[str]] = None
+    record, start = "", 0
+    async for number, line in _lines(chunks):
+        # Поле в кавычках может содержать перевод строки: копим строки,
+        # пока число кавычек в записи не станет четным
+        record = f"{record}\n{line}" if record else line
+        start = start or number
+        if record.count('"') % 2:
+            if len(record) > settings.IMPORT_MAX_LINE_LENGTH:
+                raise InvalidImportFileException(f"record at line {start} is too long")
+            continue
+        values = next(csv.reader([record]), [])
+        record_start, record, start = start, "", 0
+        if not values:
+            continue
+        if header is None:
+            header = [value.strip() for value in values]
+            missing = {"sku", "name", "price", "stock", "category_id"} - set(header)
+            if missing:
+                raise InvalidImportFileException(f"missing columns {', '.join(sorted(missing))}")
+            continue
+        if len(values) != len(header):
+            yield record_start, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        # Пустая ячейка CSV - отсутствующее значение
+        yield record_start, {key: value for key, value in zip(header, values) if value != ""}
+    if record:
+        yield start, "Unterminated quoted field"
+
+
+class ProductImportService:
+    @classmethod
+    async def import_products(
+            cls,
+            chunks: AsyncIterator[bytes],
+            format: ImportFormat,
+            batch_size: Optional[int] = None,
+    ) -> ImportReport:
+        batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        rows = _csv_rows(chunks) if format == "csv" else _ndjson_rows(chunks)
+        report = ImportReport()
+        started = time.perf_counter()
+
+        # Отдельное соединение на весь импорт: временная таблица привязана к нему
+        async with engine.connect() as connection:
+            await connection.run_sync(staging.create)
+            await connection.commit()
+
+            # Внутри пачки sku уникален (последняя строка побеждает) - иначе
+            # ON CONFLICT DO UPDATE не сможет обновить одну строку дважды
+            batch: Dict[str, Tuple[int, ProductImportRow]] = {}
+            async for number, row in rows:
+                report.rows += 1
+                if isinstance(row, str):
+                    cls._reject(report, number, None, row)
+                    continue
+                try:
+                    product = ProductImportRow.model_validate(row)
+                except ValidationError as e:
+                    error = "; ".join(
+                        f"{'.'.join(map(str, item['loc']))}: {item['msg']}" for item in e.errors())
+                    cls._reject(report, number, row.get("sku"), error)
+                    continue
+                if product.sku in batch:
+                    report.duplicates += 1
+                batch[product.sku] = (number, product)
+                if len(batch) >= batch_size:
+                    await cls._flush(connection, batch, report)
+                    batch = {}
+            if batch:
+                await cls._flush(connection, batch, report)
+
+        if report.inserted or report.updated:
+            await FacetService.rebuild_counts()
+        await invalidate_tags("products", "products-import")
+        report.seconds = round(time.perf_counter() - started, 3)
+        log.info(
+            "Products import: {} rows, {} inserted, {} updated, {} rejected in {}s",
+            report.rows, report.inserted, report.updated, report.rejected, report.seconds
+        )
+        return report
+
+    @classmethod
+    async def _flush(
+            cls,
+            connection: AsyncConnection,
+            batch: Dict[str, Tuple[int, ProductImportRow]],
+            report: ImportReport
+    ) -> None:
+        try:
+            # TRUNCATE заодно открывает транзакцию, в которую попадет COPY
+            await connection.execute(text(f"TRUNCATE {staging.name}"))
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                staging.name,
+                records=[
+                    (number, *(getattr(product, column) for column in PRODUCT_COLUMNS))
+                    for number, product in batch.values()
+                ],
+                columns=["line", *PRODUCT_COLUMNS],
+            )
+
+            unknown_category = (await connection.execute(
+                select(staging.c.line, staging.c.sku, staging.c.category_id)
+                .where(~exists().where(CategoryModel.id == staging.c.category_id))
+                .order_by(staging.c.line)
+            )).all()
+
+            stmt = pg_insert(ProductModel).from_select(
+                PRODUCT_COLUMNS,
+                select(*(staging.c[column] for column in PRODUCT_COLUMNS))
+                .join(CategoryModel, CategoryModel.id == staging.c.category_id)
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ProductModel.sku],
+                set_={
+                    **{column: stmt.excluded[column] for column in UPDATE_COLUMNS},
+                    "price_version": next_price_version(stmt.excluded.price, stmt.excluded.discount_price),
+                },
+                # Неизменившиеся товары не переписываем - не плодим мертвые версии строк
+                where=tuple_(*(ProductModel.__table__.c[column] for column in UPDATE_COLUMNS))
+                .is_distinct_from(tuple_(*(stmt.excluded[column] for column in UPDATE_COLUMNS)))
+            ).returning(ProductModel.id, (literal_column("xmax") == 0).label("inserted"))
+            written = (await connection.execute(stmt)).all()
+            await connection.commit()
+        except (SQLAlchemyError, OSError) as e:
+            await connection.rollback()
+            log.exception("Products import batch failed")
+            first_line = min(number for number, _ in batch.values())
+            report.rejected += len(batch)
+            cls._add_error(report, first_line, None, f"Batch of {len(batch)} rows failed: {e}")
+            return
+
+        for line, sku, category_id in unknown_category:
+            cls._reject(report, line, sku, f"Category {category_id} does not exist")
+        updated_ids = [row.id for row in written if not row.inserted]
+        report.inserted += len(written) - len(updated_ids)
+        report.updated += len(updated_ids)
+        report.unchanged += len(batch) - len(written) - len(unknown_category)
+        await product_cache.invalidate_many(updated_ids)
+
+    @classmethod
+    def _reject(cls, report: ImportReport, line: int, sku: Optional[str], error: str) -> None:
+        report.rejected += 1
+        cls._add_error(report, line, sku, error)
+
+    @staticmethod
+    def _add_error(report: ImportReport, line: int, sku: Optional[str], error: str) -> None:
+        if len(report.errors) < settings.IMPORT_MAX_ERRORS:
+            report.errors.append(ImportRowError(line=line, sku=str(sku) if sku is not None else None, error=error))
+        else:
+            report.errors_truncated = True
@@ -0,0 +1,115 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, Sequence, Set, Tuple, TypeVar
+
+from sqlalchemy import select, or_, any_, literal, ARRAY, Integer, String
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import ProductModel
+from .schemas import Product
+
+
+KeyType = TypeVar("KeyType", bound=Hashable)
+ValueType = TypeVar("ValueType")
+
+
+class DataLoader(Generic[KeyType, ValueType]):
+    # Собирает ключи, запрошенные в одной итерации event loop, и загружает их
+    # одним вызовом batch_load. Живет один запрос: результаты запоминаются
+    def __init__(
+            self,
+            batch_load: Callable[[List[KeyType]], Awaitable[Dict[KeyType, ValueType]]],
+            max_batch_size: int = 1000
+    ):
+        self._batch_load = batch_load
+        self._max_batch_size = max_batch_size
+        self._results: Dict[KeyType, asyncio.Future] = {}
+        # Ключи ждут отправки вместе со своими future: clear() до конца загрузки
+        # не мешает разрешить тех, кто уже ждет
+        self._pending: List[Tuple[KeyType, asyncio.Future]] = []
+        # Event loop держит задачи слабыми ссылками: без этого пачку может собрать GC
+        self._tasks: Set[asyncio.Task] = set()
+        # Загрузки идут по очереди: у сессии за раз может выполняться один запрос
+        self._lock = asyncio.Lock()
+
+    def load(self, key: KeyType) -> Awaitable[Optional[ValueType]]:
+        future = self._results.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._results[key] = future
+            if not self._pending:
+                asyncio.get_running_loop().call_soon(self._dispatch)
+            self._pending.append((key, future))
+        return future
+
+    async def load_many(self, keys: Sequence[KeyType]) -> List[Optional[ValueType]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: KeyType, value: Optional[ValueType]) -> None:
+        if key not in self._results:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._results[key] = future
+
+    def clear(self, key: KeyType) -> None:
+        self._results.pop(key, None)
+
+    def _dispatch(self) -> None:
+        pending, self._pending = self._pending, []
+        for start in range(0, len(pending), self._max_batch_size):
+            task = asyncio.create_task(self._run(pending[start:start + self._max_batch_size]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: List[Tuple[KeyType, asyncio.Future]]) -> None:
+        # После clear() и повторного load ключ может попасть в пачку дважды
+        keys = list(dict.fromkeys(key for key, _ in pending))
+        try:
+            async with self._lock:
+                values = await self._batch_load(keys)
+        except Exception as e:
+            for key, future in pending:
+                # Ошибку не запоминаем, но и чужой future после clear() не трогаем
+                if self._results.get(key) is future:
+                    del self._results[key]
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in pending:
+            if not future.done():
+                future.set_result(values.get(key))
+
+
+ProductKey = Tuple[str, Any]
+
+
+class ProductLoader(DataLoader[ProductKey, Product]):
+    # Товары по id и sku: ключи ("id", 1) и ("sku", "abc") из одной пачки
+    # уходят в базу одним запросом id = ANY(...) OR sku = ANY(...)
+    def __init__(self, session: AsyncSession, max_batch_size: int = 1000):
+        super().__init__(self._load_products, max_batch_size)
+        self._session = session
+
+    def by_id(self, product_id: int) -> Awaitable[Optional[Product]]:
+        return self.load(("id", product_id))
+
+    def by_sku(self, sku: str) -> Awaitable[Optional[Product]]:
+        return self.load(("sku", sku))
+
+    async def _load_products(self, keys: List[ProductKey]) -> Dict[ProductKey, Product]:
+        ids = [value for field, value in keys if field == "id"]
+        skus = [value for field, value in keys if field == "sku"]
+        conditions = []
+        if ids:
+            conditions.append(ProductModel.id == any_(literal(ids, ARRAY(Integer))))
+        if skus:
+            conditions.append(ProductModel.sku == any_(literal(skus, ARRAY(String))))
+
+        result = await self._session.execute(select(ProductModel).where(or_(*conditions)))
+        found = {}
+        for model in result.scalars():
+            product = Product.model_validate(model)
+            found[("id", product.id)] = found[("sku", product.sku)] = product
+            # Тот же товар по второму ключу больше не грузим
+            self.prime(("id", product.id), product)
+            self.prime(("sku", product.sku), product)
+        return found
@@ -2,9 +2,12 @@ import datetime
 import uuid
 
 from typing_extensions import Annotated
-from sqlalchemy import MetaData, String, Boolean, ForeignKey, TIMESTAMP, LargeBinary, DATE, UUID, func
+from sqlalchemy import (MetaData, String, Boolean, ForeignKey, TIMESTAMP, LargeBinary, DATE, UUID, Computed, func,
+                        case, tuple_)
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, aliased
-from sqlalchemy.schema import UniqueConstraint, ForeignKeyConstraint
+from sqlalchemy.schema import UniqueConstraint, ForeignKeyConstraint, Index
 
 from ..database import Base
 try:
@@ -19,7 +22,8 @@ class CategoryModel(Base):
     name: Mapped[str] = mapped_column(nullable=False, unique=True)
     parent_id: Mapped[int] = mapped_column(
         ForeignKey('categories.id', onupdate="CASCADE", ondelete="CASCADE"),
-        nullable=True
+        nullable=True,
+        index=True
     )
     parent: Mapped["CategoryModel"] = relationship(
         "CategoryModel",
@@ -31,6 +35,15 @@ class CategoryModel(Base):
         uselist=True,
     )
 
+# Полнотекстовый индекс товара: sku и название весят больше описания.
+# sku разбирается конфигурацией simple, чтобы артикулы не стеммились
+PRODUCT_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(sku, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'B')"
+)
+
+
 class ProductModel(Base):
     __tablename__ = 'products'
 
@@ -41,12 +54,18 @@ class ProductModel(Base):
     price: Mapped[float] = mapped_column(nullable=False)
     discount_price: Mapped[float] = mapped_column(nullable=True)
     stock: Mapped[int] = mapped_column(nullable=False)
+    # Растет при каждом изменении price или discount_price, см. next_price_version.
+    # Строки корзины запоминают версию, по которой снята цена
+    price_version: Mapped[int] = mapped_column(nullable=False, default=1, server_default="1")
+    # Считается самим Postgres, в обычных запросах не загружается
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR, Computed(PRODUCT_SEARCH_VECTOR, persisted=True), nullable=True, deferred=True)
 
     category_id: Mapped[int] = mapped_column(
         ForeignKey(
         'categories.id',
         onupdate="CASCADE",
-        ondelete="CASCADE"), nullable=False)
+        ondelete="CASCADE"), nullable=False, index=True)
 
     category: Mapped[CategoryModel] = relationship(
         back_populates="products",
@@ -63,7 +82,51 @@ class ProductModel(Base):
         uselist=True,
     )
 
+    @hybrid_property
+    def unit_price(self) -> float:
+        # Цена продажи: цена со скидкой, если она задана
+        return min(self.price, self.discount_price) if self.discount_price else self.price
+
+    @unit_price.inplace.expression
+    @classmethod
+    def _unit_price_expression(cls):
+        return func.least(cls.price, func.nullif(cls.discount_price, 0))
+
     # __table_args__ = (UniqueConstraint('sku', name='_sku_uc'),)
+    __table_args__ = (
+        # Keyset-пагинация по цене
+        Index('products_price_id_idx', 'price', 'id'),
+        Index('products_search_vector_idx', 'search_vector', postgresql_using='gin'),
+        # Триграммные индексы products_name_trgm_idx и products_sku_trgm_idx
+        # требуют расширения pg_trgm и создаются только миграцией
+    )
+
+
+def next_price_version(price, discount_price):
+    # Значение price_version для UPDATE товара новыми price и discount_price
+    return case(
+        (
+            tuple_(ProductModel.price, ProductModel.discount_price)
+            .is_distinct_from(tuple_(price, discount_price)),
+            ProductModel.price_version + 1
+        ),
+        else_=ProductModel.price_version
+    )
+
+
+class ProductFacetCountModel(Base):
+    # Сколько товаров в каждой комбинации фасетов. Обновляется на создании
+    # и изменении товара, после импорта пересчитывается целиком
+    __tablename__ = 'product_facet_counts'
+
+    category_id: Mapped[int] = mapped_column(
+        ForeignKey('categories.id', onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True
+    )
+    price_bucket: Mapped[int] = mapped_column(primary_key=True)
+    in_stock: Mapped[bool] = mapped_column(primary_key=True)
+    has_discount: Mapped[bool] = mapped_column(primary_key=True)
+    product_count: Mapped[int] = mapped_column(nullable=False, default=0)
 
 
 class CartItemModel(Base):
@@ -81,7 +144,9 @@ class CartItemModel(Base):
     )
 
     quantity: Mapped[int] = mapped_column(nullable=False, default=1)
+    # Снимок цены товара на момент добавления и его price_version
     price: Mapped[float] = mapped_column(nullable=False, default=0.0)
+    price_version: Mapped[int] = mapped_column(nullable=False, default=1, server_default="1")
 
     user: Mapped["UserModel"] = relationship(
         back_populates="cart_items",
@@ -94,6 +159,12 @@ class CartItemModel(Base):
         foreign_keys=[product_id]
     )
 
+    __table_args__ = (
+        # Одна строка на товар в корзине пользователя: на ней держится upsert
+        # добавления в корзину, и она же - индекс выборки корзины по user_uuid
+        Index('cart_items_user_uuid_product_id_idx', 'user_uuid', 'product_id', unique=True),
+    )
+
 
 # class CartModel(Base):
 #     __tablename__ = 'carts'
@@ -121,7 +192,8 @@ class OrderModel(Base):
     user_uuid: Mapped[uuid.UUID] = mapped_column(
         UUID,
         ForeignKey('users.id', onupdate="CASCADE", ondelete="CASCADE"),
-        nullable=False
+        nullable=False,
+        index=True
     )
     created_at: Mapped[datetime.datetime] = mapped_column(nullable=False)
     status: Mapped[str] = mapped_column(nullable=False)
@@ -135,7 +207,8 @@ class OrderModel(Base):
 
     order_items: Mapped[list["OrderItemModel"]] = relationship(
         back_populates="order",
-        uselist=True
+        uselist=True,
+        order_by="OrderItemModel.id"
     )
 
 
@@ -145,11 +218,14 @@ class OrderItemModel(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     order_id: Mapped[str] = mapped_column(
         ForeignKey('orders.id', onupdate="CASCADE", ondelete="CASCADE"),
-        nullable=False
+        nullable=False,
+        index=True
     )
+    # Индекс нужен каскадному удалению и изменению товара
     product_id: Mapped[str] = mapped_column(
         ForeignKey('products.id', onupdate="CASCADE", ondelete="CASCADE"),
-        nullable=False
+        nullable=False,
+        index=True
     )
     quantity: Mapped[int] = mapped_column(nullable=False)
     price: Mapped[float] = mapped_column(nullable=False)  # Цена на момент покупки
@@ -1,16 +1,28 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, status
-from fastapi.responses import JSONResponse
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, Query, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi_cache.decorator import cache
+from sqlalchemy.ext.asyncio import AsyncSession
 from .models import ProductModel, CategoryModel
-from .schemas import (Product, ProductCreate, ProductUpdate,
-                      Category, CategoryCreate, CategoryUpdate,
-                      CartItem, CartItemCreate, CartItemUpdate,
-                      Order, OrderCreate, OrderUpdate)
+from .schemas import (Product, ProductCreate, ProductUpdate, ProductsPage, ProductSearchHit, ImportReport,
+                      ProductFacetFilter, FacetedProductsPage, ProductBatchRequest, ProductBatch,
+                      Category, CategoryCreate, CategoryUpdate, CategoryTreeOut,
+                      CartItem, CartItemCreate, CartItemUpdate, CartSet, CartDetail,
+                      Order, OrderCreate, OrderUpdate, OrderDetail)
 from .service import ProductService, CategoryService, CartService, OrderService
+from .importer import ProductImportService, ImportFormat
+from .facets import FacetService
+from .loaders import ProductLoader
+from .dependencies import get_product_loader
+from .exporter import ProductExportService, ExportFormat, EXPORT_MEDIA_TYPES
 from ..exceptions import InvalidCredentialsException
 from ..config import settings
+from ..database import get_async_session
+from ..cache import tagged_key_builder
+from ..pagination import CursorPage
 from src.users.dependencies import get_current_user, get_current_superuser
 from src.users.models import UserModel
+from src.users.schemas import Principal
 
 catalog_router = APIRouter(prefix="/catalog", tags=["Catalog"])
 cart_router = APIRouter(prefix="/user", tags=["Cart"])
@@ -19,98 +31,206 @@ order_router = APIRouter(prefix="/user", tags=["Order"])
 @catalog_router.post("/add_product", status_code=status.HTTP_201_CREATED)
 async def add_product(
         product: ProductCreate = Depends(ProductCreate),
-        current_user: UserModel = Depends(get_current_superuser),
+        current_user: Principal = Depends(get_current_superuser),
+        session: AsyncSession = Depends(get_async_session),
 ) -> Product:
-    return await ProductService.create_product(product)
+    return await ProductService.create_product(session, product)
+
+
+# Тело читается потоком: CSV с заголовком или NDJSON, upsert по sku пачками
+@catalog_router.post("/products/import")
+async def import_products(
+        request: Request,
+        format: ImportFormat = "ndjson",
+        current_user: Principal = Depends(get_current_superuser),
+) -> ImportReport:
+    return await ProductImportService.import_products(request.stream(), format)
+
+
+@catalog_router.get("/export")
+async def export_products(
+        format: ExportFormat = "ndjson",
+        category_id: Optional[int] = None,
+        with_category_path: bool = False,
+) -> StreamingResponse:
+    return StreamingResponse(
+        ProductExportService.export_products(format, category_id, with_category_path),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'}
+    )
 
 
 @catalog_router.get("/products")
+@cache(namespace="catalog", key_builder=tagged_key_builder("products"))
 async def get_products(
         offset: Optional[int] = 0,
         limit: Optional[int] = 25,
-) -> List[Product]:
-    return await ProductService.get_products(offset=offset, limit=limit)
+        cursor: Optional[str] = None,
+        sort: Literal["id", "price"] = "id",
+        session: AsyncSession = Depends(get_async_session),
+) -> CursorPage[Product]:
+    return await ProductService.get_products(
+        session, offset=offset, limit=limit, cursor=cursor, sort=sort)
+
+@catalog_router.post("/products/batch")
+async def get_products_batch(
+        request: ProductBatchRequest,
+        loader: ProductLoader = Depends(get_product_loader),
+) -> ProductBatch:
+    return await ProductService.get_products_batch(loader, request)
+
+
+@catalog_router.get("/products/faceted")
+@cache(namespace="catalog", key_builder=tagged_key_builder("products", "products-import", "categories"))
+async def get_faceted_products(
+        filters: ProductFacetFilter = Depends(ProductFacetFilter),
+        limit: int = Query(25, ge=1, le=100),
+        cursor: Optional[str] = None,
+        session: AsyncSession = Depends(get_async_session),
+) -> FacetedProductsPage:
+    return await FacetService.get_faceted_products(session, filters, limit=limit, cursor=cursor)
+
+
+@catalog_router.get("/search")
+@cache(namespace="catalog", key_builder=tagged_key_builder("products", "products-import"))
+async def search_products(
+        q: str = Query(min_length=1, max_length=200),
+        category_id: Optional[int] = None,
+        limit: int = Query(25, ge=1, le=100),
+        cursor: Optional[str] = None,
+        session: AsyncSession = Depends(get_async_session),
+) -> CursorPage[ProductSearchHit]:
+    return await ProductService.search_products(
+        session, q, category_id=category_id, limit=limit, cursor=cursor)
+
 
 @catalog_router.get("/products/{category_id}")
+@cache(namespace="catalog", key_builder=tagged_key_builder("products", "categories"))
 async def get_products_by_category(
-        category_id: Optional[int] = None,
-):
-    products = await ProductService.get_products_by_category(category_id)
-    # print(products)
-    for item in products:
-        print(item)
-
-    return products
+        category_id: int,
+        offset: Optional[int] = 0,
+        limit: Optional[int] = 25,
+        session: AsyncSession = Depends(get_async_session),
+) -> ProductsPage:
+    return await ProductService.get_products_by_category(
+        session, category_id, offset=offset, limit=limit)
 
 @catalog_router.get("/product/{product_id}")
+@cache(namespace="catalog", key_builder=tagged_key_builder("product:{product_id}", "products-import"))
 async def get_product_by_id(
         product_id: int,
+        session: AsyncSession = Depends(get_async_session),
 ) -> Product:
-    return await ProductService.get_product_by_id(product_id)
+    return await ProductService.get_product_by_id(session, product_id)
 
 @catalog_router.post("/add_category", status_code=status.HTTP_201_CREATED)
 async def add_category(
         category: CategoryCreate = Depends(CategoryCreate),
-        current_user: UserModel = Depends(get_current_superuser),
+        current_user: Principal = Depends(get_current_superuser),
+        session: AsyncSession = Depends(get_async_session),
 ) -> Category:
-    return await CategoryService.create_category(category)
+    return await CategoryService.create_category(session, category)
+
+
+@catalog_router.get("/categories/tree")
+async def get_category_tree() -> CategoryTreeOut:
+    return await CategoryService.get_category_tree()
 
 
 @catalog_router.get("/categories")
+@cache(namespace="catalog", key_builder=tagged_key_builder("categories"))
 async def get_categories(
         offset: Optional[int] = 0,
         limit: Optional[int] = 100,
-) -> List[Category]:
-    return await CategoryService.get_categories(offset=offset, limit=limit)
+        cursor: Optional[str] = None,
+        session: AsyncSession = Depends(get_async_session),
+) -> CursorPage[Category]:
+    return await CategoryService.get_categories(
+        session, offset=offset, limit=limit, cursor=cursor)
 
 
 @cart_router.get("/category/{category_id}")
+@cache(namespace="catalog", key_builder=tagged_key_builder("category:{category_id}"))
 async def get_category_by_id(
         category_id: int,
+        session: AsyncSession = Depends(get_async_session),
 ) -> Category:
-    return await CategoryService.get_category_by_id(category_id)
+    return await CategoryService.get_category_by_id(session, category_id)
 
 
 @cart_router.get("/cart_items")
 async def get_cart_items(
-    current_user: UserModel = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ) -> List[CartItem]:
-    return await CartService.get_cart_items(user_id=current_user.id)
+    return await CartService.get_cart_items(session, user_id=current_user.id)
+
+
+@cart_router.get("/cart")
+async def get_cart(
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+    loader: ProductLoader = Depends(get_product_loader),
+) -> CartDetail:
+    return await CartService.get_cart(session, current_user.id, loader)
 
 
 @cart_router.post("/add_cart_item", status_code=status.HTTP_201_CREATED)
 async def add_cart_item(
         cart_item: CartItemCreate = Depends(CartItemCreate),
-        current_user: UserModel = Depends(get_current_user),
+        current_user: Principal = Depends(get_current_user),
+        session: AsyncSession = Depends(get_async_session),
 ) -> CartItem:
-    return await CartService.add_item_to_cart(cart_item, current_user.id)
+    return await CartService.add_item_to_cart(session, cart_item, current_user.id)
+
+
+# Синхронизация корзины с фронтенда одним запросом: корзина заменяется целиком
+@cart_router.put("/cart")
+async def set_cart(
+        cart: CartSet,
+        current_user: Principal = Depends(get_current_user),
+        session: AsyncSession = Depends(get_async_session),
+) -> List[CartItem]:
+    return await CartService.set_cart(session, cart, current_user.id)
 
 
 @cart_router.delete("/remove_cart_item", status_code=status.HTTP_200_OK)
 async def remove_cart_item(
         cart_id: int,
-        current_user: UserModel = Depends(get_current_user),
+        current_user: Principal = Depends(get_current_user),
+        session: AsyncSession = Depends(get_async_session),
 ):
-    await CartService.remove_cart_item(cart_id)
+    await CartService.remove_cart_item(session, cart_id, current_user.id)
 
 
 @order_router.post("/create_order", status_code=status.HTTP_201_CREATED)
 async def create_order(
-        current_user: UserModel = Depends(get_current_user),
+        current_user: Principal = Depends(get_current_user),
+        session: AsyncSession = Depends(get_async_session),
 ) -> Order:
-    new_order = await OrderService.create_order(current_user.id)
+    new_order = await OrderService.create_order(session, current_user.id)
     return new_order
 
 @order_router.get("/orders")
 async def get_orders(
-    current_user: UserModel = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ) -> List[Order]:
-    return await OrderService.get_orders(user_id=current_user.id)
+    return await OrderService.get_orders(session, user_id=current_user.id)
+
+@order_router.get("/orders/{order_id}")
+async def get_order_detail(
+    order_id: int,
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+) -> OrderDetail:
+    return await OrderService.get_order_detail(session, current_user.id, order_id)
 
 @order_router.get("/update_order/{order_id}")
 async def update_order(
     order_id: int,
     order: OrderUpdate = Depends(OrderUpdate),
-    current_user: UserModel = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ) -> Order:
-    return await OrderService.update_order(order_id, order)
+    return await OrderService.update_order(session, order_id, order)
@@ -2,7 +2,9 @@ import datetime
 import uuid
 from enum import Enum
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
+
+from ..config import settings
 
 
 class OrderStatus(str, Enum):
@@ -41,6 +43,101 @@ class Product(ProductBase):
         from_attributes = True
 
 
+class ProductBatchRequest(BaseModel):
+    ids: list[int] = Field([])
+    skus: list[str] = Field([])
+
+    @model_validator(mode="after")
+    def check_size(self):
+        if len(self.ids) + len(self.skus) > settings.PRODUCT_BATCH_MAX_SIZE:
+            raise ValueError(f"At most {settings.PRODUCT_BATCH_MAX_SIZE} ids and skus per request")
+        return self
+
+
+class ProductBatch(BaseModel):
+    # Найденные товары в порядке запроса: сначала по ids, затем по skus
+    items: list[Product]
+    missing_ids: list[int]
+    missing_skus: list[str]
+
+
+class ProductFacetFilter(BaseModel):
+    category_id: Optional[int] = Field(None)
+    price_min: Optional[float] = Field(None, ge=0)
+    price_max: Optional[float] = Field(None, ge=0)
+    in_stock: bool = Field(False)
+    has_discount: bool = Field(False)
+
+
+class PriceBucketFacet(BaseModel):
+    price_min: Optional[float]
+    price_max: Optional[float]
+    count: int
+
+
+class CategoryFacet(BaseModel):
+    id: int
+    name: str
+    count: int
+
+
+class ProductFacets(BaseModel):
+    # Счетчик каждого фасета учитывает все фильтры, кроме своего собственного
+    price: list[PriceBucketFacet]
+    categories: list[CategoryFacet]
+    in_stock: int
+    has_discount: int
+
+
+class FacetedProductsPage(BaseModel):
+    items: list[Product]
+    next_cursor: Optional[str] = Field(None)
+    total: int
+    facets: ProductFacets
+
+
+class ProductSearchHit(Product):
+    rank: float
+    # Фрагмент описания (или названия) с найденными словами в <mark></mark>
+    highlight: Optional[str] = Field(None)
+
+
+class ProductImportRow(BaseModel):
+    sku: str = Field(min_length=1)
+    name: str = Field(min_length=1)
+    description: Optional[str] = Field(None)
+    price: float = Field(ge=0)
+    discount_price: Optional[float] = Field(None, ge=0)
+    stock: int = Field(ge=0, le=2**31 - 1)
+    category_id: int = Field(ge=1, le=2**31 - 1)
+
+
+class ImportRowError(BaseModel):
+    line: int
+    sku: Optional[str] = Field(None)
+    error: str
+
+
+class ImportReport(BaseModel):
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # Строки, перекрытые более поздней строкой с тем же sku в той же пачке
+    duplicates: int = 0
+    rejected: int = 0
+    errors: list[ImportRowError] = Field([])
+    errors_truncated: bool = False
+    seconds: float = 0.0
+
+
+class ProductsPage(BaseModel):
+    items: list[Product]
+    total: int
+    offset: int
+    limit: int
+
+
 
 
 # Категории ///////////////////////////////////////////////////////////////
@@ -63,6 +160,15 @@ class Category(CategoryBase):
         from_attributes = True
 
 
+class CategoryTreeNode(Category):
+    children: list["CategoryTreeNode"] = Field([])
+
+
+class CategoryTreeOut(BaseModel):
+    version: int
+    items: list[CategoryTreeNode]
+
+
 
 # Корзина ///////////////////////////////////////////////////////////////
 class CartItemBase(BaseModel):
@@ -70,11 +176,12 @@ class CartItemBase(BaseModel):
     product_id: int = Field(1)
     quantity: int = Field(1)
     price: float = Field(0.0)
+    price_version: int = Field(1)
 
 class CartItemCreate(BaseModel):
+    # Цену клиент не передает: она снимается с товара на сервере
     product_id: int = Field(1)
     quantity: int = Field(1, ge=1)
-    price: float = Field(0.0)
 
 class CartItemUpdate(CartItemBase):
     id: int
@@ -87,6 +194,50 @@ class CartItem(CartItemBase):
         from_attributes = True
 
 
+class CartSet(BaseModel):
+    # Новое содержимое корзины целиком: строк, которых здесь нет, в корзине не останется
+    items: list[CartItemCreate] = Field([])
+
+    @model_validator(mode="after")
+    def check_items(self):
+        if len(self.items) > settings.CART_MAX_LINES:
+            raise ValueError(f"At most {settings.CART_MAX_LINES} cart lines per request")
+        if len({item.product_id for item in self.items}) != len(self.items):
+            raise ValueError("Each product may appear in the cart only once")
+        return self
+
+
+
+class ProductBrief(BaseModel):
+    # Урезанный товар для строк корзины и заказа
+    id: int
+    sku: str
+    name: str
+    price: float
+    discount_price: Optional[float]
+    stock: int
+
+    class Config:
+        from_attributes = True
+
+
+class CartLine(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    price: float
+    product: ProductBrief
+
+    class Config:
+        from_attributes = True
+
+
+class CartDetail(BaseModel):
+    items: list[CartLine]
+    total_quantity: int
+    total_price: float
+
+
 
 # Ордеры ///////////////////////////////////////////////////////////////
 class OrderBase(BaseModel):
@@ -128,3 +279,18 @@ class OrderItem(OrderItemBase):
 
     class Config:
         from_attributes = True
+
+
+class OrderLine(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    price: float
+    product: ProductBrief
+
+    class Config:
+        from_attributes = True
+
+
+class OrderDetail(Order):
+    order_items: list[OrderLine]
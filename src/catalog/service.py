@@ -1,24 +1,61 @@
+import asyncio
+import re
 import time
 import random
 import uuid
+from bisect import bisect_right
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from fastapi import HTTPException, status
-from sqlalchemy import select, insert, update, delete, literal, func
+from sqlalchemy import (select, insert, update, delete, literal, literal_column, func, true, any_, all_, or_, and_,
+                        UUID, ARRAY, Integer, Float, JSON)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload, joinedload, aliased, contains_eager
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .schemas import (OrderStatus,
-                      Product, ProductCreate, ProductUpdate,
-                      Category, CategoryCreate, CategoryUpdate,
-                      CartItem, CartItemCreate, CartItemUpdate,
-                      Order, OrderBase,
+                      Product, ProductCreate, ProductUpdate, ProductsPage, ProductSearchHit,
+                      ProductBatchRequest, ProductBatch,
+                      Category, CategoryCreate, CategoryUpdate, CategoryTreeOut,
+                      CartItem, CartItemCreate, CartItemUpdate, CartSet, CartLine, CartDetail,
+                      Order, OrderBase, OrderDetail,
                       OrderItem, OrderItemCreate, OrderItemUpdate, CartItemBase, OrderCreate, OrderUpdate, )
-from .models import ProductModel, CategoryModel, CartItemModel, OrderModel, OrderItemModel
+from .models import ProductModel, CategoryModel, CartItemModel, OrderModel, OrderItemModel, next_price_version
 from .dao import ProductDAO, CategoryDAO, CartDAO, OrderDAO
-from ..exceptions import InvalidTokenException, TokenExpiredException
-from ..database import async_session_maker
+from ..exceptions import InvalidTokenException, TokenExpiredException, CartPricesChangedException
 from ..config import settings
+from ..pagination import CursorPage, encode_cursor, decode_cursor
+from ..cache import invalidate_tags, TwoTierCache
+from .tree import category_tree
+from .facets import FacetService
+from .loaders import ProductLoader
+from .cart_store import cart_store
+
+
+# Допустимые сортировки списка товаров для keyset-пагинации
+PRODUCT_ORDERINGS = {
+    "id": (ProductModel.id,),
+    "price": (ProductModel.price, ProductModel.id),
+}
+
+
+async def _load_product(session: AsyncSession, product_id: str) -> Optional[ProductModel]:
+    return await ProductDAO.find_one_or_none(session, ProductModel.id == int(product_id))
+
+
+async def _load_category(session: AsyncSession, category_id: str) -> Optional[CategoryModel]:
+    return await CategoryDAO.find_one_or_none(session, CategoryModel.id == int(category_id))
+
+
+# Конфигурация полнотекстового поиска, та же, что в products.search_vector
+SEARCH_CONFIG = literal_column("'russian'::regconfig")
+SEARCH_WORD = re.compile(r"\w+")
+
+
+# L1 (память воркера) + L2 (redis) для поиска товара и категории по id
+product_cache = TwoTierCache("product", Product, _load_product)
+category_cache = TwoTierCache("category", Category, _load_category)
 
 
 def generate_unique_id() -> str:
@@ -31,66 +68,91 @@ class ProductService:
     @classmethod
     async def get_products(
             cls,
+            session: AsyncSession,
            *filter,
            offset: int = 0,
            limit: int = 100,
+           cursor: Optional[str] = None,
+           sort: str = "id",
            **filter_by
-    ) -> list[Product]:
-
-        async with async_session_maker() as session:
-            products = await ProductDAO.find_all(
-                session,
-                *filter,
-                offset=offset,
-                limit=limit,
-                **filter_by
-            )
+    ) -> CursorPage[Product]:
+
+        products, next_cursor = await ProductDAO.find_page(
+            session,
+            *filter,
+            order_by=PRODUCT_ORDERINGS[sort],
+            cursor=cursor,
+            offset=offset,
+            limit=limit,
+            **filter_by
+        )
 
         if products is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Products not found")
-        return products
+        return CursorPage[Product](items=products, next_cursor=next_cursor)
 
     @classmethod
     async def get_products_by_category(
             cls,
-            category_id: int
-    ) -> list[Product]:
-
-        async with async_session_maker() as session:
-            # query = (
-            #     select(CategoryModel)
-            #     .where(CategoryModel.id == category_id)
-            #     .union_all(
-            #         select(CategoryModel).where(CategoryModel.parent_id == category_id)
-            #     )
-            # )
-            subquery = (
-                select(CategoryModel).where(CategoryModel.parent_id == category_id)
+            session: AsyncSession,
+            category_id: int,
+            offset: int = 0,
+            limit: int = 25,
+    ) -> ProductsPage:
+        tree = category_tree.tree
+        if tree is not None:
+            # Поддерево уже посчитано в памяти - в базу уходит один массив id
+            products_in_subtree = (
+                select(ProductModel)
+                .where(ProductModel.category_id == any_(
+                    literal(sorted(tree.descendant_ids(category_id)), ARRAY(Integer))))
             )
-            subresult = await session.execute(subquery)
-            subcategories = subresult.scalars().all()
-            subcats_ids = [category.id for category in subcategories]
-            subcats_ids.append(category_id)
-
-            prod_query = (
+        else:
+            # Дерево еще не загружено: все подкатегории одним рекурсивным CTE
+            subtree = (
+                select(CategoryModel.id)
+                .where(CategoryModel.id == category_id)
+                .cte("subtree", recursive=True)
+            )
+            subtree = subtree.union_all(
+                select(CategoryModel.id).where(CategoryModel.parent_id == subtree.c.id)
+            )
+            products_in_subtree = (
                 select(ProductModel)
-                .where(ProductModel.category_id.in_(subcats_ids))
+                .join(subtree, ProductModel.category_id == subtree.c.id)
             )
-            prod_result = await session.execute(prod_query)
-            products_orm = prod_result.scalars().all()
-            products_dto = [Product.model_validate(product, from_attributes=True) for product in products_orm]
-            products = products_dto
 
-        if products is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Products not found")
-        return products  # [category for category in categories]
+        query = (
+            products_in_subtree
+            .add_columns(func.count().over().label("total"))
+            .order_by(ProductModel.id)
+            .offset(offset)
+            .limit(limit)
+        )
+        result = await session.execute(query)
+        rows = result.all()
+
+        if rows:
+            total = rows[0].total
+        elif offset > 0:
+            # Страница за пределами выборки - оконный count не вернулся, считаем отдельно
+            total = await session.scalar(
+                select(func.count()).select_from(products_in_subtree.subquery())
+            )
+        else:
+            total = 0
+
+        return ProductsPage(
+            items=[Product.model_validate(row.ProductModel) for row in rows],
+            total=total,
+            offset=offset,
+            limit=limit
+        )
 
     @classmethod
-    async def get_product_by_id(cls, product_id: int) -> Product:
-        async with async_session_maker() as session:
-            product = await ProductDAO.find_one_or_none(session, ProductModel.id == product_id)
+    async def get_product_by_id(cls, session: AsyncSession, product_id: int) -> Product:
+        product = await product_cache.get(session, product_id)
 
         if product is None:
             raise HTTPException(
@@ -98,60 +160,206 @@ class ProductService:
         return product
 
     @classmethod
-    async def create_product(cls, product: ProductCreate) -> Product:
-        async with async_session_maker() as session:
-            product_exist = await ProductDAO.find_one_or_none(session, sku=product.sku)
-            if product_exist:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT, detail="Product already exists")
+    async def get_products_batch(cls, loader: ProductLoader, request: ProductBatchRequest) -> ProductBatch:
+        # Все ключи попадают в одну пачку загрузчика - один запрос к базе
+        by_id, by_sku = await asyncio.gather(
+            loader.load_many([("id", product_id) for product_id in request.ids]),
+            loader.load_many([("sku", sku) for sku in request.skus]),
+        )
+        items, seen = [], set()
+        for product in (*by_id, *by_sku):
+            if product is not None and product.id not in seen:
+                seen.add(product.id)
+                items.append(product)
+        return ProductBatch(
+            items=items,
+            missing_ids=[product_id for product_id, product in zip(request.ids, by_id) if product is None],
+            missing_skus=[sku for sku, product in zip(request.skus, by_sku) if product is None],
+        )
 
-            new_product = await ProductDAO.add(
-                session,
-                product
-            )
-            await session.commit()
+    @classmethod
+    async def create_product(cls, session: AsyncSession, product: ProductCreate) -> Product:
+        product_exist = await ProductDAO.find_one_or_none(session, sku=product.sku)
+        if product_exist:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail="Product already exists")
+
+        new_product = await ProductDAO.add(
+            session,
+            product
+        )
+        if new_product is not None:
+            await FacetService.record_product_change(session, new=new_product)
+        await session.commit()
+        await invalidate_tags("products")
 
         return new_product
 
     @classmethod
-    async def update_product(cls, product_id: int, product: ProductUpdate) -> ProductModel:
-        async with async_session_maker() as session:
-            product_exist = await ProductDAO.find_one_or_none(session, ProductModel.id == product_id)
-            if product_exist is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    async def update_product(cls, session: AsyncSession, product_id: int, product: ProductUpdate) -> ProductModel:
+        # Блокировка строки: старые значения нужны для счетчиков фасетов
+        product_exist = await session.scalar(
+            select(ProductModel).where(ProductModel.id == product_id).with_for_update())
+        if product_exist is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+        old_product = Product.model_validate(product_exist)
+
+        update_data = product.model_dump(exclude_unset=True)
+        if "price" in update_data or "discount_price" in update_data:
+            update_data["price_version"] = next_price_version(
+                update_data.get("price", ProductModel.price),
+                update_data.get("discount_price", ProductModel.discount_price)
+            )
+        updated_product = await ProductDAO.update(
+            session,
+            ProductModel.id == product_id,
+            obj_in=update_data
+        )
+        await FacetService.record_product_change(session, old=old_product, new=updated_product)
+        await session.commit()
+        await product_cache.invalidate(product_id)
+        await invalidate_tags("products", f"product:{product_id}")
+        return updated_product
 
-            updated_product = await ProductDAO.update(
-                session,
-                ProductModel.id == product_id,
-                obj_in=product
+    @classmethod
+    async def search_products(
+            cls,
+            session: AsyncSession,
+            q: str,
+            category_id: Optional[int] = None,
+            limit: int = 25,
+            cursor: Optional[str] = None,
+    ) -> CursorPage[ProductSearchHit]:
+        words = SEARCH_WORD.findall(q)
+        if not words:
+            return CursorPage[ProductSearchHit](items=[])
+
+        # Каждое слово запроса ищется как префикс: "ноут" находит "ноутбук"
+        tsquery = func.to_tsquery(SEARCH_CONFIG, " & ".join(f"{word}:*" for word in words))
+        rank = func.ts_rank(ProductModel.search_vector, tsquery, type_=Float)
+        match = ProductModel.search_vector.op("@@")(tsquery)
+        if settings.SEARCH_TRIGRAM_ENABLED:
+            # Опечатки в названии и префикс артикула - через триграммные индексы pg_trgm
+            rank = rank + func.word_similarity(q, ProductModel.name, type_=Float)
+            match = or_(
+                match,
+                literal(q).op("<%")(ProductModel.name),
+                ProductModel.sku.ilike(q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"),
             )
-            await session.commit()
-            return updated_product
+
+        hits = select(ProductModel.id, rank.label("rank")).where(match)
+        if category_id is not None:
+            tree = category_tree.tree or await category_tree.reload()
+            hits = hits.where(ProductModel.category_id == any_(
+                literal(sorted(tree.descendant_ids(category_id)), ARRAY(Integer))))
+        hits = hits.subquery("hits")
+
+        # Keyset по (rank desc, id asc): ранг одной и той же строки от запроса к запросу не меняется
+        order_by = (hits.c.rank, hits.c.id)
+        page = select(hits)
+        if cursor:
+            last_rank, last_id = decode_cursor(order_by, cursor)
+            page = page.where(or_(
+                hits.c.rank < last_rank,
+                and_(hits.c.rank == last_rank, hits.c.id > last_id)
+            ))
+        page = page.order_by(hits.c.rank.desc(), hits.c.id).limit(limit + 1).cte("page")
+
+        # ts_headline дорогой - считаем его только для строк страницы
+        query = (
+            select(
+                ProductModel,
+                page.c.rank,
+                func.ts_headline(
+                    SEARCH_CONFIG,
+                    func.coalesce(ProductModel.description, ProductModel.name),
+                    tsquery,
+                    "StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=10"
+                ).label("highlight")
+            )
+            .join(page, page.c.id == ProductModel.id)
+            .order_by(page.c.rank.desc(), page.c.id)
+        )
+        rows = (await session.execute(query)).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(order_by, [rows[-1].rank, rows[-1].ProductModel.id])
+        return CursorPage[ProductSearchHit](
+            items=[
+                ProductSearchHit(
+                    **Product.model_validate(row.ProductModel).model_dump(),
+                    rank=row.rank,
+                    highlight=row.highlight
+                ) for row in rows
+            ],
+            next_cursor=next_cursor
+        )
 
 
 
 class CategoryService:
     @classmethod
-    async def get_categories(cls, *filter, offset: int = 0, limit: int = 100, **filter_by) -> list[Category]:
-        async with async_session_maker() as session:
-            categories = await CategoryDAO.find_all(session, *filter, offset=offset, limit=limit, **filter_by)
+    async def get_categories(
+            cls,
+            session: AsyncSession,
+            *filter,
+            offset: int = 0,
+            limit: int = 100,
+            cursor: Optional[str] = None,
+            **filter_by
+    ) -> CursorPage[Category]:
+        tree = category_tree.tree
+        if tree is not None and not filter and not filter_by:
+            return cls._get_categories_from_tree(tree, offset, limit, cursor)
+
+        categories, next_cursor = await CategoryDAO.find_page(
+            session, *filter, cursor=cursor, offset=offset, limit=limit, **filter_by)
 
         if categories is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Categories not found")
-        return [
-            Category(
-                id=str(item.id),
-                name=item.name,
-                parent_id=item.parent_id
-            ) for item in categories
-        ]
+        return CursorPage[Category](
+            items=[
+                Category(
+                    id=str(item.id),
+                    name=item.name,
+                    parent_id=item.parent_id
+                ) for item in categories
+            ],
+            next_cursor=next_cursor
+        )
+
+    @staticmethod
+    def _get_categories_from_tree(tree, offset: int, limit: int, cursor: Optional[str]) -> CursorPage[Category]:
+        # Та же keyset-пагинация по id, что и в CategoryDAO.find_page, курсоры совместимы
+        order_by = (CategoryModel.id,)
+        start = bisect_right(tree.sorted_ids, decode_cursor(order_by, cursor)[0]) if cursor else offset
+        page_ids = tree.sorted_ids[start:start + limit]
+        next_cursor = None
+        if start + limit < len(tree.sorted_ids) and page_ids:
+            next_cursor = encode_cursor(order_by, [page_ids[-1]])
+        return CursorPage[Category](
+            items=[tree.get(category_id) for category_id in page_ids],
+            next_cursor=next_cursor
+        )
 
     @classmethod
-    async def get_category_by_id(cls, category_id: int) -> Category:
-        async with async_session_maker() as session:
-            category = await CategoryDAO.find_one_or_none(session, CategoryModel.id == category_id)
+    async def get_category_tree(cls) -> CategoryTreeOut:
+        tree = category_tree.tree
+        if tree is None:
+            tree = await category_tree.reload()
+        return CategoryTreeOut(version=tree.version, items=tree.nested())
+
+    @classmethod
+    async def get_category_by_id(cls, session: AsyncSession, category_id: int) -> Category:
+        tree = category_tree.tree
+        if tree is not None:
+            category = tree.get(category_id)
+        else:
+            category = await category_cache.get(session, category_id)
 
         if category is None:
             raise HTTPException(
@@ -160,32 +368,36 @@ class CategoryService:
 
 
     @classmethod
-    async def create_category(cls, category: CategoryCreate) -> Category:
-        async with async_session_maker() as session:
-            category_exist = await CategoryDAO.find_one_or_none(session, name=category.name)
-            if category_exist:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT, detail="Category already exists")
+    async def create_category(cls, session: AsyncSession, category: CategoryCreate) -> Category:
+        category_exist = await CategoryDAO.find_one_or_none(session, name=category.name)
+        if category_exist:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail="Category already exists")
 
-            new_category = await CategoryDAO.add(
-                session,
-                category
-            )
-            await session.commit()
+        new_category = await CategoryDAO.add(
+            session,
+            category
+        )
+        await session.commit()
+        if new_category is not None:
+            await category_tree.add(Category.model_validate(new_category))
+        await invalidate_tags("categories")
 
         return new_category
 
 
 class CartService:
     @classmethod
-    async def get_cart_items(cls, user_id: str) -> list[CartItem]:
-        async with async_session_maker() as session:
-            query = (
-                select(CartItemModel)
-                .where(CartItemModel.user_uuid == user_id)
-            )
-            result = await session.execute(query)
-            cart = result.scalars().all()
+    async def get_cart_items(cls, session: AsyncSession, user_id: str) -> list[CartItem]:
+        if settings.CART_BACKEND == "redis":
+            return await cart_store.get(user_id)
+
+        query = (
+            select(CartItemModel)
+            .where(CartItemModel.user_uuid == user_id)
+        )
+        result = await session.execute(query)
+        cart = result.scalars().all()
 
         if cart is None:
             raise HTTPException(
@@ -193,67 +405,193 @@ class CartService:
         return cart
 
     @classmethod
-    async def add_item_to_cart(cls, item: CartItemCreate, user_id: str) -> CartItem:
-        async with async_session_maker() as session:
-            cartitem_exist = await CartDAO.find_one_or_none(session, product_id=item.product_id)
-            if cartitem_exist:
+    async def get_cart(
+            cls,
+            session: AsyncSession,
+            user_id: str,
+            loader: Optional[ProductLoader] = None
+    ) -> CartDetail:
+        if settings.CART_BACKEND == "redis":
+            # Товары строк корзины - одной пачкой через загрузчик
+            loader = loader or ProductLoader(session)
+            cart_items = await cart_store.get(user_id)
+            products = await loader.load_many([("id", item.product_id) for item in cart_items])
+            return cls._cart_detail([
+                CartLine(**item.model_dump(), product=product)
+                for item, product in zip(cart_items, products) if product is not None
+            ])
+
+        # Строки корзины вместе с товарами одним запросом через JOIN
+        query = (
+            select(CartItemModel)
+            .join(CartItemModel.product)
+            .options(contains_eager(CartItemModel.product))
+            .where(CartItemModel.user_uuid == user_id)
+            .order_by(CartItemModel.id)
+        )
+        return cls._cart_detail([CartLine.model_validate(item) for item in (await session.scalars(query)).all()])
+
+    @staticmethod
+    def _cart_detail(items: list[CartLine]) -> CartDetail:
+        return CartDetail(
+            items=items,
+            total_quantity=sum(item.quantity for item in items),
+            total_price=sum(item.price * item.quantity for item in items),
+        )
+
+    @classmethod
+    async def add_item_to_cart(cls, session: AsyncSession, item: CartItemCreate, user_id: str) -> CartItem:
+        if settings.CART_BACKEND == "redis":
+            snapshot = (await cls._price_snapshots(session, [item.product_id])).get(item.product_id)
+            if snapshot is None:
                 raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT, detail="Cart item already exists")
-
-            new_cart_item = await CartDAO.add(
-                session,
-                CartItemBase(
-                    user_uuid=user_id,
-                    product_id=item.product_id,
-                    quantity=item.quantity,
-                    price=item.price
-                )
-            )
-            await session.commit()
+                    status_code=status.HTTP_404_NOT_FOUND, detail=f"Product by id:{item.product_id} not found")
+            # HINCRBY: повторное добавление товара увеличивает количество
+            return await cart_store.add(user_id, item.product_id, item.quantity, *snapshot)
+
+        # Один upsert вместо проверки и вставки: строка берется из products
+        # вместе с ценой и ее версией, поэтому несуществующий товар просто
+        # не вставится, а повторное добавление увеличит количество и обновит снимок цены
+        stmt = pg_insert(CartItemModel).from_select(
+            ["user_uuid", "product_id", "quantity", "price", "price_version"],
+            select(
+                literal(user_id, UUID), ProductModel.id, literal(item.quantity, Integer),
+                ProductModel.unit_price, ProductModel.price_version
+            ).where(ProductModel.id == item.product_id)
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CartItemModel.user_uuid, CartItemModel.product_id],
+            set_={
+                "quantity": CartItemModel.quantity + stmt.excluded.quantity,
+                "price": stmt.excluded.price,
+                "price_version": stmt.excluded.price_version,
+            }
+        ).returning(CartItemModel)
+        new_cart_item = await session.scalar(stmt)
+        if new_cart_item is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=f"Product by id:{item.product_id} not found")
+        await session.commit()
 
         return new_cart_item
 
     @classmethod
-    async def update_cart_item(cls, item: CartItemUpdate) -> CartItem:
-        async with async_session_maker() as session:
-            cart_item_exist = await CartDAO.find_one_or_none(session, CartItemModel.id == item.id)
-            if cart_item_exist is None:
+    async def set_cart(cls, session: AsyncSession, cart: CartSet, user_id: str) -> list[CartItem]:
+        product_ids = [item.product_id for item in cart.items]
+        if settings.CART_BACKEND == "redis":
+            snapshots = await cls._price_snapshots(session, product_ids)
+            cls._check_cart_products(product_ids, snapshots)
+            return await cart_store.replace(user_id, [
+                CartItem(id=item.product_id, user_uuid=user_id, product_id=item.product_id, quantity=item.quantity,
+                         price=snapshots[item.product_id][0], price_version=snapshots[item.product_id][1])
+                for item in cart.items
+            ])
+
+        # Вся корзина одним запросом: строки не из списка удаляются,
+        # остальные вставляются или перезаписываются upsert-ом
+        ids = literal(product_ids, ARRAY(Integer))
+        lines = select(
+            func.unnest(ids).label("product_id"),
+            func.unnest(literal([item.quantity for item in cart.items], ARRAY(Integer))).label("quantity"),
+        ).cte("lines")
+        removed = (
+            delete(CartItemModel)
+            .where(CartItemModel.user_uuid == user_id, CartItemModel.product_id != all_(ids))
+            .cte("removed")
+        )
+        stmt = pg_insert(CartItemModel).from_select(
+            ["user_uuid", "product_id", "quantity", "price", "price_version"],
+            select(literal(user_id, UUID), ProductModel.id, lines.c.quantity,
+                   ProductModel.unit_price, ProductModel.price_version)
+            .join(ProductModel, ProductModel.id == lines.c.product_id)
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CartItemModel.user_uuid, CartItemModel.product_id],
+            set_={
+                "quantity": stmt.excluded.quantity,
+                "price": stmt.excluded.price,
+                "price_version": stmt.excluded.price_version,
+            }
+        ).returning(CartItemModel).add_cte(removed)
+        items = {item.product_id: item for item in (await session.scalars(stmt)).all()}
+        try:
+            cls._check_cart_products(product_ids, items)
+        except HTTPException:
+            await session.rollback()
+            raise
+        await session.commit()
+
+        return [items[product_id] for product_id in product_ids]
+
+    @staticmethod
+    async def _price_snapshots(session: AsyncSession, product_ids: list[int]) -> dict[int, tuple[float, int]]:
+        # Текущая цена продажи и price_version товаров
+        result = await session.execute(
+            select(ProductModel.id, ProductModel.unit_price, ProductModel.price_version)
+            .where(ProductModel.id == any_(literal(product_ids, ARRAY(Integer))))
+        )
+        return {product_id: (price, price_version) for product_id, price, price_version in result.all()}
+
+    @staticmethod
+    def _check_cart_products(product_ids: list[int], found) -> None:
+        missing = [product_id for product_id in product_ids if product_id not in found]
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Products by id:{', '.join(map(str, missing))} not found")
+
+    @classmethod
+    async def update_cart_item(cls, session: AsyncSession, item: CartItemUpdate) -> CartItem:
+        if settings.CART_BACKEND == "redis":
+            updated_cart_item = await cart_store.set_quantity(item.user_uuid, item.product_id, item.quantity)
+            if updated_cart_item is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
-
-            updated_cart_item = await CartDAO.update(
-                session,
-                CartItemModel.id == item.id,
-                obj_in=item
-            )
-            await session.commit()
             return updated_cart_item
 
+        cart_item_exist = await CartDAO.find_one_or_none(session, CartItemModel.id == item.id)
+        if cart_item_exist is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
+
+        # Меняется только количество: цена в строке - снимок с товара
+        updated_cart_item = await CartDAO.update(
+            session,
+            CartItemModel.id == item.id,
+            obj_in={"quantity": item.quantity}
+        )
+        await session.commit()
+        return updated_cart_item
+
 
     @classmethod
-    async def remove_cart_item(cls, cart_id: int):
-        async with async_session_maker() as session:
-            cartitem_exist = await CartDAO.find_one_or_none(session, id=cart_id)
-            if cartitem_exist is None:
+    async def remove_cart_item(cls, session: AsyncSession, cart_id: int, user_id: str):
+        if settings.CART_BACKEND == "redis":
+            if not await cart_store.remove(user_id, cart_id):
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
-            await CartDAO.delete(
-                session,
-                CartItemModel.id == cart_id
-            )
-            await session.commit()
+            return
+
+        cartitem_exist = await CartDAO.find_one_or_none(session, id=cart_id, user_uuid=user_id)
+        if cartitem_exist is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
+        await CartDAO.delete(
+            session,
+            CartItemModel.id == cart_id
+        )
+        await session.commit()
 
 
 class OrderService:
     @classmethod
-    async def get_orders(cls, user_id: str) -> list[Order]:
-        async with async_session_maker() as session:
-            query = (
-                select(OrderModel)
-                .where(OrderModel.user_uuid == user_id)
-            )
-            result = await session.execute(query)
-            orders = result.scalars().all()
+    async def get_orders(cls, session: AsyncSession, user_id: str) -> list[Order]:
+        query = (
+            select(OrderModel)
+            .where(OrderModel.user_uuid == user_id)
+        )
+        result = await session.execute(query)
+        orders = result.scalars().all()
 
         if orders is None:
             raise HTTPException(
@@ -261,72 +599,204 @@ class OrderService:
         return orders
 
     @classmethod
-    async def create_order(cls, user_id: uuid.UUID) -> Order:
-        async with async_session_maker() as session:
-            # Создаем ордер
-            total_price = 0.0
-            order = OrderCreate(
-                user_uuid=user_id,
-                created_at=datetime.utcnow(),
-                status=OrderStatus.CREATED,
-                total_price=0
-            )
-            # Получаем список товаров в корзине
-            cart_items = await CartService.get_cart_items(str(user_id))
-            # Считаем итоговую сумму товаров
-            for cart_item in cart_items:
-                total_price += cart_item.price * cart_item.quantity
-
-            # Сохраняем ордер
-            order.total_price = total_price
-            new_order = await OrderDAO.add(session, order)
-            await session.commit()
+    async def get_order_detail(cls, session: AsyncSession, user_id: str, order_id: int) -> OrderDetail:
+        # Заказ, затем все его строки с товарами вторым запросом (selectinload + JOIN)
+        query = (
+            select(OrderModel)
+            .where(OrderModel.id == order_id, OrderModel.user_uuid == user_id)
+            .options(selectinload(OrderModel.order_items).joinedload(OrderItemModel.product))
+        )
+        order = await session.scalar(query)
+
+        if order is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
+        return OrderDetail.model_validate(order)
 
-            # Добавляем товары из корзины в ордер и удаляем их из корзины
-            for cart_item in cart_items:
-                add_orders_item = (
-                    insert(OrderItemModel)
-                    .values(
-                        order_id=new_order.id,
-                        product_id=cart_item.product_id,
-                        quantity=cart_item.quantity,
-                        price=cart_item.price
-                    )
+    @classmethod
+    async def create_order(cls, session: AsyncSession, user_id: uuid.UUID) -> Order:
+        if settings.CART_BACKEND == "redis":
+            return await cls._create_order_from_redis_cart(session, user_id)
+
+        # Строки корзины удаляются в том же запросе, что создает заказ
+        cart_lines = (
+            delete(CartItemModel)
+            .where(CartItemModel.user_uuid == user_id)
+            .returning(CartItemModel.product_id, CartItemModel.quantity,
+                       CartItemModel.price, CartItemModel.price_version)
+            .cte("cart_lines")
+        )
+        cart_product_ids = select(CartItemModel.product_id).where(CartItemModel.user_uuid == user_id)
+        try:
+            return await cls._checkout(session, user_id, cart_lines, ProductModel.id.in_(cart_product_ids))
+        except CartPricesChangedException:
+            # Обновляем снимок цен, чтобы клиент показал новые цены и повторил заказ
+            await session.execute(
+                update(CartItemModel)
+                .where(
+                    CartItemModel.user_uuid == user_id,
+                    CartItemModel.product_id == ProductModel.id,
+                    CartItemModel.price_version != ProductModel.price_version
                 )
-                await session.execute(add_orders_item)
-                await session.commit()
-
-                # Удаляем товары из корзины
-                await CartDAO.delete(session, CartItemModel.id == cart_item.id)
-                await session.commit()
+                .values(price=ProductModel.unit_price, price_version=ProductModel.price_version)
+            )
+            await session.commit()
+            raise
 
-        return new_order
+    @classmethod
+    async def _create_order_from_redis_cart(cls, session: AsyncSession, user_id: uuid.UUID) -> Order:
+        checkout_key, items = await cart_store.take(user_id)
+        if not items:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Cart is empty")
+
+        # Корзина из redis приходит в запрос тремя массивами
+        cart_lines = select(
+            func.unnest(literal([item.product_id for item in items], ARRAY(Integer))).label("product_id"),
+            func.unnest(literal([item.quantity for item in items], ARRAY(Integer))).label("quantity"),
+            func.unnest(literal([item.price for item in items], ARRAY(Float))).label("price"),
+            func.unnest(literal([item.price_version for item in items], ARRAY(Integer))).label("price_version"),
+        ).cte("cart_lines")
+        try:
+            order = await cls._checkout(
+                session, user_id, cart_lines,
+                ProductModel.id == any_(literal([item.product_id for item in items], ARRAY(Integer))))
+        except BaseException as e:
+            await cart_store.restore(user_id, checkout_key, items)
+            if isinstance(e, CartPricesChangedException):
+                await cart_store.set_prices(
+                    user_id, await CartService._price_snapshots(session, [item.product_id for item in items]))
+            raise
+        await cart_store.discard(user_id, checkout_key)
+        return order
 
     @classmethod
-    async def remove_order(cls, order_id: int):
-        async with async_session_maker() as session:
-            order_exist = await OrderDAO.find_one_or_none(session, id=order_id)
-            if order_exist is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="Order item not found")
-            await OrderDAO.delete(
-                session,
-                OrderItemModel.id == order_id
+    async def _checkout(cls, session: AsyncSession, user_id: uuid.UUID, cart_lines, cart_products) -> Order:
+        # Блокируем товары корзины всегда в порядке id, чтобы параллельные
+        # checkout-ы с пересекающимися товарами не ловили deadlock
+        await session.execute(
+            select(ProductModel.id)
+            .where(cart_products)
+            .order_by(ProductModel.id)
+            .with_for_update()
+        )
+
+        # Весь checkout - один запрос и одна транзакция: из строк корзины
+        # резервируется остаток, считается сумма заказа и вставляются позиции заказа
+        wanted = (
+            select(cart_lines.c.product_id, func.sum(cart_lines.c.quantity).label("quantity"))
+            .group_by(cart_lines.c.product_id)
+            .cte("wanted")
+        )
+        # Условный декремент: строка без достаточного остатка просто не обновится
+        reserved = (
+            update(ProductModel)
+            .where(
+                ProductModel.id == wanted.c.product_id,
+                ProductModel.stock >= wanted.c.quantity
             )
-            await session.commit()
+            .values(stock=ProductModel.stock - wanted.c.quantity)
+            .returning(ProductModel.id, ProductModel.category_id, ProductModel.price,
+                       ProductModel.discount_price, ProductModel.stock,
+                       (ProductModel.stock + wanted.c.quantity).label("old_stock"))
+            .cte("reserved")
+        )
+        # HAVING не дает создать заказ из пустой корзины
+        new_order = (
+            insert(OrderModel)
+            .from_select(
+                ["user_uuid", "created_at", "status", "total_price"],
+                select(
+                    literal(user_id, UUID),
+                    literal(datetime.utcnow()),
+                    literal(OrderStatus.CREATED.value),
+                    func.sum(cart_lines.c.price * cart_lines.c.quantity)
+                ).having(func.count() > 0)
+            )
+            .returning(OrderModel.id, OrderModel.user_uuid, OrderModel.created_at,
+                       OrderModel.status, OrderModel.total_price)
+            .cte("new_order")
+        )
+        new_order_items = (
+            insert(OrderItemModel)
+            .from_select(
+                ["order_id", "product_id", "quantity", "price"],
+                select(new_order.c.id, cart_lines.c.product_id,
+                       cart_lines.c.quantity, cart_lines.c.price)
+                .select_from(new_order.join(cart_lines, true()))
+            )
+            .cte("new_order_items")
+        )
+
+        # Строки, цена которых снята со старой версии товара. Товары заблокированы,
+        # так что версии не поменяются до конца транзакции
+        stale = (
+            select(func.count())
+            .select_from(cart_lines.join(ProductModel, ProductModel.id == cart_lines.c.product_id))
+            .where(ProductModel.price_version != cart_lines.c.price_version)
+        )
+
+        result = await session.execute(
+            select(
+                new_order,
+                select(func.count()).select_from(wanted).scalar_subquery().label("wanted_count"),
+                select(func.count()).select_from(reserved).scalar_subquery().label("reserved_count"),
+                stale.scalar_subquery().label("stale_count"),
+                # Товары, которые checkout распродал: для счетчиков фасетов "в наличии"
+                select(func.json_agg(literal_column("reserved"), type_=JSON))
+                .select_from(reserved)
+                .where(reserved.c.stock <= 0, reserved.c.old_stock > 0)
+                .scalar_subquery().label("sold_out"),
+                select(func.array_agg(reserved.c.id)).select_from(reserved)
+                .scalar_subquery().label("reserved_ids"),
+            ).add_cte(new_order_items)
+        )
+        created = result.one_or_none()
+        if created is None:
+            await session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Cart is empty")
+        if created.stale_count:
+            await session.rollback()
+            raise CartPricesChangedException()
+        if created.reserved_count != created.wanted_count:
+            # Хотя бы одного товара не хватило - откатываем и корзину, и резерв
+            await session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail="Not enough products in stock")
+        if created.sold_out:
+            await FacetService.record_stock_changes(session, created.sold_out)
+        await session.commit()
+        # Остатки изменились: карточки товаров в кэше устарели
+        for product_id in created.reserved_ids:
+            await product_cache.invalidate(product_id)
+        await invalidate_tags("products", *(f"product:{product_id}" for product_id in created.reserved_ids))
+
+        return Order.model_validate(created, from_attributes=True)
 
     @classmethod
-    async def update_order(cls, order_id: int, order: OrderUpdate) -> Order:
-        async with async_session_maker() as session:
-            order_exist = await OrderDAO.find_one_or_none(session, OrderModel.id == order_id)
-            if order_exist is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
+    async def remove_order(cls, session: AsyncSession, order_id: int):
+        order_exist = await OrderDAO.find_one_or_none(session, id=order_id)
+        if order_exist is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Order item not found")
+        await OrderDAO.delete(
+            session,
+            OrderItemModel.id == order_id
+        )
+        await session.commit()
 
-            updated_order = await OrderDAO.update(
-                session,
-                OrderModel.id == order_id,
-                obj_in=order
-            )
-            await session.commit()
-            return updated_order
+    @classmethod
+    async def update_order(cls, session: AsyncSession, order_id: int, order: OrderUpdate) -> Order:
+        order_exist = await OrderDAO.find_one_or_none(session, OrderModel.id == order_id)
+        if order_exist is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
+
+        updated_order = await OrderDAO.update(
+            session,
+            OrderModel.id == order_id,
+            obj_in=order
+        )
+        await session.commit()
+        return updated_order
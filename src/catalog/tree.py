@@ -0,0 +1,179 @@
+import asyncio
+import uuid
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from loguru import logger as log
+from sqlalchemy import select
+
+from .models import CategoryModel
+from .schemas import Category, CategoryTreeNode
+from ..cache import invalidation_bus
+from ..database import async_session_maker
+
+
+class CategoryNode:
+    __slots__ = ("id", "name", "parent_id", "children", "depth", "tin", "tout", "path", "descendants")
+
+    def __init__(self, id: int, name: str, parent_id: Optional[int]):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.children: List[int] = []
+        self.depth = 0
+        # Интервал в эйлеровом обходе: потомки узла - это ровно order[tin:tout]
+        self.tin = 0
+        self.tout = 0
+        # id от корня до узла включительно
+        self.path: Tuple[int, ...] = ()
+        # Сам узел и все его потомки на любую глубину
+        self.descendants: FrozenSet[int] = frozenset()
+
+
+class CategoryTree:
+    # Неизменяемый снимок дерева категорий. Любое изменение - новый снимок
+    # со следующей версией, поэтому читатели никогда не видят дерево наполовину
+    def __init__(self, categories: Iterable[Tuple[int, str, Optional[int]]], version: int = 1):
+        self.version = version
+        self.nodes: Dict[int, CategoryNode] = {
+            id: CategoryNode(id, name, parent_id) for id, name, parent_id in categories
+        }
+        self.roots: List[int] = []
+        for node in sorted(self.nodes.values(), key=lambda node: node.id):
+            parent = self.nodes.get(node.parent_id) if node.parent_id is not None else None
+            if parent is None:
+                self.roots.append(node.id)
+            else:
+                parent.children.append(node.id)
+        self.order: List[int] = []
+        self._index()
+        self.sorted_ids: List[int] = sorted(self.nodes)
+
+    def _index(self) -> None:
+        # Итеративный обход в глубину, чтобы глубина дерева не упиралась в рекурсию
+        visited = set()
+        for root_id in self.roots:
+            stack = [(root_id, False)]
+            while stack:
+                node_id, leaving = stack.pop()
+                node = self.nodes[node_id]
+                if leaving:
+                    node.tout = len(self.order)
+                    node.descendants = frozenset(self.order[node.tin:node.tout])
+                    continue
+                if node_id in visited:
+                    continue
+                visited.add(node_id)
+                parent = self.nodes.get(node.parent_id) if node.parent_id is not None else None
+                if parent is not None and parent.id in visited:
+                    node.depth = parent.depth + 1
+                    node.path = parent.path + (node_id,)
+                else:
+                    node.path = (node_id,)
+                node.tin = len(self.order)
+                self.order.append(node_id)
+                stack.append((node_id, True))
+                for child_id in reversed(node.children):
+                    stack.append((child_id, False))
+        if len(visited) != len(self.nodes):
+            # Циклы по parent_id недостижимы из корней - в индекс не попадают
+            log.warning("Category tree has {} unreachable categories", len(self.nodes) - len(visited))
+            for node_id in set(self.nodes) - visited:
+                del self.nodes[node_id]
+
+    def __contains__(self, category_id: int) -> bool:
+        return category_id in self.nodes
+
+    def get(self, category_id: int) -> Optional[Category]:
+        node = self.nodes.get(category_id)
+        if node is None:
+            return None
+        return Category(id=node.id, name=node.name, parent_id=node.parent_id)
+
+    def descendant_ids(self, category_id: int) -> FrozenSet[int]:
+        node = self.nodes.get(category_id)
+        return node.descendants if node is not None else frozenset()
+
+    def is_ancestor(self, ancestor_id: int, category_id: int) -> bool:
+        ancestor = self.nodes.get(ancestor_id)
+        node = self.nodes.get(category_id)
+        if ancestor is None or node is None:
+            return False
+        return ancestor.tin <= node.tin and node.tout <= ancestor.tout
+
+    def breadcrumbs(self, category_id: int) -> List[Category]:
+        node = self.nodes.get(category_id)
+        if node is None:
+            return []
+        return [self.get(node_id) for node_id in node.path]
+
+    def path_names(self, category_id: int, separator: str = " / ") -> str:
+        node = self.nodes.get(category_id)
+        if node is None:
+            return ""
+        return separator.join(self.nodes[node_id].name for node_id in node.path)
+
+    def nested(self) -> List[CategoryTreeNode]:
+        def build(node_id: int) -> CategoryTreeNode:
+            node = self.nodes[node_id]
+            return CategoryTreeNode(
+                id=node.id,
+                name=node.name,
+                parent_id=node.parent_id,
+                children=[build(child_id) for child_id in node.children]
+            )
+        return [build(root_id) for root_id in self.roots]
+
+    def with_category(self, category: Category) -> "CategoryTree":
+        categories = [(node.id, node.name, node.parent_id) for node in self.nodes.values()]
+        categories.append((category.id, category.name, category.parent_id))
+        return CategoryTree(categories, version=self.version + 1)
+
+
+class CategoryTreeIndex:
+    # Дерево категорий в памяти воркера. Строится в lifespan, после
+    # create_category патчится локально, остальные воркеры перечитывают его
+    # из базы по сообщению из шины инвалидаций
+    message = "category-tree:reload"
+
+    def __init__(self):
+        self.tree: Optional[CategoryTree] = None
+        self._reload_task: Optional[asyncio.Task] = None
+        # Свое же сообщение воркер пропускает - его дерево уже пропатчено
+        self._origin = uuid.uuid4().hex
+
+    @property
+    def version(self) -> int:
+        return self.tree.version if self.tree is not None else 0
+
+    async def reload(self) -> CategoryTree:
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(CategoryModel.id, CategoryModel.name, CategoryModel.parent_id)
+            )
+            rows = result.all()
+        self.tree = CategoryTree(rows, version=self.version + 1)
+        log.info("Category tree v{} loaded: {} categories", self.tree.version, len(self.tree.nodes))
+        return self.tree
+
+    async def add(self, category: Category) -> None:
+        if self.tree is not None:
+            self.tree = self.tree.with_category(category)
+        await invalidation_bus.publish(f"{self.message}:{self._origin}")
+
+    def on_invalidation(self, message: str) -> None:
+        prefix, _, origin = message.rpartition(":")
+        if prefix != self.message or origin == self._origin or self.tree is None:
+            return
+        if self._reload_task is not None and not self._reload_task.done():
+            return
+        self._reload_task = asyncio.create_task(self._reload_quietly())
+
+    async def _reload_quietly(self) -> None:
+        try:
+            await self.reload()
+        except Exception:
+            log.exception("Category tree reload failed")
+
+
+category_tree = CategoryTreeIndex()
+invalidation_bus.subscribe(category_tree.on_invalidation)
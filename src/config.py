@@ -1,4 +1,4 @@
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -26,10 +26,94 @@ class Settings(BaseSettings):
     def TEST_DATABASE_URL(self):
         return f"postgresql+asyncpg://{self.TEST_POSTGRES_USER}:{self.TEST_POSTGRES_PASSWORD}@{self.TEST_POSTGRES_HOST}:{self.TEST_POSTGRES_PORT}/{self.TEST_POSTGRES_DB}"
 
+    REDIS_URL: str = "redis://localhost/0"
+    # memory - кэш ответов в памяти процесса (тесты и деплой в один узел)
+    CACHE_BACKEND: Literal["redis", "memory"] = "redis"
+    CACHE_EXPIRE_SECONDS: int = 60
+    # Двухуровневый кэш сущностей: L1 - LRU в памяти воркера, L2 - redis.
+    # После L1_CACHE_TTL_SECONDS запись еще L1_CACHE_STALE_SECONDS отдается
+    # устаревшей, пока в фоне загружается свежая (stale-while-revalidate)
+    L1_CACHE_MAX_SIZE: int = 10000
+    L1_CACHE_TTL_SECONDS: int = 30
+    L1_CACHE_STALE_SECONDS: int = 30
+    L2_CACHE_TTL_SECONDS: int = 300
+
+    # Массовый импорт товаров: строк в одной пачке COPY + upsert,
+    # сколько ошибок по строкам вернуть в отчете и максимальная длина строки файла
+    IMPORT_BATCH_SIZE: int = 5000
+    IMPORT_MAX_ERRORS: int = 1000
+    IMPORT_MAX_LINE_LENGTH: int = 1_000_000
+
+    # Поиск по товарам: без расширения pg_trgm остается только полнотекстовый поиск
+    SEARCH_TRIGRAM_ENABLED: bool = True
+
+    # Где хранятся корзины: postgres (cart_items) или redis (hash на пользователя).
+    # При CART_WRITE_BEHIND корзины из redis фоном копируются в cart_items
+    CART_BACKEND: Literal["postgres", "redis"] = "postgres"
+    CART_TTL_SECONDS: int = 30 * 24 * 3600
+    CART_WRITE_BEHIND: bool = False
+    CART_WRITE_BEHIND_INTERVAL_SECONDS: float = 5.0
+    CART_WRITE_BEHIND_BATCH_SIZE: int = 500
+    # Сколько строк можно передать в PUT /user/cart
+    CART_MAX_LINES: int = 200
+
+    # Сколько товаров можно запросить одним POST /catalog/products/batch
+    PRODUCT_BATCH_MAX_SIZE: int = 100
+
+    # Счетчики фасетов берутся из таблицы product_facet_counts, а не считаются по products.
+    # Работает для запросов без фильтра по диапазону цены
+    FACET_COUNTS_ENABLED: bool = False
+
+    # Выгрузка каталога: строк в одной пачке серверного курсора
+    EXPORT_CHUNK_ROWS: int = 5000
+
+    # ALGORITHM: HS256/HS384/HS512 - SECRET_KEY общий секрет;
+    # RS256/EdDSA - SECRET_KEY закрытый ключ в PEM (пустой на узлах, которые только
+    # проверяют токены), JWT_PUBLIC_KEY - открытый ключ, если его не вывести из закрытого
     SECRET_KEY: str
     ALGORITHM: str
+    JWT_PUBLIC_KEY: Optional[str] = None
+    # Сколько последних проверенных access-токенов помнить (0 - не кэшировать)
+    TOKEN_VERIFY_CACHE_SIZE: int = 10000
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
     REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    # Где хранятся refresh-сессии: postgres (refresh_sessions) или redis (ключи с TTL).
+    # В postgres просроченные сессии раз в интервал удаляются пачками
+    REFRESH_SESSION_BACKEND: Literal["postgres", "redis"] = "postgres"
+    REFRESH_SESSION_SWEEP_INTERVAL_SECONDS: float = 300.0
+    REFRESH_SESSION_SWEEP_BATCH_SIZE: int = 1000
+    # Повторное предъявление уже обмененного refresh-токена отзывает всю его семью
+    # (все сессии, выросшие из того же логина). Параллельные refresh с одним
+    # токеном тоже считаются повтором
+    REFRESH_REUSE_DETECTION: bool = True
+
+    # Кэш принципала (id + флаги пользователя) для get_current_user
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 30
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10000
+    # Флаги is_active/is_verified/is_superuser передаются в подписанном access-токене,
+    # и get_current_user вообще не ходит в базу. Изменения флагов применяются
+    # только после перевыпуска токена (не позже ACCESS_TOKEN_EXPIRE_MINUTES)
+    AUTH_CLAIMS_IN_TOKEN: bool = False
+
+    # Пул потоков для bcrypt: сколько хэшей считается одновременно
+    # и сколько запросов может ждать своей очереди, остальные получают 503
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_SIZE: int = 64
+
+    # /metrics в формате Prometheus. При нескольких воркерах (gunicorn) нужен общий
+    # для них METRICS_DIR: каждый воркер пишет туда снимок своих метрик, и /metrics
+    # любого воркера отдает сумму. Каталог стоит очищать при перезапуске сервиса
+    METRICS_ENABLED: bool = True
+    METRICS_DIR: Optional[str] = None
+    METRICS_FLUSH_INTERVAL_SECONDS: float = 5.0
+    METRICS_ROUTE_CACHE_SIZE: int = 10000
+
+    # Монитор запросов к базе для разработки: на каждый HTTP-запрос считает SQL-запросы,
+    # пишет в лог запросы дольше QUERY_MONITOR_SLOW_MS и формы запросов, повторенные
+    # QUERY_MONITOR_REPEAT_THRESHOLD раз и больше (N+1). В тестах доступен через query_budget
+    QUERY_MONITOR_ENABLED: bool = False
+    QUERY_MONITOR_SLOW_MS: float = 100.0
+    QUERY_MONITOR_REPEAT_THRESHOLD: int = 3
 
     model_config = SettingsConfigDict(env_file=".env", extra="allow")
 
@@ -6,4 +6,8 @@ DB_NAMING_CONVENTION = {
     "ck": "%(table_name)s_%(constraint_name)s_check",
     "fk": "%(table_name)s_%(column_0_name)s_fkey",
     "pk": "%(table_name)s_pkey",
-}
\ No newline at end of file
+}
+
+# Границы ценовых корзин для фасетов каталога: корзина i - цены от PRICE_BUCKETS[i - 1]
+# до PRICE_BUCKETS[i], корзина 0 - ниже первой границы (как width_bucket в Postgres)
+PRICE_BUCKETS = (0, 1000, 5000, 10000, 50000)
@@ -1,3 +1,5 @@
+from typing import AsyncGenerator
+
 from typing_extensions import Annotated
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
@@ -6,6 +8,8 @@ from sqlalchemy import String, MetaData, NullPool
 
 from .config import settings
 from .constants import DB_NAMING_CONVENTION
+from .metrics import InstrumentedQueuePool, instrument_engine
+from .query_monitor import install_query_monitor
 
 str_256 = Annotated[str, 256]
 
@@ -36,9 +40,15 @@ if settings.MODE == "TEST":
 else:
     DATABASE_URL = settings.DATABASE_URL
     DATABASE_PARAMS = {'pool_size': 10, 'pool_pre_ping': True, 'max_overflow': 0, 'future': True}
+    if settings.METRICS_ENABLED:
+        DATABASE_PARAMS['poolclass'] = InstrumentedQueuePool
 
 
 engine = create_async_engine(DATABASE_URL, **DATABASE_PARAMS)
+if settings.METRICS_ENABLED:
+    instrument_engine(engine)
+if settings.QUERY_MONITOR_ENABLED or settings.MODE == "TEST":
+    install_query_monitor(engine)
 
 async_session_maker = async_sessionmaker(
     engine,
@@ -48,6 +58,14 @@ async_session_maker = async_sessionmaker(
     class_=AsyncSession
 )
 
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    # Одна сессия на весь запрос: ее разделяют зависимости авторизации, сервисы и DAO.
+    # Соединение берется из пула только при первом запросе к базе и держится
+    # до commit/закрытия, поэтому ответ из кэша соединение не занимает
+    async with async_session_maker() as session:
+        yield session
+
 # //////////////////////////////////////////////////////////////////////////////////////////////////////
 
 # async def main():
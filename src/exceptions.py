@@ -13,4 +13,21 @@ class TokenExpiredException(HTTPException):
 
 class InvalidCredentialsException(HTTPException):
     def __init__(self):
-        super().__init__(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password")
\ No newline at end of file
+        super().__init__(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password")
+
+class InvalidCursorException(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+class InvalidImportFileException(HTTPException):
+    def __init__(self, detail: str):
+        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid import file: {detail}")
+
+
+class CartPricesChangedException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Prices of products in the cart have changed, review the cart and try again"
+        )
@@ -3,16 +3,26 @@ from loguru import logger as log
 
 # FastAPI
 from fastapi import FastAPI, Request, Depends, HTTPException, status
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
+from fastapi.encoders import jsonable_encoder
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.backends.inmemory import InMemoryBackend
 from contextlib import asynccontextmanager
 
 # Database
 from redis import asyncio as aioredis
 
+from src.config import settings
+from src.metrics import MetricsMiddleware, registry as metrics_registry
+from src.query_monitor import QueryMonitorMiddleware
+from src.cache import init_entity_caches, close_entity_caches
+from src.catalog.tree import category_tree
+from src.catalog.cart_store import cart_store
+from src.users.session_store import postgres_session_store, redis_session_store
+
 # Routes
 from src.users.router import auth_router, user_router
 from src.catalog.router import catalog_router, cart_router, order_router
@@ -21,10 +31,38 @@ from src.catalog.router import catalog_router, cart_router, order_router
 @asynccontextmanager
 async def lifespan(application: FastAPI):
     log.info("🚀 Starting application")
-    # Подключаемся к redis для кэширование результатов запросов
-    redis = aioredis.from_url("redis://localhost/0", encoding="utf8", decode_responses=True)
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+    # Подключаемся к redis для кэширование результатов запросов.
+    # JsonCoder из fastapi-cache ждет bytes, поэтому без decode_responses
+    redis = None
+    if "redis" in (settings.CACHE_BACKEND, settings.CART_BACKEND, settings.REFRESH_SESSION_BACKEND):
+        redis = aioredis.from_url(settings.REDIS_URL)
+    if settings.CACHE_BACKEND == "memory":
+        FastAPICache.init(InMemoryBackend(), prefix="fastapi-cache", expire=settings.CACHE_EXPIRE_SECONDS)
+    else:
+        FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache", expire=settings.CACHE_EXPIRE_SECONDS)
+    # L2 кэша сущностей и pub/sub инвалидаций между воркерами - тот же redis
+    await init_entity_caches(redis if settings.CACHE_BACKEND == "redis" else None)
+    # Корзины в redis (CART_BACKEND=redis) через то же подключение
+    if settings.CART_BACKEND == "redis":
+        await cart_store.connect(redis)
+    # Refresh-сессии: в redis живут по TTL, в postgres их чистит фоновый sweeper
+    if settings.REFRESH_SESSION_BACKEND == "redis":
+        await redis_session_store.connect(redis)
+    else:
+        await postgres_session_store.start()
+    # Дерево категорий держим в памяти воркера. Если база недоступна на старте,
+    # сервисы работают через рекурсивный CTE, пока дерево не загрузится
+    try:
+        await category_tree.reload()
+    except Exception:
+        log.exception("Category tree is not loaded")
+    await metrics_registry.start()
     yield
+    await metrics_registry.close()
+    await cart_store.close()
+    await postgres_session_store.close()
+    await redis_session_store.close()
+    await close_entity_caches()
     log.info("⛔ Stopping application")
 
 
@@ -38,6 +76,12 @@ app.add_middleware(
                    "Authorization"],
 )
 
+if settings.QUERY_MONITOR_ENABLED:
+    app.add_middleware(QueryMonitorMiddleware)
+# Снаружи остальных middleware: в задержку входит все, что происходит с запросом
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, routes=app.routes)
+
 app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(catalog_router)
@@ -49,10 +93,16 @@ app.include_router(order_router)
 def validation_exception_handler(request: Request, exc: RequestValidationError):
     return JSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-        content={"detail": exc.errors()},
+        # В ctx ошибок pydantic могут лежать исключения - без jsonable_encoder ответ не сериализуется
+        content={"detail": jsonable_encoder(exc.errors())},
     )
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # Маршрут для отображения главной страницы
 @app.get("/", response_class=HTMLResponse)
 def home():
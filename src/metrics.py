@@ -0,0 +1,324 @@
+import asyncio
+import json
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger as log
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.routing import Match
+
+from .config import settings
+
+
+# Маршрут текущего запроса: им помечаются запросы к базе, сделанные внутри запроса
+current_route: ContextVar[str] = ContextVar("current_route", default="")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def snapshot(self) -> list:
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+    @staticmethod
+    def merge(merged: dict, snapshot: list) -> None:
+        for labels, value in snapshot:
+            merged[tuple(labels)] = merged.get(tuple(labels), 0) + value
+
+    def render(self, merged: dict) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                for labels, value in sorted(merged.items())]
+
+
+class Gauge(Counter):
+    # Значения гейджей воркеров суммируются (запросы в обработке, соединения пулов)
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) - value
+
+    def set(self, labels: tuple, value: float) -> None:
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # По меткам: счетчики по корзинам (последняя - +Inf, без накопления) и сумма
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        item = self.values.get(labels)
+        if item is None:
+            item = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def snapshot(self) -> list:
+        return [[list(labels), counts, total] for labels, (counts, total) in self.values.items()]
+
+    @staticmethod
+    def merge(merged: dict, snapshot: list) -> None:
+        for labels, counts, total in snapshot:
+            item = merged.setdefault(tuple(labels), [[0] * len(counts), 0.0])
+            item[0] = [a + b for a, b in zip(item[0], counts)]
+            item[1] += total
+
+    def render(self, merged: dict) -> List[str]:
+        lines = []
+        for labels, (counts, total) in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    # Метрики живут в памяти воркера и обновляются без блокировок (один event loop).
+    # При METRICS_DIR каждый воркер раз в METRICS_FLUSH_INTERVAL_SECONDS пишет снимок
+    # в свой файл, а /metrics любого воркера складывает свои данные и файлы остальных.
+    # Гейджи из файлов, которые давно не обновлялись (воркер умер), не учитываются
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.collectors: List[Callable[[], None]] = []
+        self._file: Optional[str] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        # Вызывается перед снимком: гейджи, которые дешевле прочитать, чем поддерживать
+        self.collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        for collector in self.collectors:
+            collector()
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _worker_snapshots(self) -> List[Tuple[dict, bool]]:
+        snapshots = [(self.snapshot(), True)]
+        if not settings.METRICS_DIR:
+            return snapshots
+        stale_after = time.time() - 3 * settings.METRICS_FLUSH_INTERVAL_SECONDS
+        for entry in os.scandir(settings.METRICS_DIR):
+            if not entry.name.endswith(".json") or entry.path == self._file:
+                continue
+            try:
+                with open(entry.path) as file:
+                    snapshots.append((json.load(file), entry.stat().st_mtime >= stale_after))
+            except (OSError, ValueError):
+                # Файл удалили или пишут прямо сейчас - пропускаем до следующего сбора
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        merged: Dict[str, dict] = {name: {} for name in self.metrics}
+        for snapshot, alive in self._worker_snapshots():
+            for name, metric in self.metrics.items():
+                if name in snapshot and (alive or metric.kind != "gauge"):
+                    metric.merge(merged[name], snapshot[name])
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(merged[name]))
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        if self._file is None:
+            return
+        # Через временный файл и rename: читатель не увидит файл наполовину
+        tmp = f"{self._file}.tmp"
+        with open(tmp, "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(tmp, self._file)
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(settings.METRICS_FLUSH_INTERVAL_SECONDS)
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Metrics flush failed")
+
+    async def start(self) -> None:
+        if not settings.METRICS_DIR:
+            return
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        # Время старта в имени: новый воркер с тем же pid не затрет счетчики умершего
+        self._file = os.path.join(settings.METRICS_DIR, f"{os.getpid()}-{time.time_ns()}.json")
+        self.flush()
+        self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self.flush()
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_requests_in_progress = registry.gauge(
+    "http_requests_in_progress", "HTTP requests being processed", ("method", "route"))
+db_statement_duration = registry.histogram(
+    "db_statement_duration_seconds", "SQL statement execution time by route", ("route", "operation"))
+db_pool_checkout_duration = registry.histogram(
+    "db_pool_checkout_seconds", "Time to get a connection from the pool, including waiting for a free one")
+db_pool_connections = registry.gauge(
+    "db_pool_connections", "Pool connections: capacity, checked out and callers waiting", ("state",))
+password_hash_duration = registry.histogram(
+    "password_hash_duration_seconds", "bcrypt time including the wait for a worker thread", ("operation",))
+
+
+class MetricsMiddleware:
+    # ASGI middleware: задержка, статусы и запросы в обработке по шаблону маршрута
+    # (/catalog/products/{product_id}, а не по конкретному пути)
+    def __init__(self, app, routes: list):
+        self.app = app
+        self.routes = routes
+        self._route_by_path: Dict[tuple, str] = {}
+
+    def _route(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        route = self._route_by_path.get(key)
+        if route is None:
+            route = "<unmatched>"
+            for candidate in self.routes:
+                match, _ = candidate.matches(scope)
+                if match == Match.FULL:
+                    route = candidate.path
+                    break
+            # Путей с разными id много - кэш просто сбрасывается, когда разрастается
+            if len(self._route_by_path) >= settings.METRICS_ROUTE_CACHE_SIZE:
+                self._route_by_path.clear()
+            self._route_by_path[key] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        labels = (method, route)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = current_route.set(route)
+        http_requests_in_progress.inc(labels)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_duration.observe(labels, time.perf_counter() - started)
+            http_requests_in_progress.dec(labels)
+            http_requests.inc((method, route, str(status_code)))
+            current_route.reset(token)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    # Пул, который замеряет получение соединения: при исчерпании pool_size
+    # сюда входит ожидание освободившегося соединения
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+
+    def connect(self):
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            self.waiting -= 1
+            db_pool_checkout_duration.observe((), time.perf_counter() - started)
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip()[:16].split(None, 1)[0].upper() if statement.strip() else ""
+
+
+def instrument_engine(engine) -> None:
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_statement_duration.observe(
+            (current_route.get(), _operation(statement)), time.perf_counter() - context._metrics_started)
+
+    def collect_pool() -> None:
+        pool = sync_engine.pool
+        if not isinstance(pool, InstrumentedQueuePool):
+            return
+        db_pool_connections.set(("capacity",), pool.size() + max(pool._max_overflow, 0))
+        db_pool_connections.set(("checked_out",), pool.checkedout())
+        db_pool_connections.set(("waiting",), pool.waiting)
+
+    registry.add_collector(collect_pool)
@@ -0,0 +1,66 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Generic, List, Optional, Sequence, TypeVar
+
+from pydantic import BaseModel, Field
+
+from .exceptions import InvalidCursorException
+
+ItemType = TypeVar("ItemType")
+
+
+class CursorPage(BaseModel, Generic[ItemType]):
+    items: List[ItemType]
+    # Передается в cursor= для получения следующей страницы, None - страниц больше нет
+    next_cursor: Optional[str] = Field(None)
+
+
+def _key_name(order_by: Sequence[Any]) -> str:
+    return ",".join(column.key for column in order_by)
+
+
+def _dump_value(value: Any) -> Any:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _load_value(column: Any, value: Any) -> Any:
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is uuid.UUID:
+        return uuid.UUID(value)
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type in (int, float) and not isinstance(value, (int, float)):
+        raise ValueError(value)
+    return value
+
+
+def encode_cursor(order_by: Sequence[Any], values: Sequence[Any]) -> str:
+    # Курсор непрозрачен для клиента: ключ сортировки + значения последней строки страницы
+    payload = json.dumps(
+        {"k": _key_name(order_by), "v": [_dump_value(value) for value in values]},
+        separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(order_by: Sequence[Any], cursor: str) -> list[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        # Курсор от другой сортировки не подходит
+        if payload["k"] != _key_name(order_by) or len(payload["v"]) != len(order_by):
+            raise ValueError(payload)
+        return [_load_value(column, value) for column, value in zip(order_by, payload["v"])]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursorException
@@ -0,0 +1,134 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from loguru import logger as log
+from sqlalchemy import event
+
+from .config import settings
+
+
+# Отладочный учет запросов к базе для разработки и тестов (QUERY_MONITOR_ENABLED).
+# Внутри track_queries считаются все запросы, сделанные в этом контексте, включая
+# порожденные им задачи. Запросы приводятся к "форме" без значений параметров:
+# одна и та же форма много раз за запрос - признак N+1
+
+_PARAMETER = re.compile(r"\$\d+|%\(\w+\)s")
+_PARAMETER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_ROWS = re.compile(r"\(\?\.\.\.\)(?:\s*,\s*\(\?\.\.\.\))+|\(\?\)(?:\s*,\s*\(\?\))+")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    # IN ($1, $2, $3) и VALUES (...), (...) с разным числом значений - одна форма
+    shape = _PARAMETER.sub("?", statement)
+    shape = _PARAMETER_LIST.sub("?...", shape)
+    shape = _ROWS.sub("(?...)...", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+class QueryStats:
+    def __init__(self, label: str):
+        self.label = label
+        self.count = 0
+        self.duration = 0.0
+        self.shapes: Counter = Counter()
+        self.sources: Dict[str, set] = {}
+        self.slow: List[tuple[str, float]] = []
+
+    def record(self, shape: str, duration: float, source: Optional[str]) -> None:
+        self.count += 1
+        self.duration += duration
+        self.shapes[shape] += 1
+        if source is not None:
+            self.sources.setdefault(shape, set()).add(source)
+
+    def repeated(self, threshold: Optional[int] = None) -> Dict[str, int]:
+        threshold = settings.QUERY_MONITOR_REPEAT_THRESHOLD if threshold is None else threshold
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+    def describe(self) -> str:
+        lines = [f"{self.label}: {self.count} statements, {self.duration * 1000:.1f} ms"]
+        for shape, count in self.shapes.most_common():
+            sources = ", ".join(sorted(self.sources.get(shape, ())))
+            lines.append(f"  {count}x {shape[:300]}" + (f"  [{sources}]" if sources else ""))
+        return "\n".join(lines)
+
+    def report(self) -> None:
+        for shape, count in self.repeated().items():
+            sources = ", ".join(sorted(self.sources.get(shape, ()))) or "-"
+            log.warning("Possible N+1 in {}: {} identical statements from {}: {}",
+                        self.label, count, sources, shape[:300])
+        log.debug("{}: {} statements, {:.1f} ms in database", self.label, self.count, self.duration * 1000)
+
+
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+current_source: ContextVar[Optional[str]] = ContextVar("query_source", default=None)
+
+
+@contextmanager
+def track_queries(label: str, report: bool = True) -> Iterator[QueryStats]:
+    stats = QueryStats(label)
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+        if report:
+            stats.report()
+
+
+@contextmanager
+def _source(name: str):
+    token = current_source.set(name)
+    try:
+        yield
+    finally:
+        current_source.reset(token)
+
+
+def query_source(name: str):
+    # Подпись для запросов внутри блока (метод DAO). Без учета запросов - ничего не делает
+    if current_stats.get() is None:
+        return nullcontext()
+    return _source(name)
+
+
+def install_query_monitor(engine) -> None:
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_monitor_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = current_stats.get()
+        if stats is None and not settings.QUERY_MONITOR_ENABLED:
+            return
+        duration = time.perf_counter() - context._query_monitor_started
+        shape = statement_shape(statement)
+        source = current_source.get()
+        if stats is not None:
+            stats.record(shape, duration, source)
+        if duration * 1000 >= settings.QUERY_MONITOR_SLOW_MS:
+            if stats is not None:
+                stats.slow.append((shape, duration))
+            log.warning("Slow statement in {} ({:.1f} ms) from {}: {}",
+                        stats.label if stats is not None else "-", duration * 1000, source or "-", shape[:300])
+
+
+class QueryMonitorMiddleware:
+    # Учет запросов к базе на каждый HTTP-запрос, отчет пишется в лог в конце запроса
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with track_queries(f"{scope['method']} {scope['path']}"):
+            await self.app(scope, receive, send)
@@ -1,44 +1,56 @@
 from typing import Optional
 import uuid
 
-from jose import jwt
 from fastapi import Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .models import UserModel
+from .schemas import Principal
 from .utils import OAuth2PasswordBearerWithCookie
 from .service import UserService
+from .token_codec import token_codec
 from ..exceptions import InvalidTokenException
 from ..config import settings
+from ..database import get_async_session
 
 oauth2_scheme = OAuth2PasswordBearerWithCookie(tokenUrl="/api/auth/login")
 
 
 async def get_current_user(
-        token: str = Depends(oauth2_scheme)
-) -> Optional[UserModel]:
+        token: str = Depends(oauth2_scheme),
+        session: AsyncSession = Depends(get_async_session),
+) -> Principal:
     try:
-        payload = jwt.decode(token,
-                             settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = token_codec.decode(token)
         user_id = payload.get("sub")
         if user_id is None:
             raise InvalidTokenException
     except Exception:
         raise InvalidTokenException
-    current_user = await UserService.get_user(uuid.UUID(user_id))
+    if settings.AUTH_CLAIMS_IN_TOKEN and "is_verified" in payload:
+        # Флаги пришли в подписанном токене - в базу не ходим
+        current_user = Principal(
+            id=uuid.UUID(user_id),
+            is_active=payload["is_active"],
+            is_verified=payload["is_verified"],
+            is_superuser=payload["is_superuser"]
+        )
+    else:
+        current_user = await UserService.get_principal(session, uuid.UUID(user_id))
     if not current_user.is_verified:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Verify email")
     return current_user
 
 
-async def get_current_superuser(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+async def get_current_superuser(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not enough privileges")
     return current_user
 
 
-async def get_current_active_user(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="User is not active")
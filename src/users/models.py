@@ -44,5 +44,19 @@ class RefreshSessionModel(Base):
     expires_in: Mapped[int]
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True),
                                                  server_default=func.now())
+    # Момент истечения токена: по индексу на нем sweeper находит просроченные сессии
+    expires_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False, index=True)
     user_id: Mapped[uuid.UUID] = mapped_column(UUID, ForeignKey(
-        "users.id", ondelete="CASCADE"))
+        "users.id", ondelete="CASCADE"), index=True)
+    # Все токены, полученные ротацией из одного логина, - одна семья.
+    # При повторном предъявлении уже обмененного токена семья отзывается целиком
+    family_id: Mapped[uuid.UUID] = mapped_column(UUID, nullable=False, index=True, default=uuid.uuid4)
+
+
+class UsedRefreshTokenModel(Base):
+    # Refresh-токены, уже обмененные на новые. Хранятся, пока жива их семья
+    __tablename__ = 'used_refresh_tokens'
+
+    refresh_token: Mapped[uuid.UUID] = mapped_column(UUID, primary_key=True)
+    family_id: Mapped[uuid.UUID] = mapped_column(UUID, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False, index=True)
@@ -3,13 +3,16 @@ import uuid
 
 from fastapi import APIRouter, Depends, Response, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .models import UserModel
-from .schemas import UserCreate, Token, User, UserUpdate
+from .schemas import UserCreate, Token, User, UserUpdate, Principal
 from .service import AuthService, UserService
 from .dependencies import get_current_user, get_current_superuser, get_current_active_user
 from ..exceptions import InvalidCredentialsException
 from ..config import settings
+from ..database import get_async_session
+from ..pagination import CursorPage
 
 
 auth_router = APIRouter(prefix="/auth", tags=["auth"])
@@ -19,19 +22,21 @@ user_router = APIRouter(prefix="/users", tags=["user"])
 @auth_router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(
     user: UserCreate = Depends(UserCreate),
+    session: AsyncSession = Depends(get_async_session),
 ) -> User:
-    return await UserService.register_new_user(user)
+    return await UserService.register_new_user(session, user)
 
 
 @auth_router.post("/login")
 async def login(
     response: Response,
-    credentials: OAuth2PasswordRequestForm = Depends()
+    credentials: OAuth2PasswordRequestForm = Depends(),
+    session: AsyncSession = Depends(get_async_session),
 ) -> Token:
-    user = await AuthService.authenticate_user(credentials.username, credentials.password)
+    user = await AuthService.authenticate_user(session, credentials.username, credentials.password)
     if not user:
         raise InvalidCredentialsException
-    token = await AuthService.create_token(user.id)
+    token = await AuthService.create_token(session, user)
     response.set_cookie(
         'access_token',
         token.access_token,
@@ -51,21 +56,24 @@ async def login(
 async def logout(
     request: Request,
     response: Response,
-    user: UserModel = Depends(get_current_active_user),
+    user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session),
 ):
     response.delete_cookie('access_token')
     response.delete_cookie('refresh_token')
 
-    await AuthService.logout(request.cookies.get('refresh_token'))
+    await AuthService.logout(session, request.cookies.get('refresh_token'))
     return {"message": "Logged out successfully"}
 
 
 @auth_router.post("/refresh")
 async def refresh_token(
     request: Request,
-    response: Response
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
 ) -> Token:
     new_token = await AuthService.refresh_token(
+        session,
         uuid.UUID(request.cookies.get("refresh_token"))
     )
 
@@ -87,12 +95,13 @@ async def refresh_token(
 @auth_router.post("/abort")
 async def abort_all_sessions(
     response: Response,
-    user: UserModel = Depends(get_current_user)
+    user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ):
     response.delete_cookie('access_token')
     response.delete_cookie('refresh_token')
 
-    await AuthService.abort_all_sessions(user.id)
+    await AuthService.abort_all_sessions(session, user.id)
     return {"message": "All sessions was aborted"}
 
 
@@ -100,61 +109,70 @@ async def abort_all_sessions(
 async def get_users_list(
     offset: Optional[int] = 0,
     limit: Optional[int] = 100,
-    current_user: UserModel = Depends(get_current_superuser)
-) -> List[User]:
-    return await UserService.get_users_list(offset=offset, limit=limit)
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_superuser),
+    session: AsyncSession = Depends(get_async_session),
+) -> CursorPage[User]:
+    return await UserService.get_users_list(
+        session, offset=offset, limit=limit, cursor=cursor)
 
 
 @user_router.get("/me")
 async def get_current_user(
-    current_user: UserModel = Depends(get_current_active_user)
+    current_user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session),
 ) -> User:
-    return await UserService.get_user(current_user.id)
+    return await UserService.get_user(session, current_user.id)
 
 
 @user_router.put("/me")
 async def update_current_user(
     user: UserUpdate,
-    current_user: UserModel = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ) -> User:
-    return await UserService.update_user(current_user.id, user)
+    return await UserService.update_user(session, current_user.id, user)
 
 
 @user_router.delete("/me")
 async def delete_current_user(
     request: Request,
     response: Response,
-    current_user: UserModel = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ):
     response.delete_cookie('access_token')
     response.delete_cookie('refresh_token')
 
-    await AuthService.logout(request.cookies.get('refresh_token'))
-    await UserService.delete_user(current_user.id)
+    await AuthService.logout(session, request.cookies.get('refresh_token'))
+    await UserService.delete_user(session, current_user.id)
     return {"message": "User status is not active already"}
 
 
 @user_router.get("/{user_id}")
 async def get_user(
     user_id: str,
-    current_user: UserModel = Depends(get_current_superuser)
+    current_user: Principal = Depends(get_current_superuser),
+    session: AsyncSession = Depends(get_async_session),
 ) -> User:
-    return await UserService.get_user(user_id)
+    return await UserService.get_user(session, user_id)
 
 
 @user_router.put("/{user_id}")
 async def update_user(
     user_id: str,
     user: User,
-    current_user: UserModel = Depends(get_current_superuser)
+    current_user: Principal = Depends(get_current_superuser),
+    session: AsyncSession = Depends(get_async_session),
 ) -> User:
-    return await UserService.update_user_from_superuser(user_id, user)
+    return await UserService.update_user_from_superuser(session, user_id, user)
 
 
 @user_router.delete("/{user_id}")
 async def delete_user(
     user_id: str,
-    current_user: UserModel = Depends(get_current_superuser)
+    current_user: Principal = Depends(get_current_superuser),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    await UserService.delete_user_from_superuser(user_id)
+    await UserService.delete_user_from_superuser(session, user_id)
     return {"message": "User was deleted"}
\ No newline at end of file
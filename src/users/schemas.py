@@ -1,4 +1,5 @@
 import uuid
+from datetime import datetime
 from typing import Optional
 
 from pydantic import BaseModel, Field
@@ -34,6 +35,16 @@ class User(UserBase):
         from_attributes = True
 
 
+class Principal(BaseModel):
+    id: uuid.UUID
+    is_active: bool
+    is_verified: bool
+    is_superuser: bool
+
+    class Config:
+        from_attributes = True
+
+
 class UserCreateDB(UserBase):
     hashed_password: Optional[str] = None
 
@@ -45,6 +56,7 @@ class UserUpdateDB(UserBase):
 class RefreshSessionCreate(BaseModel):
     refresh_token: uuid.UUID
     expires_in: int
+    expires_at: datetime
     user_id: uuid.UUID
 
 
@@ -52,6 +64,16 @@ class RefreshSessionUpdate(RefreshSessionCreate):
     user_id: Optional[uuid.UUID] = Field(None)
 
 
+class RefreshSession(BaseModel):
+    refresh_token: uuid.UUID
+    user_id: uuid.UUID
+    family_id: uuid.UUID
+    expires_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 class Token(BaseModel):
     access_token: str
     refresh_token: uuid.UUID
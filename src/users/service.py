@@ -1,102 +1,113 @@
+import time
 import uuid
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import NoReturn, Optional, Union
 
 from fastapi import HTTPException, status
-from jose import jwt
-
-from .utils import get_password_hash, is_valid_password
-from .schemas import (RefreshSessionUpdate, UserCreate, User, Token,
-                      UserCreateDB, RefreshSessionCreate, UserUpdate, UserUpdateDB)
-from .models import UserModel, RefreshSessionModel
-from .dao import UserDAO, RefreshSessionDAO
+from loguru import logger as log
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .utils import hash_password, verify_password
+from .schemas import UserCreate, User, Token, Principal, UserCreateDB, UserUpdate, UserUpdateDB
+from .models import UserModel
+from .dao import UserDAO
+from .session_store import get_session_store
+from .token_codec import token_codec
 from ..exceptions import InvalidTokenException, TokenExpiredException
-from ..database import async_session_maker
 from ..config import settings
+from ..cache import TTLCache, invalidation_bus
+from ..pagination import CursorPage
+
+
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_MAX_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS
+)
+
+
+async def _invalidate_principal(user_id: uuid.UUID) -> None:
+    # Свой кэш сбрасываем сразу, остальные воркеры - через шину инвалидаций
+    principal_cache.invalidate(str(user_id))
+    await invalidation_bus.publish(f"principal:{user_id}")
+
+
+def _on_principal_invalidation(message: str) -> None:
+    prefix, _, user_id = message.partition(":")
+    if prefix == "principal":
+        principal_cache.invalidate(user_id)
+
+
+invalidation_bus.subscribe(_on_principal_invalidation)
 
 
 class AuthService:
     @classmethod
-    async def create_token(cls, user_id: uuid.UUID) -> Token:
-        access_token = cls._create_access_token(user_id)
+    async def create_token(cls, session: AsyncSession, user: UserModel) -> Token:
+        access_token = cls._create_access_token(user)
         refresh_token_expires = timedelta(
             days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
         refresh_token = cls._create_refresh_token()
 
-        async with async_session_maker() as session:
-            await RefreshSessionDAO.add(
-                session,
-                RefreshSessionCreate(
-                    user_id=user_id,
-                    refresh_token=refresh_token,
-                    expires_in=refresh_token_expires.total_seconds()
-                )
-            )
-            await session.commit()
+        await get_session_store().add(session, user.id, refresh_token, int(refresh_token_expires.total_seconds()))
         return Token(access_token=access_token, refresh_token=refresh_token, token_type="bearer")
 
     @classmethod
-    async def logout(cls, token: uuid.UUID) -> None:
-        async with async_session_maker() as session:
-            refresh_session = await RefreshSessionDAO.find_one_or_none(session, RefreshSessionModel.refresh_token == token)
-            if refresh_session:
-                await RefreshSessionDAO.delete(session, id=refresh_session.id)
-            await session.commit()
+    async def logout(cls, session: AsyncSession, token: uuid.UUID) -> None:
+        if token is not None:
+            await get_session_store().delete(session, token)
 
     @classmethod
-    async def refresh_token(cls, token: uuid.UUID) -> Token:
-        async with async_session_maker() as session:
-            refresh_session = await RefreshSessionDAO.find_one_or_none(session, RefreshSessionModel.refresh_token == token)
+    async def refresh_token(cls, session: AsyncSession, token: uuid.UUID) -> Token:
+        store = get_session_store()
+        refresh_token_expires = timedelta(
+            days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+        refresh_token = cls._create_refresh_token()
 
-            if refresh_session is None:
-                raise InvalidTokenException
-            if datetime.now(timezone.utc) >= refresh_session.created_at + timedelta(seconds=refresh_session.expires_in):
-                await RefreshSessionDAO.delete(session, id=refresh_session.id)
-                raise TokenExpiredException
+        user = await store.rotate(session, token, refresh_token, int(refresh_token_expires.total_seconds()))
+        if user is None:
+            await cls._reject_refresh(session, store, token)
 
-            user = await UserDAO.find_one_or_none(session, id=refresh_session.user_id)
-            if user is None:
-                raise InvalidTokenException
-
-            access_token = cls._create_access_token(user.id)
-            refresh_token_expires = timedelta(
-                days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
-            refresh_token = cls._create_refresh_token()
-
-            await RefreshSessionDAO.update(
-                session,
-                RefreshSessionModel.id == refresh_session.id,
-                obj_in=RefreshSessionUpdate(
-                    refresh_token=refresh_token,
-                    expires_in=refresh_token_expires.total_seconds()
-                )
-            )
-            await session.commit()
+        access_token = cls._create_access_token(user)
         return Token(access_token=access_token, refresh_token=refresh_token, token_type="bearer")
 
     @classmethod
-    async def authenticate_user(cls, email: str, password: str) -> Optional[UserModel]:
-        async with async_session_maker() as session:
-            db_user = await UserDAO.find_one_or_none(session, email=email)
-        if db_user and is_valid_password(password, db_user.hashed_password):
+    async def _reject_refresh(cls, session: AsyncSession, store, token: uuid.UUID) -> NoReturn:
+        # Ротация не прошла - выясняем почему, это уже не горячий путь
+        refresh_session = await store.get(session, token)
+        if refresh_session is not None:
+            if datetime.now(timezone.utc) >= refresh_session.expires_at:
+                await store.delete(session, token)
+                raise TokenExpiredException
+            # Сессия жива, но пользователь удален или неактивен
+            raise InvalidTokenException
+        if settings.REFRESH_REUSE_DETECTION and await store.revoke_family(session, token):
+            log.warning("Refresh token reuse detected, token family revoked")
+        raise InvalidTokenException
+
+    @classmethod
+    async def authenticate_user(cls, session: AsyncSession, email: str, password: str) -> Optional[UserModel]:
+        db_user = await UserDAO.find_one_or_none(session, email=email)
+        if db_user and await verify_password(password, db_user.hashed_password):
             return db_user
         return None
 
     @classmethod
-    async def abort_all_sessions(cls, user_id: uuid.UUID):
-        async with async_session_maker() as session:
-            await RefreshSessionDAO.delete(session, RefreshSessionModel.user_id == user_id)
-            await session.commit()
+    async def abort_all_sessions(cls, session: AsyncSession, user_id: uuid.UUID):
+        await get_session_store().delete_user(session, user_id)
 
     @classmethod
-    def _create_access_token(cls, user_id: uuid.UUID) -> str:
+    def _create_access_token(cls, user: Union[UserModel, Principal]) -> str:
         to_encode = {
-            "sub": str(user_id),
-            "exp": datetime.utcnow() + timedelta(
-                minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+            "sub": str(user.id),
+            "exp": int(time.time()) + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
         }
-        encoded_jwt = jwt.encode(
-            to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+        if settings.AUTH_CLAIMS_IN_TOKEN:
+            to_encode.update(
+                is_active=user.is_active,
+                is_verified=user.is_verified,
+                is_superuser=user.is_superuser
+            )
+        encoded_jwt = token_codec.encode(to_encode)
         return f'Bearer {encoded_jwt}'
 
     @classmethod
@@ -106,109 +117,128 @@ class AuthService:
 
 class UserService:
     @classmethod
-    async def register_new_user(cls, user: UserCreate) -> UserModel:
-        async with async_session_maker() as session:
-            user_exist = await UserDAO.find_one_or_none(session, email=user.email)
-            if user_exist:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT, detail="User already exists")
-
-            user.is_superuser = False
-            user.is_verified = False
-            db_user = await UserDAO.add(
-                session,
-                UserCreateDB(
-                    **user.model_dump(),
-                    hashed_password=get_password_hash(user.password))
-            )
-            await session.commit()
+    async def register_new_user(cls, session: AsyncSession, user: UserCreate) -> UserModel:
+        user_exist = await UserDAO.find_one_or_none(session, email=user.email)
+        if user_exist:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail="User already exists")
+
+        user.is_superuser = False
+        user.is_verified = False
+        db_user = await UserDAO.add(
+            session,
+            UserCreateDB(
+                **user.model_dump(),
+                hashed_password=await hash_password(user.password))
+        )
+        await session.commit()
         return db_user
 
     @classmethod
-    async def get_user(cls, user_id: uuid.UUID) -> UserModel:
-        async with async_session_maker() as session:
-            db_user = await UserDAO.find_one_or_none(session, id=user_id)
+    async def get_user(cls, session: AsyncSession, user_id: uuid.UUID) -> UserModel:
+        db_user = await UserDAO.find_one_or_none(session, id=user_id)
         if db_user is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
         return db_user
 
     @classmethod
-    async def update_user(cls, user_id: uuid.UUID, user: UserUpdate) -> UserModel:
-        async with async_session_maker() as session:
-            db_user = await UserDAO.find_one_or_none(session, UserModel.id == user_id)
-            if db_user is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-
-            if user.password:
-                user_in = UserUpdateDB(
-                    **user.model_dump
-                    (
-                        exclude={'is_active', 'is_verified', 'is_superuser'},
-                        exclude_unset=True
-                    ),
-                    hashed_password=get_password_hash(user.password)
-                )
-            else:
-                user_in = UserUpdateDB(**user.model_dump())
-
-            user_update = await UserDAO.update(
-                session,
-                UserModel.id == user_id,
-                obj_in=user_in)
-            await session.commit()
-            return user_update
-
-    @classmethod
-    async def delete_user(cls, user_id: uuid.UUID):
-        async with async_session_maker() as session:
-            db_user = await UserDAO.find_one_or_none(session, id=user_id)
-            if db_user is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-            await UserDAO.update(
-                session,
-                UserModel.id == user_id,
-                {'is_active': False}
+    async def get_principal(cls, session: AsyncSession, user_id: uuid.UUID) -> Principal:
+        principal = principal_cache.get(str(user_id))
+        if principal is None:
+            db_user = await cls.get_user(session, user_id)
+            principal = Principal.model_validate(db_user)
+            principal_cache.set(str(user_id), principal)
+        return principal
+
+    @classmethod
+    async def update_user(cls, session: AsyncSession, user_id: uuid.UUID, user: UserUpdate) -> UserModel:
+        db_user = await UserDAO.find_one_or_none(session, UserModel.id == user_id)
+        if db_user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+        if user.password:
+            user_in = UserUpdateDB(
+                **user.model_dump
+                (
+                    exclude={'is_active', 'is_verified', 'is_superuser'},
+                    exclude_unset=True
+                ),
+                hashed_password=await hash_password(user.password)
             )
-            await session.commit()
+        else:
+            user_in = UserUpdateDB(**user.model_dump())
+
+        user_update = await UserDAO.update(
+            session,
+            UserModel.id == user_id,
+            obj_in=user_in)
+        await session.commit()
+        await _invalidate_principal(user_id)
+        return user_update
+
+    @classmethod
+    async def delete_user(cls, session: AsyncSession, user_id: uuid.UUID):
+        db_user = await UserDAO.find_one_or_none(session, id=user_id)
+        if db_user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        await UserDAO.update(
+            session,
+            UserModel.id == user_id,
+            obj_in={'is_active': False}
+        )
+        await session.commit()
+        await _invalidate_principal(user_id)
 
     @classmethod
-    async def get_users_list(cls, *filter, offset: int = 0, limit: int = 100, **filter_by) -> list[User]:
-        async with async_session_maker() as session:
-            users = await UserDAO.find_all(session, *filter, offset=offset, limit=limit, **filter_by)
+    async def get_users_list(
+            cls,
+            session: AsyncSession,
+            *filter,
+            offset: int = 0,
+            limit: int = 100,
+            cursor: Optional[str] = None,
+            **filter_by
+    ) -> CursorPage[User]:
+        users, next_cursor = await UserDAO.find_page(
+            session, *filter, cursor=cursor, offset=offset, limit=limit, **filter_by)
         if users is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Users not found")
-        return [
-            User(
-                id=str(db_user.id),
-                email=db_user.email,
-                fio=db_user.fio,
-                is_active=db_user.is_active,
-                is_superuser=db_user.is_superuser
-            ) for db_user in users
-        ]
-
-    @classmethod
-    async def update_user_from_superuser(cls, user_id: uuid.UUID, user: UserUpdate) -> User:
-        async with async_session_maker() as session:
-            db_user = await UserDAO.find_one_or_none(session, UserModel.id == user_id)
-            if db_user is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-
-            user_in = UserUpdateDB(**user.model_dump(exclude_unset=True))
-            user_update = await UserDAO.update(
-                session,
-                UserModel.id == user_id,
-                obj_in=user_in)
-            await session.commit()
-            return user_update
-
-    @classmethod
-    async def delete_user_from_superuser(cls, user_id: uuid.UUID):
-        async with async_session_maker() as session:
-            await UserDAO.delete(session, UserModel.id == user_id)
-            await session.commit()
+        return CursorPage[User](
+            items=[
+                User(
+                    id=str(db_user.id),
+                    email=db_user.email,
+                    fio=db_user.fio,
+                    is_active=db_user.is_active,
+                    is_verified=db_user.is_verified,
+                    is_superuser=db_user.is_superuser
+                ) for db_user in users
+            ],
+            next_cursor=next_cursor
+        )
+
+    @classmethod
+    async def update_user_from_superuser(cls, session: AsyncSession, user_id: uuid.UUID, user: UserUpdate) -> User:
+        db_user = await UserDAO.find_one_or_none(session, UserModel.id == user_id)
+        if db_user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+        user_in = UserUpdateDB(**user.model_dump(exclude_unset=True))
+        user_update = await UserDAO.update(
+            session,
+            UserModel.id == user_id,
+            obj_in=user_in)
+        await session.commit()
+        await _invalidate_principal(user_id)
+        return user_update
+
+    @classmethod
+    async def delete_user_from_superuser(cls, session: AsyncSession, user_id: uuid.UUID):
+        await UserDAO.delete(session, UserModel.id == user_id)
+        await session.commit()
+        await _invalidate_principal(user_id)
@@ -0,0 +1,265 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from loguru import logger as log
+from redis.exceptions import WatchError
+from sqlalchemy import select, insert, update, delete, literal, func, UUID, TIMESTAMP
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .dao import UserDAO, RefreshSessionDAO
+from .models import UserModel, RefreshSessionModel, UsedRefreshTokenModel
+from .schemas import RefreshSession, RefreshSessionCreate, Principal
+from ..config import settings
+from ..database import async_session_maker
+
+
+class PostgresRefreshSessionStore:
+    # Сессии в таблице refresh_sessions. Просроченные строки удаляет фоновый
+    # sweeper пачками, а не только тот, кто предъявил просроченный токен
+    def __init__(self):
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def add(self, session: AsyncSession, user_id: uuid.UUID, token: uuid.UUID, expires_in: int) -> None:
+        await RefreshSessionDAO.add(
+            session,
+            RefreshSessionCreate(
+                user_id=user_id,
+                refresh_token=token,
+                expires_in=expires_in,
+                expires_at=datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+            )
+        )
+        await session.commit()
+
+    async def get(self, session: AsyncSession, token: uuid.UUID) -> Optional[RefreshSession]:
+        model = await RefreshSessionDAO.find_one_or_none(session, RefreshSessionModel.refresh_token == token)
+        return RefreshSession.model_validate(model) if model is not None else None
+
+    async def rotate(
+            self,
+            session: AsyncSession,
+            token: uuid.UUID,
+            new_token: uuid.UUID,
+            expires_in: int
+    ) -> Optional[Principal]:
+        # Ротация одним запросом: UPDATE находит живую сессию активного пользователя
+        # и сразу заменяет токен. Параллельный запрос с тем же токеном ждет блокировку
+        # строки, а после нее условие refresh_token = old уже не выполняется
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        rotated = (
+            update(RefreshSessionModel)
+            .where(
+                RefreshSessionModel.refresh_token == token,
+                RefreshSessionModel.expires_at > func.now(),
+                RefreshSessionModel.user_id == UserModel.id,
+                UserModel.is_active
+            )
+            .values(refresh_token=new_token, expires_in=expires_in, expires_at=expires_at)
+            .returning(RefreshSessionModel.family_id, UserModel.id, UserModel.is_active,
+                       UserModel.is_verified, UserModel.is_superuser)
+            .cte("rotated")
+        )
+        # Старый токен запоминается для обнаружения повторного предъявления
+        used = (
+            insert(UsedRefreshTokenModel)
+            .from_select(
+                ["refresh_token", "family_id", "expires_at"],
+                select(literal(token, UUID), rotated.c.family_id, literal(expires_at, TIMESTAMP(timezone=True)))
+            )
+            .cte("used")
+        )
+        row = (await session.execute(
+            select(rotated.c.id, rotated.c.is_active, rotated.c.is_verified, rotated.c.is_superuser)
+            .add_cte(used)
+        )).one_or_none()
+        await session.commit()
+        return Principal.model_validate(row) if row is not None else None
+
+    async def revoke_family(self, session: AsyncSession, token: uuid.UUID) -> bool:
+        family_id = await session.scalar(
+            select(UsedRefreshTokenModel.family_id).where(UsedRefreshTokenModel.refresh_token == token))
+        if family_id is None:
+            return False
+        await RefreshSessionDAO.delete(session, RefreshSessionModel.family_id == family_id)
+        await session.commit()
+        return True
+
+    async def delete(self, session: AsyncSession, token: uuid.UUID) -> None:
+        await RefreshSessionDAO.delete(session, RefreshSessionModel.refresh_token == token)
+        await session.commit()
+
+    async def delete_user(self, session: AsyncSession, user_id: uuid.UUID) -> None:
+        await RefreshSessionDAO.delete(session, RefreshSessionModel.user_id == user_id)
+        await session.commit()
+
+    async def sweep_expired(self, batch_size: int) -> int:
+        # Пачка сессий и пачка обмененных токенов по индексам expires_at
+        return (await self._sweep(RefreshSessionModel, RefreshSessionModel.id, batch_size) +
+                await self._sweep(UsedRefreshTokenModel, UsedRefreshTokenModel.refresh_token, batch_size))
+
+    @staticmethod
+    async def _sweep(model, key, batch_size: int) -> int:
+        # SKIP LOCKED: sweeper-ы разных воркеров не ждут друг друга и не удаляют одни и те же строки
+        expired = (
+            select(key)
+            .where(model.expires_at <= datetime.now(timezone.utc))
+            .order_by(model.expires_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with async_session_maker() as session:
+            result = await session.execute(
+                delete(model).where(key.in_(expired.scalar_subquery())).returning(key))
+            deleted = len(result.all())
+            await session.commit()
+        return deleted
+
+    async def _run_sweeper(self) -> None:
+        while True:
+            try:
+                while await self.sweep_expired(settings.REFRESH_SESSION_SWEEP_BATCH_SIZE) >= \
+                        settings.REFRESH_SESSION_SWEEP_BATCH_SIZE:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Refresh session sweep failed")
+            await asyncio.sleep(settings.REFRESH_SESSION_SWEEP_INTERVAL_SECONDS)
+
+    async def start(self) -> None:
+        self._sweeper = asyncio.create_task(self._run_sweeper())
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+
+class RedisRefreshSessionStore:
+    # Сессия - hash refresh:<token> с TTL до истечения токена: просроченные
+    # удаляет сам redis. Токены пользователя - sorted set refresh-user:<user_id>
+    # со временем истечения в score, по нему "выйти везде" стоит O(k).
+    # refresh-family:<family_id> - текущий токен семьи, refresh-used:<token> - семья
+    # уже обмененного токена
+    def __init__(self, prefix: str = "refresh"):
+        self.prefix = prefix
+        self.redis = None
+
+    def _key(self, token) -> str:
+        return f"{self.prefix}:{token}"
+
+    def _user_key(self, user_id) -> str:
+        return f"{self.prefix}-user:{user_id}"
+
+    def _family_key(self, family_id) -> str:
+        return f"{self.prefix}-family:{family_id}"
+
+    def _used_key(self, token) -> str:
+        return f"{self.prefix}-used:{token}"
+
+    @staticmethod
+    def _str(value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _add(self, pipe, user_id, family_id, token: uuid.UUID, expires_in: int) -> None:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        pipe.hset(self._key(token), mapping={
+            "user_id": str(user_id), "family_id": str(family_id), "expires_at": expires_at.timestamp()})
+        pipe.expire(self._key(token), expires_in)
+        pipe.set(self._family_key(family_id), str(token), ex=expires_in)
+        # Заодно выбрасываем из набора уже истекшие токены
+        pipe.zremrangebyscore(self._user_key(user_id), "-inf", datetime.now(timezone.utc).timestamp())
+        pipe.zadd(self._user_key(user_id), {str(token): expires_at.timestamp()})
+        pipe.expire(self._user_key(user_id), expires_in)
+
+    async def add(self, session: AsyncSession, user_id: uuid.UUID, token: uuid.UUID, expires_in: int) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self._add(pipe, user_id, uuid.uuid4(), token, expires_in)
+            await pipe.execute()
+
+    async def get(self, session: AsyncSession, token: uuid.UUID) -> Optional[RefreshSession]:
+        return self._session(token, await self.redis.hgetall(self._key(token)))
+
+    def _session(self, token: uuid.UUID, data: dict) -> Optional[RefreshSession]:
+        if not data:
+            return None
+        data = {self._str(key): self._str(value) for key, value in data.items()}
+        return RefreshSession(
+            refresh_token=token,
+            user_id=data["user_id"],
+            family_id=data["family_id"],
+            expires_at=datetime.fromtimestamp(float(data["expires_at"]), timezone.utc)
+        )
+
+    async def rotate(
+            self,
+            session: AsyncSession,
+            token: uuid.UUID,
+            new_token: uuid.UUID,
+            expires_in: int
+    ) -> Optional[Principal]:
+        # WATCH на ключе токена: из параллельных ротаций EXEC пройдет у одной,
+        # остальные получат WatchError. Старый ключ, метка использования и новый
+        # токен меняются в одном EXEC - проигравший сразу видит метку
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self._key(token))
+                refresh_session = self._session(token, await pipe.hgetall(self._key(token)))
+                if refresh_session is None:
+                    return None
+                # Пользователь проверяется до EXEC: сессия неактивного остается как есть,
+                # без метки использования, и не принимается за повторное предъявление
+                user = await UserDAO.find_one_or_none(session, id=refresh_session.user_id)
+                if user is None or not user.is_active:
+                    return None
+                pipe.multi()
+                pipe.delete(self._key(token))
+                pipe.zrem(self._user_key(refresh_session.user_id), str(token))
+                pipe.set(self._used_key(token), str(refresh_session.family_id), ex=expires_in)
+                self._add(pipe, refresh_session.user_id, refresh_session.family_id, new_token, expires_in)
+                await pipe.execute()
+            except WatchError:
+                return None
+        return Principal.model_validate(user)
+
+    async def revoke_family(self, session: AsyncSession, token: uuid.UUID) -> bool:
+        family_id = await self.redis.get(self._used_key(token))
+        if family_id is None:
+            return False
+        current = await self.redis.get(self._family_key(self._str(family_id)))
+        if current is not None:
+            await self.delete(session, self._str(current))
+        await self.redis.delete(self._family_key(self._str(family_id)))
+        return True
+
+    async def delete(self, session: AsyncSession, token: uuid.UUID) -> None:
+        refresh_session = await self.get(session, token)
+        if refresh_session is None:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(token))
+            pipe.zrem(self._user_key(refresh_session.user_id), str(token))
+            await pipe.execute()
+
+    async def delete_user(self, session: AsyncSession, user_id: uuid.UUID) -> None:
+        tokens = await self.redis.zrange(self._user_key(user_id), 0, -1)
+        await self.redis.delete(self._user_key(user_id), *(self._key(self._str(token)) for token in tokens))
+
+    async def connect(self, redis) -> None:
+        self.redis = redis
+
+    async def close(self) -> None:
+        self.redis = None
+
+
+postgres_session_store = PostgresRefreshSessionStore()
+redis_session_store = RedisRefreshSessionStore()
+
+
+def get_session_store():
+    # Хранилище выбирается настройкой REFRESH_SESSION_BACKEND
+    if settings.REFRESH_SESSION_BACKEND == "redis":
+        return redis_session_store
+    return postgres_session_store
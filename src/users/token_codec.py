@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict, Optional
+
+from ..cache import TTLCache
+from ..config import settings
+from ..exceptions import InvalidTokenException, TokenExpiredException
+
+
+HMAC_ALGORITHMS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+ASYMMETRIC_ALGORITHMS = {"RS256", "EdDSA"}
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _pem(value: str) -> bytes:
+    # PEM из .env обычно записан в одну строку с \n
+    return value.replace("\\n", "\n").encode()
+
+
+class TokenCodec:
+    # JWT (компактный JWS) с ключом, подготовленным один раз при создании:
+    # HS* - готовый HMAC, который только копируется на каждый токен,
+    # RS256/EdDSA - загруженные объекты ключей cryptography.
+    # Для RS256/EdDSA достаточно публичного ключа, чтобы только проверять токены.
+    # Проверенные токены запоминаются до их exp в ограниченном LRU-кэше
+    def __init__(
+            self,
+            algorithm: str,
+            key: Optional[str],
+            public_key: Optional[str] = None,
+            cache_size: int = 0
+    ):
+        if algorithm not in HMAC_ALGORITHMS and algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self._header = _b64encode(json.dumps(
+            {"alg": algorithm, "typ": "JWT"}, separators=(",", ":"), sort_keys=True).encode())
+        self._mac = None
+        self._private_key = None
+        self._public_key = None
+        if algorithm in HMAC_ALGORITHMS:
+            self._mac = hmac.new(key.encode(), digestmod=HMAC_ALGORITHMS[algorithm])
+        else:
+            self._load_asymmetric_keys(key, public_key)
+        self._verified = TTLCache(maxsize=cache_size, ttl=0) if cache_size > 0 else None
+
+    def _load_asymmetric_keys(self, key: Optional[str], public_key: Optional[str]) -> None:
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding, ed25519, rsa
+
+        if key:
+            self._private_key = serialization.load_pem_private_key(_pem(key), password=None)
+        if public_key:
+            self._public_key = serialization.load_pem_public_key(_pem(public_key))
+        elif self._private_key is not None:
+            self._public_key = self._private_key.public_key()
+        if self._public_key is None:
+            raise ValueError(f"{self.algorithm} needs a private or a public key")
+
+        self._invalid_signature = InvalidSignature
+        expected = rsa.RSAPublicKey if self.algorithm == "RS256" else ed25519.Ed25519PublicKey
+        if not isinstance(self._public_key, expected):
+            raise ValueError(f"Key does not match JWT algorithm {self.algorithm}")
+        if self.algorithm == "RS256":
+            self._sign_args = (padding.PKCS1v15(), hashes.SHA256())
+        else:
+            self._sign_args = ()
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        if self._mac is not None:
+            mac = self._mac.copy()
+            mac.update(signing_input)
+            return mac.digest()
+        if self._private_key is None:
+            raise ValueError("Token codec has no private key, it can only verify tokens")
+        return self._private_key.sign(signing_input, *self._sign_args)
+
+    def _verify(self, signing_input: bytes, signature: bytes) -> bool:
+        if self._mac is not None:
+            mac = self._mac.copy()
+            mac.update(signing_input)
+            return hmac.compare_digest(mac.digest(), signature)
+        try:
+            self._public_key.verify(signature, signing_input, *self._sign_args)
+        except self._invalid_signature:
+            return False
+        return True
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        signing_input = self._header + b"." + _b64encode(
+            json.dumps(claims, separators=(",", ":")).encode())
+        return (signing_input + b"." + _b64encode(self._sign(signing_input))).decode()
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        if self._verified is not None:
+            claims = self._verified.get(token)
+            if claims is not None:
+                return claims
+
+        try:
+            signing_input, signature = token.encode().rsplit(b".", 1)
+            header, payload = signing_input.split(b".")
+            # Заголовок своего формата сравнивается как есть, чужой (например,
+            # от другой библиотеки) разбирается, но алгоритм обязан совпасть
+            if header != self._header and json.loads(_b64decode(header)).get("alg") != self.algorithm:
+                raise InvalidTokenException
+            if not self._verify(signing_input, _b64decode(signature)):
+                raise InvalidTokenException
+            claims = json.loads(_b64decode(payload))
+            ttl = float(claims["exp"]) - time.time()
+        except InvalidTokenException:
+            raise
+        except Exception:
+            raise InvalidTokenException
+
+        if ttl <= 0:
+            raise TokenExpiredException
+        if self._verified is not None:
+            self._verified.set(token, claims, ttl=ttl)
+        return claims
+
+
+token_codec = TokenCodec(
+    settings.ALGORITHM,
+    settings.SECRET_KEY,
+    settings.JWT_PUBLIC_KEY,
+    settings.TOKEN_VERIFY_CACHE_SIZE
+)
@@ -1,3 +1,6 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional
 
 from passlib.context import CryptContext
@@ -6,9 +9,21 @@ from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
 from fastapi.security import OAuth2
 from fastapi.security.utils import get_authorization_scheme_param
 
+from ..config import settings
+from ..metrics import password_hash_duration
+
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt отпускает GIL, поэтому потоков достаточно, чтобы не блокировать event loop
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+password_slots = asyncio.Semaphore(
+    settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE
+)
+
 
 class OAuth2PasswordBearerWithCookie(OAuth2):
     def __init__(
@@ -45,4 +60,28 @@ def is_valid_password(plain_password: str, hashed_password: str) -> bool:
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
+
+
+async def _run_password_task(func, *args):
+    if password_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests",
+            headers={"Retry-After": "1"},
+        )
+    started = time.perf_counter()
+    try:
+        async with password_slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(password_executor, func, *args)
+    finally:
+        password_hash_duration.observe((func.__name__,), time.perf_counter() - started)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_password_task(is_valid_password, plain_password, hashed_password)
+
+
+async def hash_password(password: str) -> str:
+    return await _run_password_task(get_password_hash, password)
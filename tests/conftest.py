@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, text
+
+from src.config import settings
+from src.database import Base, engine, async_session_maker
+from src.query_monitor import track_queries
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def db_session_maker(anyio_backend):
+    # Тесты, которым нужен Postgres (TEST_POSTGRES_* из .env), пропускаются без базы
+    try:
+        async with engine.begin() as connection:
+            await connection.execute(text("SELECT 1"))
+            await connection.run_sync(Base.metadata.create_all)
+    except Exception as e:
+        pytest.skip(f"Test database is not available: {e}")
+    yield async_session_maker
+    await engine.dispose()
+
+
+@pytest.fixture
+def sql_statements():
+    # Все SQL-запросы, ушедшие в базу за время теста
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def query_budget():
+    # Бюджет запросов к базе на блок (обычно один вызов эндпоинта):
+    #   with query_budget(2): await client.get(...)
+    # Падает, если запросов больше max_statements или одна форма запроса
+    # повторилась больше max_repeats раз (N+1)
+    @contextmanager
+    def budget(max_statements: int, max_repeats: int = settings.QUERY_MONITOR_REPEAT_THRESHOLD - 1):
+        with track_queries("query budget", report=False) as stats:
+            yield stats
+        assert stats.count <= max_statements, \
+            f"Query budget of {max_statements} exceeded\n{stats.describe()}"
+        assert not stats.repeated(max_repeats + 1), \
+            f"Statement repeated more than {max_repeats} times\n{stats.describe()}"
+
+    return budget
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+from pydantic import BaseModel
+
+from src.cache import TTLCache, TwoTierCache, invalidation_bus
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_invalidate():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert "a" not in cache
+
+
+class Item(BaseModel):
+    id: int
+    name: str
+
+
+def make_cache(name: str, loads: list, **kwargs) -> TwoTierCache:
+    async def load(session, key):
+        loads.append(key)
+        await asyncio.sleep(0.01)
+        return Item(id=int(key), name=f"item-{len(loads)}")
+
+    return TwoTierCache(name, Item, load, **kwargs)
+
+
+@pytest.mark.anyio
+async def test_two_tier_cache_coalesces_concurrent_misses():
+    loads = []
+    cache = make_cache("test-coalesce", loads)
+    items = await asyncio.gather(*(cache.get(None, 1) for _ in range(10)))
+    assert loads == ["1"]
+    assert {item.name for item in items} == {"item-1"}
+    assert cache.stats.misses == 10
+    assert cache.stats.coalesced == 9
+    await cache.get(None, 1)
+    assert cache.stats.hits == 1
+
+
+@pytest.mark.anyio
+async def test_two_tier_cache_serves_stale_while_revalidating():
+    loads = []
+    cache = make_cache("test-swr", loads, ttl=0.01, stale_ttl=60)
+    assert (await cache.get(None, 1)).name == "item-1"
+    await asyncio.sleep(0.02)
+    # Устаревшее значение отдается сразу, свежее грузится в фоне
+    assert (await cache.get(None, 1)).name == "item-1"
+    assert cache.stats.stale_hits == 1
+    await asyncio.sleep(0.05)
+    assert (await cache.get(None, 1)).name == "item-2"
+
+
+@pytest.mark.anyio
+async def test_two_tier_cache_invalidation_and_eviction():
+    loads = []
+    cache = make_cache("test-invalidate", loads, maxsize=2)
+    for key in (1, 2, 3):
+        await cache.get(None, key)
+    assert cache.stats.evictions == 1
+
+    await cache.invalidate(3)
+    assert (await cache.get(None, 3)).name == "item-4"
+
+    # Сообщение с другого воркера приходит через шину инвалидаций
+    await invalidation_bus.publish("test-invalidate:3")
+    assert (await cache.get(None, 3)).name == "item-5"
+
+
+def make_blocking_cache(name: str, loads: list, release: asyncio.Event) -> TwoTierCache:
+    async def load(session, key):
+        loads.append(key)
+        await release.wait()
+        return Item(id=int(key), name=f"item-{len(loads)}")
+
+    return TwoTierCache(name, Item, load)
+
+
+@pytest.fixture
+async def l2(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    redis = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(TwoTierCache, "l2", redis)
+    yield redis
+    await redis.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("where", ["this-worker", "other-worker"])
+async def test_load_racing_invalidation_does_not_write_l2(l2, where):
+    loads, release = [], asyncio.Event()
+    cache = make_blocking_cache(f"test-l2-race-{where}", loads, release)
+    loading = asyncio.create_task(cache.get(None, 1))
+    await asyncio.sleep(0.01)
+
+    # Товар поменяли, пока загрузка читала старую строку
+    if where == "this-worker":
+        await cache.invalidate(1)
+    else:
+        await cache._invalidate_l2(["1"])
+    release.set()
+    assert (await loading).name == "item-1"
+
+    assert await l2.get(cache._l2_key("1")) is None
+    cache.clear_local()
+    assert (await cache.get(None, 1)).name == "item-2"
+    # Загрузка после инвалидации в L2 уже пишет
+    assert await l2.get(cache._l2_key("1")) is not None
+
+
+@pytest.mark.anyio
+async def test_cancelled_leader_does_not_fail_coalesced_followers():
+    loads, release = [], asyncio.Event()
+    cache = make_blocking_cache("test-cancelled-leader", loads, release)
+    leader = asyncio.create_task(cache.get(None, 1))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(cache.get(None, 1))
+    await asyncio.sleep(0.01)
+
+    leader.cancel()
+    await asyncio.sleep(0.01)
+    release.set()
+    assert (await follower).name == "item-2"
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert loads == ["1", "1"]
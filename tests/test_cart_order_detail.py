@@ -0,0 +1,65 @@
+import uuid
+
+import pytest
+from sqlalchemy import insert
+
+from src.catalog.models import CategoryModel, ProductModel, CartItemModel
+from src.catalog.service import CartService, OrderService
+from tests.test_order_service import create_users
+
+
+async def fill_cart(session, lines: int) -> uuid.UUID:
+    (user_id,) = await create_users(session, 1)
+    category_id = await session.scalar(
+        insert(CategoryModel).values(name=str(uuid.uuid4())).returning(CategoryModel.id))
+    product_ids = (await session.scalars(
+        insert(ProductModel).returning(ProductModel.id),
+        [{"sku": str(uuid.uuid4()), "name": f"p{i}", "price": 10.0, "discount_price": 0.0,
+          "stock": 100, "category_id": category_id} for i in range(lines)]
+    )).all()
+    await session.execute(
+        insert(CartItemModel),
+        [{"user_uuid": user_id, "product_id": product_id, "quantity": 2, "price": 10.0}
+         for product_id in product_ids]
+    )
+    await session.commit()
+    return user_id
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("lines", [1, 20])
+async def test_cart_is_one_statement(db_session_maker, sql_statements, lines):
+    async with db_session_maker() as session:
+        user_id = await fill_cart(session, lines)
+        sql_statements.clear()
+        cart = await CartService.get_cart(session, user_id)
+
+    assert len(sql_statements) == 1
+    assert len(cart.items) == lines
+    assert cart.items[0].product.name == "p0"
+    assert (cart.total_quantity, cart.total_price) == (2 * lines, 20.0 * lines)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("lines", [1, 20])
+async def test_order_detail_is_two_statements(db_session_maker, sql_statements, lines):
+    async with db_session_maker() as session:
+        user_id = await fill_cart(session, lines)
+        order = await OrderService.create_order(session, user_id)
+        sql_statements.clear()
+        detail = await OrderService.get_order_detail(session, user_id, order.id)
+
+    assert len(sql_statements) == 2
+    assert detail.id == order.id
+    assert [line.product.name for line in detail.order_items] == [f"p{i}" for i in range(lines)]
+
+
+@pytest.mark.anyio
+async def test_order_detail_of_other_user_is_not_found(db_session_maker):
+    async with db_session_maker() as session:
+        user_id = await fill_cart(session, 1)
+        order = await OrderService.create_order(session, user_id)
+        (other_id,) = await create_users(session, 1)
+        with pytest.raises(Exception) as error:
+            await OrderService.get_order_detail(session, other_id, order.id)
+    assert error.value.status_code == 404
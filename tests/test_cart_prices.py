@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import select, update
+
+from src.catalog.models import CartItemModel, ProductModel
+from src.catalog.schemas import CartItemCreate, ProductUpdate
+from src.catalog.service import CartService, OrderService, ProductService
+from src.exceptions import CartPricesChangedException
+from tests.test_order_service import create_users, create_product
+
+
+async def set_price(session, product_id: int, price: float, stock: int = 10):
+    product = await session.get(ProductModel, product_id)
+    await ProductService.update_product(session, product_id, ProductUpdate(
+        name=product.name, description=product.description, price=price,
+        discount_price=product.discount_price, stock=stock, category_id=product.category_id
+    ))
+
+
+@pytest.mark.anyio
+async def test_cart_price_is_taken_from_product(db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, 10)
+        await session.execute(update(ProductModel).where(ProductModel.id == product_id).values(discount_price=7.5))
+        await session.commit()
+
+        # Цена из запроса игнорируется
+        item = await CartService.add_item_to_cart(
+            session, CartItemCreate.model_validate({"product_id": product_id, "quantity": 2, "price": 0.01}), user_id)
+        assert (item.price, item.price_version) == (7.5, 1)
+
+        order = await OrderService.create_order(session, user_id)
+        assert order.total_price == 15.0
+
+
+@pytest.mark.anyio
+async def test_price_version_changes_only_with_price(db_session_maker):
+    async with db_session_maker() as session:
+        product_id = await create_product(session, 10)
+        await session.commit()
+
+        await set_price(session, product_id, 10.0, stock=5)
+        assert await session.scalar(select(ProductModel.price_version).where(ProductModel.id == product_id)) == 1
+        await set_price(session, product_id, 12.0)
+        assert await session.scalar(select(ProductModel.price_version).where(ProductModel.id == product_id)) == 2
+        await set_price(session, product_id, 12.0, stock=3)
+        assert await session.scalar(select(ProductModel.price_version).where(ProductModel.id == product_id)) == 2
+
+
+@pytest.mark.anyio
+async def test_checkout_with_stale_prices_is_rejected(db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, 10)
+        await session.commit()
+        await CartService.add_item_to_cart(session, CartItemCreate(product_id=product_id, quantity=3), user_id)
+        await set_price(session, product_id, 20.0)
+
+        with pytest.raises(CartPricesChangedException):
+            await OrderService.create_order(session, user_id)
+        # Заказ не создан, остаток не тронут, а корзина уже с новой ценой
+        line = await session.scalar(select(CartItemModel).where(CartItemModel.user_uuid == user_id))
+        assert (line.quantity, line.price, line.price_version) == (3, 20.0, 2)
+        assert await session.scalar(select(ProductModel.stock).where(ProductModel.id == product_id)) == 10
+
+        order = await OrderService.create_order(session, user_id)
+        assert order.total_price == 60.0
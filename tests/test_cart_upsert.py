@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import select
+
+from src.catalog.models import CartItemModel
+from src.catalog.schemas import CartItemCreate, CartSet
+from src.catalog.service import CartService
+from tests.test_order_service import create_users, create_product
+
+
+async def cart_of(session, user_id) -> list[tuple[int, int]]:
+    result = await session.execute(
+        select(CartItemModel.product_id, CartItemModel.quantity)
+        .where(CartItemModel.user_uuid == user_id)
+        .order_by(CartItemModel.product_id)
+    )
+    return [tuple(row) for row in result.all()]
+
+
+@pytest.mark.anyio
+async def test_concurrent_adds_accumulate(db_session_maker):
+    async with db_session_maker() as session:
+        user_ids = await create_users(session, 2)
+        product_id = await create_product(session, 10)
+        await session.commit()
+
+    async def add(user_id):
+        async with db_session_maker() as session:
+            return await CartService.add_item_to_cart(
+                session, CartItemCreate(product_id=product_id, quantity=1), user_id)
+
+    # Параллельные добавления одного товара не теряются и не дают дублей строк
+    await asyncio.gather(*(add(user_id) for user_id in user_ids for _ in range(10)))
+
+    async with db_session_maker() as session:
+        for user_id in user_ids:
+            assert await cart_of(session, user_id) == [(product_id, 10)]
+
+
+@pytest.mark.anyio
+async def test_add_unknown_product_is_not_found(db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        await session.commit()
+        with pytest.raises(HTTPException) as exc:
+            await CartService.add_item_to_cart(session, CartItemCreate(product_id=-1, quantity=1), user_id)
+    assert exc.value.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_set_cart_replaces_lines_in_one_statement(db_session_maker, sql_statements):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        kept, dropped, added = [await create_product(session, 10) for _ in range(3)]
+        await session.commit()
+        for product_id in (kept, dropped):
+            await CartService.add_item_to_cart(session, CartItemCreate(product_id=product_id, quantity=1), user_id)
+
+        sql_statements.clear()
+        items = await CartService.set_cart(session, CartSet(items=[
+            CartItemCreate(product_id=added, quantity=2),
+            CartItemCreate(product_id=kept, quantity=7),
+        ]), user_id)
+        assert len([statement for statement in sql_statements if "cart_items" in statement]) == 1
+        assert [(item.product_id, item.quantity) for item in items] == [(added, 2), (kept, 7)]
+        assert await cart_of(session, user_id) == sorted([(kept, 7), (added, 2)])
+
+        await CartService.set_cart(session, CartSet(items=[]), user_id)
+        assert await cart_of(session, user_id) == []
+
+
+@pytest.mark.anyio
+async def test_set_cart_with_unknown_product_keeps_cart(db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, 10)
+        await session.commit()
+        await CartService.add_item_to_cart(session, CartItemCreate(product_id=product_id, quantity=3), user_id)
+
+        with pytest.raises(HTTPException) as exc:
+            await CartService.set_cart(session, CartSet(items=[
+                CartItemCreate(product_id=-1, quantity=1),
+            ]), user_id)
+        assert exc.value.status_code == 404
+        assert await cart_of(session, user_id) == [(product_id, 3)]
+
+
+def test_cart_set_rejects_duplicate_products():
+    with pytest.raises(ValidationError):
+        CartSet(items=[CartItemCreate(product_id=1), CartItemCreate(product_id=1)])
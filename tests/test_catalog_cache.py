@@ -0,0 +1,98 @@
+import uuid
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import insert
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+
+from src.main import app
+from src.catalog.models import CartItemModel
+from src.catalog.schemas import CategoryCreate, ProductCreate
+from src.catalog.service import CategoryService, ProductService, OrderService
+from tests.test_order_service import create_users, create_product
+
+
+def new_product(category_id: int, name: str, sku: str = None) -> ProductCreate:
+    return ProductCreate(
+        sku=sku or str(uuid.uuid4()), name=name, description=None,
+        price=10.0, discount_price=0.0, stock=5, category_id=category_id
+    )
+
+
+@pytest.fixture
+async def client(db_session_maker):
+    FastAPICache.reset()
+    FastAPICache.init(InMemoryBackend(), prefix="test-cache", expire=60)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+    FastAPICache.reset()
+
+
+@pytest.mark.anyio
+async def test_product_list_is_cached_and_invalidated(client, db_session_maker):
+    first = await client.get("/catalog/products", params={"limit": 5})
+    second = await client.get("/catalog/products", params={"limit": 5})
+    assert first.headers["X-FastAPI-Cache"] == "MISS"
+    assert second.headers["X-FastAPI-Cache"] == "HIT"
+    assert first.json() == second.json()
+
+    # Другие query-параметры - другой ключ
+    other = await client.get("/catalog/products", params={"limit": 6})
+    assert other.headers["X-FastAPI-Cache"] == "MISS"
+
+    async with db_session_maker() as session:
+        category = await CategoryService.create_category(
+            session, CategoryCreate(name=str(uuid.uuid4())))
+        await ProductService.create_product(
+            session, new_product(category.id, "Cached"))
+
+    after = await client.get("/catalog/products", params={"limit": 5})
+    assert after.headers["X-FastAPI-Cache"] == "MISS"
+
+
+@pytest.mark.anyio
+async def test_product_page_invalidated_by_its_tag_only(client, db_session_maker):
+    async with db_session_maker() as session:
+        category = await CategoryService.create_category(
+            session, CategoryCreate(name=str(uuid.uuid4())))
+        product = await ProductService.create_product(
+            session, new_product(category.id, "Tagged"))
+        other = await ProductService.create_product(
+            session, new_product(category.id, "Other"))
+
+    for product_id in (product.id, other.id):
+        await client.get(f"/catalog/product/{product_id}")
+
+    async with db_session_maker() as session:
+        await ProductService.update_product(
+            session, product.id,
+            new_product(category.id, "Renamed", sku=product.sku))
+
+    updated = await client.get(f"/catalog/product/{product.id}")
+    untouched = await client.get(f"/catalog/product/{other.id}")
+    assert updated.headers["X-FastAPI-Cache"] == "MISS"
+    assert updated.json()["name"] == "Renamed"
+    assert untouched.headers["X-FastAPI-Cache"] == "HIT"
+
+
+@pytest.mark.anyio
+async def test_checkout_invalidates_product_pages(client, db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, stock=5)
+        await session.execute(insert(CartItemModel).values(
+            user_uuid=user_id, product_id=product_id, quantity=2, price=10.0))
+        await session.commit()
+
+    await client.get(f"/catalog/product/{product_id}")
+    await client.get("/catalog/products", params={"limit": 5})
+
+    async with db_session_maker() as session:
+        await OrderService.create_order(session, user_id)
+
+    page = await client.get(f"/catalog/product/{product_id}")
+    listing = await client.get("/catalog/products", params={"limit": 5})
+    assert page.headers["X-FastAPI-Cache"] == "MISS"
+    assert page.json()["stock"] == 3
+    assert listing.headers["X-FastAPI-Cache"] == "MISS"
@@ -0,0 +1,88 @@
+import uuid
+
+import pytest
+
+from src.catalog.schemas import Category, CategoryCreate, ProductCreate
+from src.catalog.service import CategoryService, ProductService
+from src.catalog.tree import CategoryTree, category_tree
+
+
+def make_tree() -> CategoryTree:
+    #       1          5
+    #     /   \\        |
+    #    2     3       6
+    #    |
+    #    4
+    return CategoryTree([
+        (1, "Электроника", None),
+        (2, "Телефоны", 1),
+        (3, "Ноутбуки", 1),
+        (4, "Смартфоны", 2),
+        (5, "Одежда", None),
+        (6, "Обувь", 5),
+    ])
+
+
+def test_descendants_and_ancestors():
+    tree = make_tree()
+    assert tree.descendant_ids(1) == {1, 2, 3, 4}
+    assert tree.descendant_ids(2) == {2, 4}
+    assert tree.descendant_ids(6) == {6}
+    assert tree.descendant_ids(100) == frozenset()
+    assert tree.is_ancestor(1, 4)
+    assert not tree.is_ancestor(4, 1)
+    assert not tree.is_ancestor(5, 4)
+
+
+def test_breadcrumbs_and_nested():
+    tree = make_tree()
+    assert [category.id for category in tree.breadcrumbs(4)] == [1, 2, 4]
+    assert tree.path_names(4) == "Электроника / Телефоны / Смартфоны"
+    roots = tree.nested()
+    assert [root.id for root in roots] == [1, 5]
+    assert [child.id for child in roots[0].children] == [2, 3]
+
+
+def test_cycle_is_not_indexed():
+    tree = CategoryTree([(1, "a", None), (2, "b", 3), (3, "c", 2)])
+    assert 1 in tree
+    assert 2 not in tree and 3 not in tree
+
+
+def test_patch_bumps_version():
+    tree = make_tree()
+    patched = tree.with_category(Category(id=7, name="Планшеты", parent_id=1))
+    assert patched.version == tree.version + 1
+    assert patched.descendant_ids(1) == {1, 2, 3, 4, 7}
+    # Старый снимок не меняется
+    assert tree.descendant_ids(1) == {1, 2, 3, 4}
+
+
+@pytest.mark.anyio
+async def test_products_by_category_match_cte(db_session_maker):
+    async with db_session_maker() as session:
+        root = await CategoryService.create_category(session, CategoryCreate(name=str(uuid.uuid4())))
+        child = await CategoryService.create_category(
+            session, CategoryCreate(name=str(uuid.uuid4()), parent_id=root.id))
+        for category_id in (root.id, child.id, child.id):
+            await ProductService.create_product(session, ProductCreate(
+                sku=str(uuid.uuid4()), name="p", description=None,
+                price=1.0, discount_price=0.0, stock=1, category_id=category_id))
+
+    category_tree.tree = None
+    async with db_session_maker() as session:
+        by_cte = await ProductService.get_products_by_category(session, root.id)
+
+    await category_tree.reload()
+    try:
+        async with db_session_maker() as session:
+            by_tree = await ProductService.get_products_by_category(session, root.id)
+            # Новая категория сразу видна в локальном дереве
+            leaf = await CategoryService.create_category(
+                session, CategoryCreate(name=str(uuid.uuid4()), parent_id=child.id))
+        assert category_tree.tree.is_ancestor(root.id, leaf.id)
+    finally:
+        category_tree.tree = None
+
+    assert by_cte.total == by_tree.total == 3
+    assert [p.id for p in by_cte.items] == [p.id for p in by_tree.items]
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.config import settings
+from src.main import app
+from src.metrics import (MetricsMiddleware, InstrumentedQueuePool, registry, current_route, http_requests,
+                         http_requests_in_progress, http_request_duration, db_statement_duration,
+                         db_pool_checkout_duration)
+
+
+def histogram_count(histogram, labels: tuple) -> int:
+    item = histogram.values.get(labels)
+    return sum(item[0]) if item else 0
+
+
+@pytest.mark.anyio
+async def test_middleware_labels_requests_by_route_template():
+    test_app = FastAPI()
+
+    @test_app.get("/metrics-test/{item_id}")
+    async def item(item_id: int):
+        if item_id < 0:
+            raise HTTPException(status_code=404)
+        await asyncio.sleep(0)
+        return {"id": item_id}
+
+    test_app.add_middleware(MetricsMiddleware, routes=test_app.routes)
+    async with AsyncClient(transport=ASGITransport(app=test_app), base_url="http://test") as client:
+        for path in ("/metrics-test/1", "/metrics-test/2", "/metrics-test/-1", "/metrics-test-missing"):
+            await client.get(path)
+
+    route = "/metrics-test/{item_id}"
+    assert http_requests.values[("GET", route, "200")] == 2
+    assert http_requests.values[("GET", route, "404")] == 1
+    assert http_requests.values[("GET", "<unmatched>", "404")] >= 1
+    assert histogram_count(http_request_duration, ("GET", route)) == 3
+    assert http_requests_in_progress.values[("GET", route)] == 0
+
+    rendered = registry.render()
+    assert 'http_requests_total{method="GET",route="/metrics-test/{item_id}",status="200"} 2' in rendered
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/metrics-test/{item_id}",le="+Inf"} 3' \
+           in rendered
+
+
+@pytest.mark.anyio
+async def test_metrics_endpoint():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        await client.get("/")
+        response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in response.text
+
+
+@pytest.mark.anyio
+async def test_statements_are_timed_per_route(db_session_maker):
+    token = current_route.set("metrics-test")
+    try:
+        async with db_session_maker() as session:
+            await session.execute(text("SELECT 1"))
+            await session.execute(text("  select 2"))
+    finally:
+        current_route.reset(token)
+    assert histogram_count(db_statement_duration, ("metrics-test", "SELECT")) == 2
+
+
+@pytest.mark.anyio
+async def test_pool_checkout_includes_wait(db_session_maker):
+    engine = create_async_engine(settings.TEST_DATABASE_URL, poolclass=InstrumentedQueuePool,
+                                 pool_size=1, max_overflow=0)
+    pool = engine.sync_engine.pool
+    checkouts = histogram_count(db_pool_checkout_duration, ())
+    waited = db_pool_checkout_duration.values.get((), [[], 0.0])[1]
+    waiting = []
+
+    async def hold():
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+            await asyncio.sleep(0.05)
+            waiting.append(pool.waiting)
+            await asyncio.sleep(0.2)
+
+    try:
+        await asyncio.gather(hold(), hold())
+    finally:
+        await engine.dispose()
+
+    # Второй ждал, пока первый вернет единственное соединение
+    assert 1 in waiting
+    assert histogram_count(db_pool_checkout_duration, ()) == checkouts + 2
+    assert db_pool_checkout_duration.values[()][1] - waited >= 0.2
+
+
+@pytest.mark.anyio
+async def test_exposition_sums_worker_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_DIR", str(tmp_path))
+    labels = ["GET", "/metrics-workers"]
+
+    def write(name: str, requests: int, in_progress: int):
+        (tmp_path / name).write_text(json.dumps({
+            "http_requests_total": [[labels + ["200"], requests]],
+            "http_requests_in_progress": [[labels, in_progress]],
+        }))
+
+    write("1-1.json", 3, 2)
+    write("2-1.json", 4, 5)
+    # Воркер 2 давно не обновлял файл: его счетчики остаются, гейджи нет
+    stale = time.time() - 10 * settings.METRICS_FLUSH_INTERVAL_SECONDS
+    os.utime(tmp_path / "2-1.json", (stale, stale))
+
+    await registry.start()
+    try:
+        http_requests.inc(tuple(labels + ["200"]))
+        rendered = registry.render()
+    finally:
+        await registry.close()
+        registry._file = None
+
+    assert 'http_requests_total{method="GET",route="/metrics-workers",status="200"} 8' in rendered
+    assert 'http_requests_in_progress{method="GET",route="/metrics-workers"} 2' in rendered
+    # Свой снимок воркер тоже пишет в каталог для остальных
+    own = [path for path in tmp_path.iterdir() if path.name not in ("1-1.json", "2-1.json")]
+    assert len(own) == 1 and own[0].suffix == ".json"
+    assert json.loads(own[0].read_text())["http_requests_total"]
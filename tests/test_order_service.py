@@ -0,0 +1,102 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import insert, select, func
+
+from src.catalog.models import CategoryModel, ProductModel, CartItemModel, OrderModel
+from src.catalog.service import OrderService, ProductService
+from src.users.models import UserModel
+
+
+async def create_users(session, count: int) -> list[uuid.UUID]:
+    result = await session.scalars(
+        insert(UserModel).returning(UserModel.id),
+        [
+            {"email": f"{uuid.uuid4()}@example.com", "hashed_password": "-", "fio": "test"}
+            for _ in range(count)
+        ]
+    )
+    return list(result.all())
+
+
+async def create_product(session, stock: int) -> int:
+    category_id = await session.scalar(
+        insert(CategoryModel).values(name=str(uuid.uuid4())).returning(CategoryModel.id)
+    )
+    return await session.scalar(
+        insert(ProductModel).values(
+            sku=str(uuid.uuid4()), name="Hot", price=10.0, discount_price=0.0,
+            stock=stock, category_id=category_id
+        ).returning(ProductModel.id)
+    )
+
+
+@pytest.mark.anyio
+async def test_hot_sku_checkout_never_oversells(db_session_maker):
+    stock, buyers = 20, 60
+    async with db_session_maker() as session:
+        user_ids = await create_users(session, buyers)
+        product_id = await create_product(session, stock)
+        await session.execute(
+            insert(CartItemModel),
+            [{"user_uuid": user_id, "product_id": product_id, "quantity": 1, "price": 10.0}
+             for user_id in user_ids]
+        )
+        await session.commit()
+
+    async def checkout(user_id):
+        async with db_session_maker() as session:
+            try:
+                await OrderService.create_order(session, user_id)
+                return 201
+            except HTTPException as e:
+                return e.status_code
+
+    statuses = await asyncio.gather(*(checkout(user_id) for user_id in user_ids))
+
+    assert statuses.count(201) == stock
+    assert statuses.count(409) == buyers - stock
+    async with db_session_maker() as session:
+        assert await session.scalar(select(ProductModel.stock).where(ProductModel.id == product_id)) == 0
+        orders = await session.scalar(
+            select(func.count()).select_from(OrderModel).where(OrderModel.user_uuid.in_(user_ids))
+        )
+        assert orders == stock
+
+
+@pytest.mark.anyio
+async def test_failed_reservation_keeps_cart(db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, stock=1)
+        await session.execute(insert(CartItemModel).values(
+            user_uuid=user_id, product_id=product_id, quantity=2, price=10.0))
+        await session.commit()
+
+    async with db_session_maker() as session:
+        with pytest.raises(HTTPException) as e:
+            await OrderService.create_order(session, user_id)
+    assert e.value.status_code == 409
+
+    async with db_session_maker() as session:
+        cart = (await session.scalars(
+            select(CartItemModel).where(CartItemModel.user_uuid == user_id))).all()
+        assert [item.quantity for item in cart] == [2]
+
+
+@pytest.mark.anyio
+async def test_checkout_invalidates_cached_products(db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, stock=5)
+        await session.execute(insert(CartItemModel).values(
+            user_uuid=user_id, product_id=product_id, quantity=2, price=10.0))
+        await session.commit()
+
+    async with db_session_maker() as session:
+        assert (await ProductService.get_product_by_id(session, product_id)).stock == 5
+        await OrderService.create_order(session, user_id)
+    async with db_session_maker() as session:
+        assert (await ProductService.get_product_by_id(session, product_id)).stock == 3
@@ -0,0 +1,32 @@
+import uuid
+
+import pytest
+
+from src.catalog.models import ProductModel
+from src.exceptions import InvalidCursorException
+from src.pagination import encode_cursor, decode_cursor
+from src.users.models import UserModel
+
+
+def test_cursor_roundtrip():
+    order_by = (ProductModel.price, ProductModel.id)
+    cursor = encode_cursor(order_by, [99.5, 42])
+    assert decode_cursor(order_by, cursor) == [99.5, 42]
+
+
+def test_cursor_roundtrip_uuid():
+    user_id = uuid.uuid4()
+    cursor = encode_cursor((UserModel.id,), [user_id])
+    assert decode_cursor((UserModel.id,), cursor) == [user_id]
+
+
+def test_cursor_rejects_other_ordering():
+    cursor = encode_cursor((ProductModel.id,), [42])
+    with pytest.raises(InvalidCursorException):
+        decode_cursor((ProductModel.price, ProductModel.id), cursor)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "e30"])
+def test_cursor_rejects_garbage(cursor):
+    with pytest.raises(InvalidCursorException):
+        decode_cursor((ProductModel.id,), cursor)
@@ -0,0 +1,114 @@
+import asyncio
+import uuid
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from src.main import app
+from src.catalog.loaders import DataLoader, ProductLoader
+from src.catalog.schemas import CategoryCreate, ProductCreate
+from src.catalog.service import CategoryService, ProductService
+
+
+@pytest.fixture
+async def products(db_session_maker):
+    async with db_session_maker() as session:
+        category = await CategoryService.create_category(session, CategoryCreate(name=str(uuid.uuid4())))
+        return [
+            await ProductService.create_product(session, ProductCreate(
+                sku=str(uuid.uuid4()), name=f"p{i}", description=None,
+                price=1.0, discount_price=0.0, stock=1, category_id=category.id))
+            for i in range(3)
+        ]
+
+
+@pytest.mark.anyio
+async def test_loader_batches_concurrent_loads(db_session_maker, products, sql_statements):
+    async with db_session_maker() as session:
+        loader = ProductLoader(session)
+        first, by_sku, missing = await asyncio.gather(
+            loader.by_id(products[0].id),
+            loader.by_sku(products[1].sku),
+            loader.by_id(2**31 - 1),
+        )
+        # Уже загруженное берется из памяти загрузчика, в том числе по второму ключу
+        again = await loader.by_sku(products[0].sku)
+
+    assert (first.id, by_sku.id, missing) == (products[0].id, products[1].id, None)
+    assert again == first
+    assert len([s for s in sql_statements if "FROM products" in s]) == 1
+
+
+@pytest.mark.anyio
+async def test_batch_endpoint_keeps_order_and_reports_misses(db_session_maker, products, sql_statements):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/catalog/products/batch", json={
+            "ids": [products[2].id, 2**31 - 1, products[0].id],
+            "skus": [products[1].sku, "missing-sku", products[2].sku],
+        })
+
+    body = response.json()
+    assert [item["id"] for item in body["items"]] == [products[2].id, products[0].id, products[1].id]
+    assert body["missing_ids"] == [2**31 - 1]
+    assert body["missing_skus"] == ["missing-sku"]
+    assert len([s for s in sql_statements if "FROM products" in s]) == 1
+
+
+@pytest.mark.anyio
+async def test_batch_size_is_limited(db_session_maker):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/catalog/products/batch", json={"ids": list(range(1, 102))})
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_loader_keeps_batch_tasks_until_done():
+    started = asyncio.Event()
+
+    async def batch_load(keys):
+        started.set()
+        await asyncio.sleep(0)
+        return {key: key * 2 for key in keys}
+
+    loader = DataLoader(batch_load)
+    pending = asyncio.ensure_future(loader.load_many([1, 2]))
+    await started.wait()
+    assert len(loader._tasks) == 1
+    assert await pending == [2, 4]
+    await asyncio.sleep(0)
+    assert not loader._tasks
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("fail", [False, True])
+async def test_loader_clear_during_batch_resolves_waiters(fail):
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def batch_load(keys):
+        started.set()
+        await release.wait()
+        if fail:
+            raise ValueError("boom")
+        return {key: key * 2 for key in keys}
+
+    loader = DataLoader(batch_load)
+    pending = asyncio.ensure_future(loader.load_many([1, 2]))
+    await started.wait()
+    loader.clear(1)
+    release.set()
+
+    if fail:
+        with pytest.raises(ValueError):
+            await asyncio.wait_for(pending, 1)
+    else:
+        assert await asyncio.wait_for(pending, 1) == [2, 4]
+    # Очищенный ключ грузится заново
+    release.clear()
+    reload = asyncio.ensure_future(loader.load(1))
+    await asyncio.sleep(0)
+    release.set()
+    if fail:
+        with pytest.raises(ValueError):
+            await asyncio.wait_for(reload, 1)
+    else:
+        assert await asyncio.wait_for(reload, 1) == 2
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+import uuid
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from src.main import app
+from src.catalog.schemas import CategoryCreate, ProductCreate
+from src.catalog.service import CategoryService, ProductService
+from src.catalog.tree import category_tree
+
+
+@pytest.fixture
+async def catalog(db_session_maker):
+    async with db_session_maker() as session:
+        root = await CategoryService.create_category(session, CategoryCreate(name=str(uuid.uuid4())))
+        child = await CategoryService.create_category(
+            session, CategoryCreate(name=str(uuid.uuid4()), parent_id=root.id))
+        products = [
+            await ProductService.create_product(session, ProductCreate(
+                sku=str(uuid.uuid4()), name=f'Товар "{i}", новый', description=None,
+                price=1.0 + i, discount_price=0.0, stock=i, category_id=child.id))
+            for i in range(3)
+        ]
+    yield root, child, products
+    category_tree.tree = None
+
+
+@pytest.mark.anyio
+async def test_export_ndjson_by_category_with_path(catalog):
+    root, child, products = catalog
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/catalog/export", params={
+            "category_id": root.id, "with_category_path": True})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [product.id for product in products]
+    assert rows[0]["category_path"] == f"{root.name} / {child.name}"
+
+
+@pytest.mark.anyio
+async def test_export_csv(catalog):
+    root, child, products = catalog
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/catalog/export", params={"format": "csv", "category_id": child.id})
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["name"] for row in rows] == [product.name for product in products]
+    assert rows[2]["stock"] == "2"
@@ -0,0 +1,123 @@
+import uuid
+
+import pytest
+
+from src.config import settings
+from src.catalog.facets import FacetService
+from src.catalog.schemas import CategoryCreate, ProductCreate, ProductFacetFilter, CartItemCreate
+from src.catalog.service import CategoryService, ProductService, CartService, OrderService
+from src.catalog.tree import category_tree
+from tests.test_order_service import create_users
+
+
+@pytest.fixture(params=[False, True], ids=["live", "counts-table"])
+async def catalog(request, db_session_maker, monkeypatch):
+    monkeypatch.setattr(settings, "FACET_COUNTS_ENABLED", request.param)
+    async with db_session_maker() as session:
+        root = await CategoryService.create_category(session, CategoryCreate(name=str(uuid.uuid4())))
+        child_a = await CategoryService.create_category(
+            session, CategoryCreate(name=str(uuid.uuid4()), parent_id=root.id))
+        child_b = await CategoryService.create_category(
+            session, CategoryCreate(name=str(uuid.uuid4()), parent_id=root.id))
+        products = []
+        for category_id, price, stock, discount_price in (
+                (child_a.id, 500, 5, 0),
+                (child_a.id, 2000, 0, 100),
+                (child_b.id, 7000, 3, 50),
+                (root.id, 60000, 1, 0),
+        ):
+            products.append(await ProductService.create_product(session, ProductCreate(
+                sku=str(uuid.uuid4()), name="p", description=None, price=price,
+                discount_price=discount_price, stock=stock, category_id=category_id)))
+    yield root, child_a, child_b, products
+    category_tree.tree = None
+
+
+def buckets(page) -> dict:
+    return {bucket.price_min: bucket.count for bucket in page.facets.price}
+
+
+@pytest.mark.anyio
+async def test_facets_exclude_own_filter(db_session_maker, catalog):
+    root, child_a, child_b, products = catalog
+    async with db_session_maker() as session:
+        page = await FacetService.get_faceted_products(session, ProductFacetFilter(category_id=root.id))
+        assert page.total == 4 and len(page.items) == 4
+        assert {c.id: c.count for c in page.facets.categories} == {child_a.id: 2, child_b.id: 1}
+        assert buckets(page) == {0: 1, 1000: 1, 5000: 1, 50000: 1}
+        assert (page.facets.in_stock, page.facets.has_discount) == (3, 2)
+
+        page = await FacetService.get_faceted_products(
+            session, ProductFacetFilter(category_id=root.id, in_stock=True))
+        assert page.total == 3
+        assert {c.id: c.count for c in page.facets.categories} == {child_a.id: 1, child_b.id: 1}
+        assert buckets(page) == {0: 1, 5000: 1, 50000: 1}
+        # Счетчик "в наличии" не сужается собственным фильтром
+        assert (page.facets.in_stock, page.facets.has_discount) == (3, 1)
+
+
+@pytest.mark.anyio
+async def test_price_range_and_pagination(db_session_maker, catalog):
+    root, child_a, child_b, products = catalog
+    async with db_session_maker() as session:
+        page = await FacetService.get_faceted_products(
+            session, ProductFacetFilter(category_id=root.id, price_max=5000), limit=1)
+        assert page.total == 2
+        assert [item.id for item in page.items] == [products[0].id]
+        assert buckets(page) == {0: 1, 1000: 1, 5000: 1, 50000: 1}
+
+        page = await FacetService.get_faceted_products(
+            session, ProductFacetFilter(category_id=root.id, price_max=5000),
+            limit=1, cursor=page.next_cursor)
+        assert [item.id for item in page.items] == [products[1].id]
+        assert page.next_cursor is None
+
+
+@pytest.mark.anyio
+async def test_counts_follow_product_update(db_session_maker, catalog):
+    root, child_a, child_b, products = catalog
+    product = products[0]
+    async with db_session_maker() as session:
+        await ProductService.update_product(session, product.id, ProductCreate(
+            sku=product.sku, name="p", description=None, price=product.price,
+            discount_price=10, stock=0, category_id=child_b.id))
+        page = await FacetService.get_faceted_products(session, ProductFacetFilter(category_id=root.id))
+    assert {c.id: c.count for c in page.facets.categories} == {child_a.id: 1, child_b.id: 2}
+    assert (page.facets.in_stock, page.facets.has_discount) == (2, 3)
+
+
+async def facets_both_ways(session, monkeypatch, filters):
+    pages = []
+    for enabled in (True, False):
+        monkeypatch.setattr(settings, "FACET_COUNTS_ENABLED", enabled)
+        page = await FacetService.get_faceted_products(session, filters)
+        pages.append((page.total, page.facets))
+    return pages
+
+
+@pytest.mark.anyio
+async def test_counts_follow_checkout_sell_out(db_session_maker, catalog, monkeypatch):
+    root, child_a, child_b, products = catalog
+    product = products[0]
+    if not settings.FACET_COUNTS_ENABLED:
+        pytest.skip("counts table is filled only when FACET_COUNTS_ENABLED")
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        await session.commit()
+        await CartService.add_item_to_cart(
+            session, CartItemCreate(product_id=product.id, quantity=product.stock), user_id)
+        await OrderService.create_order(session, user_id)
+
+        counted, live = await facets_both_ways(session, monkeypatch, ProductFacetFilter(category_id=root.id))
+        assert counted == live
+        assert counted[1].in_stock == 2
+
+        # Пополнение распроданного товара снова попадает в "в наличии" без ухода в минус
+        monkeypatch.setattr(settings, "FACET_COUNTS_ENABLED", True)
+        await ProductService.update_product(session, product.id, ProductCreate(
+            sku=product.sku, name="p", description=None, price=product.price,
+            discount_price=product.discount_price, stock=2, category_id=product.category_id))
+        counted, live = await facets_both_ways(
+            session, monkeypatch, ProductFacetFilter(category_id=root.id, in_stock=True))
+        assert counted == live
+        assert counted[1].in_stock == 3
@@ -0,0 +1,68 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from src.catalog.importer import ProductImportService
+from src.catalog.models import ProductModel
+from src.catalog.schemas import CategoryCreate
+from src.catalog.service import CategoryService
+
+
+async def chunked(data: bytes, size: int = 7):
+    # Режем тело на мелкие куски, чтобы строки и символы UTF-8 рвались посередине
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+@pytest.fixture
+async def category_id(db_session_maker):
+    async with db_session_maker() as session:
+        category = await CategoryService.create_category(session, CategoryCreate(name=str(uuid.uuid4())))
+    return category.id
+
+
+@pytest.mark.anyio
+async def test_ndjson_import_upserts_and_reports_errors(db_session_maker, category_id):
+    prefix = uuid.uuid4().hex
+    rows = [
+        {"sku": f"{prefix}-1", "name": "Чайник", "price": 10, "stock": 5, "category_id": category_id},
+        {"sku": f"{prefix}-2", "name": "Кружка", "price": 2.5, "stock": 100, "category_id": category_id},
+        {"sku": f"{prefix}-3", "name": "Без цены", "stock": 1, "category_id": category_id},
+        {"sku": f"{prefix}-4", "name": "Чужая", "price": 1, "stock": 1, "category_id": 2**31 - 1},
+    ]
+    body = "\n".join(json.dumps(row, ensure_ascii=False) for row in rows) + "\n{broken\n"
+    report = await ProductImportService.import_products(chunked(body.encode()), "ndjson", batch_size=2)
+
+    assert (report.rows, report.inserted, report.updated, report.rejected) == (5, 2, 0, 3)
+    assert sorted(error.line for error in report.errors) == [3, 4, 5]
+
+    # Повторный импорт: одна строка изменилась, вторая нет
+    rows[0]["price"] = 12
+    body = "\n".join(json.dumps(row, ensure_ascii=False) for row in rows[:2])
+    report = await ProductImportService.import_products(chunked(body.encode()), "ndjson")
+    assert (report.inserted, report.updated, report.unchanged) == (0, 1, 1)
+
+    async with db_session_maker() as session:
+        price = await session.scalar(select(ProductModel.price).where(ProductModel.sku == f"{prefix}-1"))
+    assert price == 12
+
+
+@pytest.mark.anyio
+async def test_csv_import_with_quoted_newlines_and_duplicates(db_session_maker, category_id):
+    prefix = uuid.uuid4().hex
+    body = (
+        "sku,name,description,price,discount_price,stock,category_id\r\n"
+        f'{prefix}-1,Лампа,"Теплый свет,\nдве строки",5,,3,{category_id}\r\n'
+        f"{prefix}-1,Лампа,,6,,3,{category_id}\r\n"
+        f"{prefix}-2,Торшер,,-1,,3,{category_id}\r\n"
+    )
+    report = await ProductImportService.import_products(chunked(body.encode()), "csv")
+
+    assert (report.rows, report.inserted, report.duplicates, report.rejected) == (3, 1, 1, 1)
+    assert report.errors[0].line == 5 and report.errors[0].sku == f"{prefix}-2"
+
+    async with db_session_maker() as session:
+        product = await session.scalar(select(ProductModel).where(ProductModel.sku == f"{prefix}-1"))
+    assert product.price == 6 and product.description is None
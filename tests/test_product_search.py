@@ -0,0 +1,81 @@
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from src.config import settings
+from src.catalog.schemas import CategoryCreate, ProductCreate
+from src.catalog.service import CategoryService, ProductService
+from src.catalog.tree import category_tree
+
+
+@pytest.fixture
+async def trigram(db_session_maker, monkeypatch):
+    # Без pg_trgm в тестовой базе проверяем только полнотекстовую часть поиска
+    async with db_session_maker() as session:
+        available = await session.scalar(text("SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'"))
+    monkeypatch.setattr(settings, "SEARCH_TRIGRAM_ENABLED", bool(available))
+    return bool(available)
+
+
+@pytest.fixture
+async def catalog(db_session_maker):
+    marker = uuid.uuid4().hex[:12]
+    async with db_session_maker() as session:
+        root = await CategoryService.create_category(session, CategoryCreate(name=str(uuid.uuid4())))
+        child = await CategoryService.create_category(
+            session, CategoryCreate(name=str(uuid.uuid4()), parent_id=root.id))
+        other = await CategoryService.create_category(session, CategoryCreate(name=str(uuid.uuid4())))
+        products = {}
+        for key, name, description, category_id in (
+                ("laptop", f"Ноутбук {marker}", "Легкий ноутбук для работы", child.id),
+                ("bag", f"Сумка {marker}", f"Сумка для ноутбука {marker}", root.id),
+                ("phone", f"Телефон {marker}", "Смартфон", other.id),
+        ):
+            products[key] = await ProductService.create_product(session, ProductCreate(
+                sku=f"{key}-{marker}", name=name, description=description,
+                price=1.0, discount_price=0.0, stock=1, category_id=category_id))
+    yield marker, root, products
+    category_tree.tree = None
+
+
+@pytest.mark.anyio
+async def test_search_ranks_highlights_and_filters(db_session_maker, trigram, catalog):
+    marker, root, products = catalog
+    async with db_session_maker() as session:
+        # Слово в названии весит больше, чем в описании; словоформа не важна
+        page = await ProductService.search_products(session, "ноутбуки", category_id=root.id)
+        assert [hit.id for hit in page.items] == [products["laptop"].id, products["bag"].id]
+        assert page.items[0].rank > page.items[1].rank
+        assert "<mark>ноутбука</mark>" in page.items[1].highlight
+
+        # Префикс слова и фильтр по поддереву категории
+        page = await ProductService.search_products(session, marker[:8], category_id=root.id)
+        assert {hit.id for hit in page.items} == {products["laptop"].id, products["bag"].id}
+        page = await ProductService.search_products(session, marker[:8])
+        assert len(page.items) == 3
+
+
+@pytest.mark.anyio
+async def test_search_keyset_pages(db_session_maker, trigram, catalog):
+    marker, root, products = catalog
+    seen = []
+    cursor = None
+    async with db_session_maker() as session:
+        while True:
+            page = await ProductService.search_products(session, marker, limit=1, cursor=cursor)
+            seen += [hit.id for hit in page.items]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+    assert sorted(seen) == sorted(product.id for product in products.values())
+
+
+@pytest.mark.anyio
+async def test_search_tolerates_typos(db_session_maker, trigram, catalog):
+    if not trigram:
+        pytest.skip("pg_trgm is not installed in the test database")
+    marker, root, products = catalog
+    async with db_session_maker() as session:
+        page = await ProductService.search_products(session, f"Телефн {marker}")
+    assert page.items[0].id == products["phone"].id
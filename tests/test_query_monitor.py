@@ -0,0 +1,105 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from loguru import logger
+from sqlalchemy import text
+
+from src.catalog.dao import ProductDAO
+from src.config import settings
+from src.main import app
+from src.query_monitor import statement_shape, track_queries
+from src.users.schemas import Principal
+from src.users.service import AuthService
+from tests.test_order_service import create_users, create_product
+
+
+@pytest.fixture
+def warnings():
+    messages = []
+    sink = logger.add(lambda message: messages.append(str(message)), level="WARNING")
+    yield messages
+    logger.remove(sink)
+
+
+def test_statement_shape_ignores_parameter_values():
+    assert statement_shape("SELECT * FROM products\n WHERE id = $1") == "SELECT * FROM products WHERE id = ?"
+    assert statement_shape("SELECT * FROM products WHERE id IN ($1, $2, $3)") == \
+           statement_shape("SELECT * FROM products WHERE id IN ($4, $5)") == \
+           "SELECT * FROM products WHERE id IN (?...)"
+    assert statement_shape("INSERT INTO t (a, b) VALUES ($1, $2), ($3, $4), ($5, $6)") == \
+           statement_shape("INSERT INTO t (a, b) VALUES ($1, $2), ($3, $4)") == \
+           "INSERT INTO t (a, b) VALUES (?...)..."
+
+
+@pytest.mark.anyio
+async def test_repeated_dao_statements_are_reported(db_session_maker, warnings):
+    async with db_session_maker() as session:
+        product_ids = [await create_product(session, 1) for _ in range(4)]
+        await session.commit()
+
+        with track_queries("n+1 test") as stats:
+            for product_id in product_ids:
+                await ProductDAO.find_one_or_none(session, id=product_id)
+            await session.execute(text("SELECT 1"))
+
+    assert stats.count == 5
+    ((shape, count),) = stats.repeated().items()
+    assert count == 4 and shape.startswith("SELECT products.")
+    assert stats.sources[shape] == {"ProductDAO.find_one_or_none"}
+    assert any("Possible N+1 in n+1 test" in message and "ProductDAO.find_one_or_none" in message
+               for message in warnings)
+
+
+@pytest.mark.anyio
+async def test_slow_statements_are_logged(db_session_maker, warnings, monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_MONITOR_SLOW_MS", 5)
+    async with db_session_maker() as session:
+        with track_queries("slow test") as stats:
+            await session.execute(text("SELECT pg_sleep(0.01)"))
+            await session.execute(text("SELECT 1"))
+    assert [shape for shape, _ in stats.slow] == ["SELECT pg_sleep(0.01)"]
+    assert any("Slow statement in slow test" in message for message in warnings)
+
+
+@pytest.mark.anyio
+async def test_query_budget_fails_when_exceeded(db_session_maker, query_budget):
+    async with db_session_maker() as session:
+        with pytest.raises(AssertionError, match="Query budget of 1 exceeded"):
+            with query_budget(1):
+                await session.execute(text("SELECT 1"))
+                await session.execute(text("SELECT 2"))
+        with pytest.raises(AssertionError, match="repeated more than 1 times"):
+            with query_budget(10, max_repeats=1):
+                for _ in range(2):
+                    await session.execute(text("SELECT 1"))
+
+
+@pytest.mark.anyio
+async def test_checkout_endpoints_stay_within_budget(db_session_maker, query_budget, monkeypatch):
+    # Флаги в токене: авторизация не ходит в базу, считаются только запросы эндпоинта
+    monkeypatch.setattr(settings, "AUTH_CLAIMS_IN_TOKEN", True)
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_ids = [await create_product(session, 10) for _ in range(5)]
+        await session.commit()
+    access_token = AuthService._create_access_token(
+        Principal(id=user_id, is_active=True, is_verified=True, is_superuser=False))
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test",
+                           cookies={"access_token": access_token}) as client:
+        # Число запросов не зависит от числа строк корзины
+        with query_budget(1):
+            response = await client.put("/user/cart", json={"items": [
+                {"product_id": product_id, "quantity": 2} for product_id in product_ids]})
+        assert response.status_code == 200
+
+        with query_budget(1):
+            response = await client.get("/user/cart_items")
+        assert len(response.json()) == 5
+
+        with query_budget(3):
+            response = await client.post("/user/create_order")
+        assert response.status_code == 201
+
+        with query_budget(2):
+            response = await client.get(f"/user/orders/{response.json()['id']}")
+        assert len(response.json()["order_items"]) == 5
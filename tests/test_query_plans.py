@@ -0,0 +1,132 @@
+import json
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, text
+
+from src.catalog.schemas import OrderStatus
+from src.catalog.service import ProductService, CartService, OrderService
+from src.database import engine
+from src.users.service import AuthService, UserService
+from src.users.session_store import postgres_session_store
+
+# Объемы, на которых планировщик уже не выбирает seq scan для точечных запросов
+USERS = 20_000
+PRODUCTS = 20_000
+CATEGORIES = 50
+
+# Большие таблицы: по ним сервисные запросы не должны идти полным проходом
+HOT_TABLES = {"users", "refresh_sessions", "products", "cart_items", "orders", "order_items"}
+
+
+@pytest.fixture(scope="module")
+async def seeded(db_session_maker):
+    # Наполнение один раз на базу: маркер - категория query-plans-0
+    async with db_session_maker() as session:
+        first_category = await session.scalar(text("SELECT id FROM categories WHERE name = 'query-plans-0'"))
+        if first_category is None:
+            first_category = await session.scalar(text(
+                "INSERT INTO categories (name) SELECT 'query-plans-' || g FROM generate_series(0, :n - 1) AS g "
+                "RETURNING id"
+            ), {"n": CATEGORIES})
+            await session.execute(text(
+                "INSERT INTO products (sku, name, price, discount_price, stock, category_id) "
+                "SELECT 'query-plans-' || g, 'Plan ' || g, 100, 0, 1000000, :first + g % :n "
+                "FROM generate_series(1, :rows) AS g"
+            ), {"rows": PRODUCTS, "first": first_category, "n": CATEGORIES})
+            await session.execute(text(
+                "INSERT INTO users (id, email, hashed_password, fio, is_active, is_verified, is_superuser) "
+                "SELECT gen_random_uuid(), 'query-plans-' || g || '@example.com', '-', 'plan', true, true, false "
+                "FROM generate_series(1, :rows) AS g"
+            ), {"rows": USERS})
+            await session.execute(text(
+                "WITH plan_users AS (SELECT id, row_number() OVER () AS n FROM users "
+                "  WHERE email LIKE 'query-plans-%'), "
+                "plan_products AS (SELECT array_agg(id ORDER BY id) AS ids FROM products "
+                "  WHERE sku LIKE 'query-plans-%'), "
+                "sessions AS (INSERT INTO refresh_sessions (refresh_token, expires_in, expires_at, user_id) "
+                "  SELECT gen_random_uuid(), 86400, now() + interval '1 day', id "
+                "  FROM plan_users, generate_series(1, 2)), "
+                "carts AS (INSERT INTO cart_items (user_uuid, product_id, quantity, price) "
+                "  SELECT u.id, p.ids[1 + (u.n * 2 + k) % cardinality(p.ids)], 1, 100 "
+                "  FROM plan_users u, plan_products p, generate_series(0, 1) AS k), "
+                "orders AS (INSERT INTO orders (user_uuid, created_at, status, total_price) "
+                "  SELECT id, now(), :status, 300 FROM plan_users, generate_series(1, 3) RETURNING id) "
+                "INSERT INTO order_items (order_id, product_id, quantity, price) "
+                "SELECT o.id, p.ids[1 + (o.id * 3 + k) % cardinality(p.ids)], 1, 100 "
+                "FROM orders o, plan_products p, generate_series(0, 2) AS k"
+            ), {"status": OrderStatus.CREATED.value})
+            await session.commit()
+            for table in sorted(HOT_TABLES):
+                await session.execute(text(f"ANALYZE {table}"))
+
+        user_id = await session.scalar(text(
+            "SELECT user_uuid FROM cart_items c JOIN users u ON u.id = c.user_uuid "
+            "WHERE u.email LIKE 'query-plans-%' ORDER BY random() LIMIT 1"))
+        order_id = await session.scalar(text("SELECT id FROM orders WHERE user_uuid = :u LIMIT 1"), {"u": user_id})
+        return {"user_id": user_id, "order_id": order_id, "category_id": first_category}
+
+
+@pytest.fixture
+def captured():
+    # Запросы вместе с параметрами, чтобы потом получить их план
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "INSERT", "UPDATE",
+                                                                                 "DELETE", "WITH"):
+            executed.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+def seq_scans(plan: dict) -> set[str]:
+    found = {plan["Relation Name"]} if plan["Node Type"] == "Seq Scan" else set()
+    for child in plan.get("Plans", ()):
+        found |= seq_scans(child)
+    return found
+
+
+async def call(coroutine):
+    # Для плана важен сам запрос, а не то, нашлась ли строка
+    try:
+        await coroutine
+    except HTTPException:
+        pass
+
+
+CASES = {
+    "get_cart": lambda session, s: CartService.get_cart(session, s["user_id"]),
+    "get_cart_items": lambda session, s: CartService.get_cart_items(session, s["user_id"]),
+    "remove_cart_item": lambda session, s: CartService.remove_cart_item(session, -1, s["user_id"]),
+    "get_orders": lambda session, s: OrderService.get_orders(session, s["user_id"]),
+    "get_order_detail": lambda session, s: OrderService.get_order_detail(session, s["user_id"], s["order_id"]),
+    "get_products_by_category": lambda session, s: ProductService.get_products_by_category(
+        session, s["category_id"]),
+    "get_product_by_id": lambda session, s: ProductService.get_product_by_id(session, -1),
+    "logout": lambda session, s: AuthService.logout(session, uuid.uuid4()),
+    "refresh_token": lambda session, s: AuthService.refresh_token(session, uuid.uuid4()),
+    "abort_all_sessions": lambda session, s: AuthService.abort_all_sessions(session, uuid.uuid4()),
+    "sweep_expired_sessions": lambda session, s: postgres_session_store.sweep_expired(100),
+    "get_user": lambda session, s: UserService.get_user(session, s["user_id"]),
+    "authenticate_user": lambda session, s: AuthService.authenticate_user(session, "missing@example.com", "-"),
+}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("case", sorted(CASES))
+async def test_service_queries_use_indexes(db_session_maker, seeded, captured, case):
+    async with db_session_maker() as session:
+        await call(CASES[case](session, seeded))
+    assert captured, f"{case} did not reach the database"
+
+    async with engine.connect() as connection:
+        for statement, parameters in captured:
+            plan = (await connection.exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {statement}", parameters)).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            scanned = seq_scans(plan[0]["Plan"]) & HOT_TABLES
+            assert not scanned, f"{case}: seq scan on {sorted(scanned)}\n{statement}"
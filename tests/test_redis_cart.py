@@ -0,0 +1,167 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+
+from src.catalog.cart_store import cart_store
+from src.catalog.models import CartItemModel, ProductModel, OrderModel
+from src.catalog.schemas import CartItemCreate, CartItemUpdate, CartSet
+from src.catalog.service import CartService, OrderService
+from src.config import settings
+from src.exceptions import CartPricesChangedException
+from tests.test_order_service import create_users, create_product
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+async def redis_cart(monkeypatch):
+    monkeypatch.setattr(settings, "CART_BACKEND", "redis")
+    monkeypatch.setattr(settings, "CART_WRITE_BEHIND", True)
+    redis = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(cart_store, "redis", redis)
+    yield redis
+    await redis.close()
+
+
+@pytest.mark.anyio
+async def test_add_accumulates_and_updates(db_session_maker, redis_cart):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, 10)
+        await session.commit()
+
+        await CartService.add_item_to_cart(session, CartItemCreate(product_id=product_id, quantity=2), user_id)
+        item = await CartService.add_item_to_cart(
+            session, CartItemCreate(product_id=product_id, quantity=3), user_id)
+        assert item.quantity == 5
+
+        await CartService.update_cart_item(
+            session, CartItemUpdate(id=product_id, user_uuid=user_id, product_id=product_id, quantity=1))
+        cart = await CartService.get_cart(session, user_id)
+        assert [(line.product_id, line.quantity, line.product.name) for line in cart.items] == \
+               [(product_id, 1, "Hot")]
+
+        await CartService.remove_cart_item(session, product_id, user_id)
+        assert await CartService.get_cart_items(session, user_id) == []
+        # От удаленной строки не остается ни одного поля
+        assert await redis_cart.hgetall(cart_store._key(user_id)) == {}
+        with pytest.raises(HTTPException) as exc:
+            await CartService.remove_cart_item(session, product_id, user_id)
+        assert exc.value.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_checkout_from_redis_cart(db_session_maker, redis_cart):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, 10)
+        await session.commit()
+        await CartService.add_item_to_cart(session, CartItemCreate(product_id=product_id, quantity=4), user_id)
+
+        order = await OrderService.create_order(session, user_id)
+        assert order.total_price == 40
+        assert await session.scalar(select(ProductModel.stock).where(ProductModel.id == product_id)) == 6
+        assert await CartService.get_cart_items(session, user_id) == []
+        # Ключ checkout-а не остается в redis
+        assert await redis_cart.keys(f"cart:{user_id}*") == []
+
+        with pytest.raises(HTTPException) as exc:
+            await OrderService.create_order(session, user_id)
+        assert exc.value.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_failed_checkout_keeps_redis_cart(db_session_maker, redis_cart):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, 10)
+        await session.commit()
+        await CartService.add_item_to_cart(session, CartItemCreate(product_id=product_id, quantity=4), user_id)
+        await session.execute(update(ProductModel).where(ProductModel.id == product_id).values(stock=1))
+        await session.commit()
+
+        with pytest.raises(HTTPException) as exc:
+            await OrderService.create_order(session, user_id)
+        assert exc.value.status_code == 409
+        await session.rollback()
+
+        assert [(item.product_id, item.quantity) for item in await CartService.get_cart_items(session, user_id)] == \
+               [(product_id, 4)]
+        assert await session.scalar(select(OrderModel.id).where(OrderModel.user_uuid == user_id)) is None
+
+
+@pytest.mark.anyio
+async def test_write_behind_copies_carts_to_postgres(db_session_maker, redis_cart):
+    async with db_session_maker() as session:
+        user_ids = await create_users(session, 2)
+        product_id = await create_product(session, 10)
+        await session.commit()
+        for user_id in user_ids:
+            await CartService.add_item_to_cart(
+                session, CartItemCreate(product_id=product_id, quantity=2), user_id)
+        await cart_store.remove(user_ids[1], product_id)
+
+        assert await cart_store.flush_dirty(100) == 2
+        rows = (await session.execute(
+            select(CartItemModel.user_uuid, CartItemModel.quantity)
+            .where(CartItemModel.user_uuid.in_(user_ids))
+        )).all()
+        assert rows == [(user_ids[0], 2)]
+        assert await cart_store.flush_dirty(100) == 0
+
+
+@pytest.mark.anyio
+async def test_write_behind_skips_deleted_products(db_session_maker, redis_cart):
+    async with db_session_maker() as session:
+        user_ids = await create_users(session, 2)
+        product_id, deleted_id = await create_product(session, 10), await create_product(session, 10)
+        await session.commit()
+        await CartService.add_item_to_cart(session, CartItemCreate(product_id=deleted_id, quantity=1), user_ids[0])
+        for user_id in user_ids:
+            await CartService.add_item_to_cart(
+                session, CartItemCreate(product_id=product_id, quantity=2), user_id)
+        await session.execute(delete(ProductModel).where(ProductModel.id == deleted_id))
+        await session.commit()
+
+        # Строка удаленного товара не мешает сохранить остальные корзины пачки
+        assert await cart_store.flush_dirty(100) == 2
+        rows = (await session.execute(
+            select(CartItemModel.user_uuid, CartItemModel.product_id)
+            .where(CartItemModel.user_uuid.in_(user_ids))
+        )).all()
+        assert sorted(rows) == sorted((user_id, product_id) for user_id in user_ids)
+        assert await cart_store.flush_dirty(100) == 0
+
+
+@pytest.mark.anyio
+async def test_set_cart_replaces_redis_cart(db_session_maker, redis_cart):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        kept, dropped = await create_product(session, 10), await create_product(session, 10)
+        await session.commit()
+        for product_id in (kept, dropped):
+            await CartService.add_item_to_cart(session, CartItemCreate(product_id=product_id, quantity=1), user_id)
+
+        await CartService.set_cart(session, CartSet(items=[CartItemCreate(product_id=kept, quantity=5)]), user_id)
+        assert [(item.product_id, item.quantity) for item in await CartService.get_cart_items(session, user_id)] == \
+               [(kept, 5)]
+
+
+@pytest.mark.anyio
+async def test_stale_redis_cart_is_repriced(db_session_maker, redis_cart):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        product_id = await create_product(session, 10)
+        await session.commit()
+        await CartService.add_item_to_cart(session, CartItemCreate(product_id=product_id, quantity=2), user_id)
+        await session.execute(
+            update(ProductModel).where(ProductModel.id == product_id).values(price=15.0, price_version=2))
+        await session.commit()
+
+        with pytest.raises(CartPricesChangedException):
+            await OrderService.create_order(session, user_id)
+        assert [(item.quantity, item.price, item.price_version)
+                for item in await CartService.get_cart_items(session, user_id)] == [(2, 15.0, 2)]
+
+        order = await OrderService.create_order(session, user_id)
+        assert order.total_price == 30.0
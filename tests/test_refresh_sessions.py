@@ -0,0 +1,198 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from loguru import logger
+from sqlalchemy import select, func
+
+from src.config import settings
+from src.exceptions import InvalidTokenException, TokenExpiredException
+from src.users.models import UserModel, RefreshSessionModel
+from src.users.service import AuthService
+from src.users.session_store import postgres_session_store, redis_session_store, get_session_store
+from tests.test_order_service import create_users
+
+
+@pytest.fixture(params=["postgres", "redis"])
+async def backend(request, monkeypatch):
+    monkeypatch.setattr(settings, "REFRESH_SESSION_BACKEND", request.param)
+    if request.param == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        redis = fakeredis.FakeAsyncRedis()
+        monkeypatch.setattr(redis_session_store, "redis", redis)
+        yield request.param
+        await redis.close()
+    else:
+        yield request.param
+
+
+async def login(session, count: int = 1):
+    user_ids = await create_users(session, count)
+    await session.commit()
+    user = await session.get(UserModel, user_ids[0])
+    return user, [await AuthService.create_token(session, user) for _ in range(count)]
+
+
+@pytest.mark.anyio
+async def test_refresh_rotates_token(db_session_maker, backend):
+    async with db_session_maker() as session:
+        user, (token,) = await login(session)
+
+        refreshed = await AuthService.refresh_token(session, token.refresh_token)
+        assert refreshed.refresh_token != token.refresh_token
+        refreshed = await AuthService.refresh_token(session, refreshed.refresh_token)
+        assert refreshed.access_token.startswith("Bearer ")
+
+
+@pytest.mark.anyio
+async def test_reused_token_revokes_family(db_session_maker, backend):
+    async with db_session_maker() as session:
+        user, (token, other) = await login(session, 2)
+        refreshed = await AuthService.refresh_token(session, token.refresh_token)
+
+        # Обмененный токен предъявлен снова: отзывается вся семья, другой логин живет
+        with pytest.raises(InvalidTokenException):
+            await AuthService.refresh_token(session, token.refresh_token)
+        with pytest.raises(InvalidTokenException):
+            await AuthService.refresh_token(session, refreshed.refresh_token)
+        assert await AuthService.refresh_token(session, other.refresh_token)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("reuse_detection", [True, False])
+async def test_concurrent_refresh_has_one_winner(db_session_maker, backend, monkeypatch, reuse_detection):
+    monkeypatch.setattr(settings, "REFRESH_REUSE_DETECTION", reuse_detection)
+    async with db_session_maker() as session:
+        user, (token,) = await login(session)
+
+    async def refresh():
+        async with db_session_maker() as session:
+            return await AuthService.refresh_token(session, token.refresh_token)
+
+    results = await asyncio.gather(*(refresh() for _ in range(10)), return_exceptions=True)
+    winners = [result for result in results if not isinstance(result, Exception)]
+    assert len(winners) == 1
+    assert all(isinstance(result, InvalidTokenException) for result in results if result not in winners)
+
+    async with db_session_maker() as session:
+        if reuse_detection:
+            # Проигравшие предъявили уже обмененный токен - семья отозвана
+            with pytest.raises(InvalidTokenException):
+                await AuthService.refresh_token(session, winners[0].refresh_token)
+        else:
+            assert await AuthService.refresh_token(session, winners[0].refresh_token)
+
+
+@pytest.mark.anyio
+async def test_inactive_user_cannot_refresh(db_session_maker, backend):
+    async with db_session_maker() as session:
+        user, (token,) = await login(session)
+        user.is_active = False
+        await session.commit()
+        messages = []
+        sink = logger.add(lambda message: messages.append(str(message)), level="WARNING")
+        try:
+            with pytest.raises(InvalidTokenException):
+                await AuthService.refresh_token(session, token.refresh_token)
+        finally:
+            logger.remove(sink)
+        # Отказ неактивному - не повторное предъявление: тревоги нет, сессия цела
+        assert not any("reuse detected" in message for message in messages)
+        user.is_active = True
+        await session.commit()
+        assert await AuthService.refresh_token(session, token.refresh_token)
+
+
+@pytest.mark.anyio
+async def test_rotation_is_one_statement(db_session_maker, sql_statements, monkeypatch):
+    monkeypatch.setattr(settings, "REFRESH_SESSION_BACKEND", "postgres")
+    async with db_session_maker() as session:
+        user, (token,) = await login(session)
+        sql_statements.clear()
+        await AuthService.refresh_token(session, token.refresh_token)
+    assert len(sql_statements) == 1
+
+
+@pytest.mark.anyio
+async def test_logout_and_abort_all(db_session_maker, backend):
+    async with db_session_maker() as session:
+        user, tokens = await login(session, 3)
+
+        await AuthService.logout(session, tokens[0].refresh_token)
+        with pytest.raises(InvalidTokenException):
+            await AuthService.refresh_token(session, tokens[0].refresh_token)
+
+        await AuthService.abort_all_sessions(session, user.id)
+        for token in tokens[1:]:
+            with pytest.raises(InvalidTokenException):
+                await AuthService.refresh_token(session, token.refresh_token)
+
+
+@pytest.mark.anyio
+async def test_expired_session_is_rejected(db_session_maker, backend):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        await session.commit()
+        token = uuid.uuid4()
+        await get_session_store().add(session, user_id, token, 1)
+        refresh_session = await get_session_store().get(session, token)
+        assert refresh_session.user_id == user_id
+
+        # В redis ключ истекает сам, в postgres срок проверяется по expires_at
+        if backend == "redis":
+            await redis_session_store.redis.delete(redis_session_store._key(token))
+            expected = InvalidTokenException
+        else:
+            await session.execute(
+                RefreshSessionModel.__table__.update()
+                .where(RefreshSessionModel.refresh_token == token)
+                .values(expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+            await session.commit()
+            expected = TokenExpiredException
+        with pytest.raises(expected):
+            await AuthService.refresh_token(session, token)
+
+
+@pytest.mark.anyio
+async def test_sweeper_deletes_only_expired(db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        await session.commit()
+        for expires_in in (-60, -30, 3600):
+            await postgres_session_store.add(session, user_id, uuid.uuid4(), expires_in)
+
+        # Пачками по одной: проходим, пока не останутся только живые
+        while await postgres_session_store.sweep_expired(1):
+            pass
+        remaining = await session.scalar(
+            select(func.count()).select_from(RefreshSessionModel).where(RefreshSessionModel.user_id == user_id))
+        assert remaining == 1
+
+
+@pytest.mark.anyio
+async def test_redis_rotation_never_hides_used_token(db_session_maker, backend):
+    if backend != "redis":
+        pytest.skip("redis only")
+    async with db_session_maker() as session:
+        user, (token,) = await login(session)
+    redis = redis_session_store.redis
+    key, used_key = redis_session_store._key(token.refresh_token), redis_session_store._used_key(token.refresh_token)
+    gaps, done = [], False
+
+    async def observe():
+        # Параллельный запрос в любой момент видит либо живой токен, либо метку использования
+        while not done:
+            async with redis.pipeline(transaction=True) as pipe:
+                exists, used = await pipe.exists(key).exists(used_key).execute()
+            gaps.append(not exists and not used)
+            await asyncio.sleep(0)
+
+    observer = asyncio.create_task(observe())
+    try:
+        async with db_session_maker() as session:
+            await AuthService.refresh_token(session, token.refresh_token)
+    finally:
+        done = True
+        await observer
+    assert gaps and not any(gaps)
@@ -0,0 +1,111 @@
+import time
+import uuid
+
+import pytest
+from jose import jwt
+
+from src.config import settings
+from src.exceptions import InvalidTokenException, TokenExpiredException
+from src.users.dependencies import get_current_user
+from src.users.schemas import Principal
+from src.users.service import AuthService
+from src.users.token_codec import TokenCodec, token_codec
+
+
+def claims(ttl: int = 60) -> dict:
+    return {"sub": str(uuid.uuid4()), "exp": int(time.time()) + ttl}
+
+
+@pytest.mark.parametrize("algorithm", ["HS256", "HS384", "HS512"])
+def test_hmac_tokens_are_compatible_with_jose(algorithm):
+    codec = TokenCodec(algorithm, "secret")
+    payload = claims()
+    assert jwt.decode(codec.encode(payload), "secret", algorithms=[algorithm]) == payload
+    assert codec.decode(jwt.encode(payload, "secret", algorithm=algorithm)) == payload
+
+
+def test_rejects_tampered_and_foreign_tokens():
+    codec = TokenCodec("HS256", "secret")
+    token = codec.encode(claims())
+    header, payload, signature = token.split(".")
+    other = TokenCodec("HS256", "other").encode(claims())
+
+    for bad in (
+            f"{header}.{other.split('.')[1]}.{signature}",
+            other,
+            jwt.encode(claims(), "secret", algorithm="HS512"),
+            f"{header}.{payload}.",
+            "not-a-token",
+    ):
+        with pytest.raises(InvalidTokenException):
+            codec.decode(bad)
+
+
+def test_expired_token_is_rejected_even_from_cache(monkeypatch):
+    codec = TokenCodec("HS256", "secret", cache_size=10)
+    with pytest.raises(TokenExpiredException):
+        codec.decode(codec.encode(claims(ttl=-1)))
+
+    token = codec.encode(claims(ttl=5))
+    codec.decode(token)
+    # Запись в кэше живет не дольше exp самого токена
+    now, monotonic = time.time(), time.monotonic()
+    monkeypatch.setattr(time, "time", lambda: now + 10)
+    monkeypatch.setattr(time, "monotonic", lambda: monotonic + 10)
+    with pytest.raises(TokenExpiredException):
+        codec.decode(token)
+
+
+def test_verification_cache_is_bounded(monkeypatch):
+    codec = TokenCodec("HS256", "secret", cache_size=2)
+    tokens = [codec.encode(claims()) for _ in range(3)]
+    verified = []
+    verify = codec._verify
+    monkeypatch.setattr(codec, "_verify", lambda *args: verified.append(1) or verify(*args))
+
+    for token in tokens + tokens[1:]:
+        codec.decode(token)
+    # Первый токен вытеснен, два последних проверены только один раз
+    assert len(verified) == 3
+    codec.decode(tokens[0])
+    assert len(verified) == 4
+
+
+@pytest.mark.parametrize("algorithm", ["RS256", "EdDSA"])
+def test_asymmetric_tokens_verify_with_public_key_only(algorithm):
+    pytest.importorskip("cryptography")
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if algorithm == "RS256":
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+    issuer = TokenCodec(algorithm, private_pem)
+    verifier = TokenCodec(algorithm, "", public_pem.replace("\n", "\\n"))
+    payload = claims()
+    token = issuer.encode(payload)
+    assert verifier.decode(token) == payload
+    with pytest.raises(ValueError):
+        verifier.encode(payload)
+    with pytest.raises(InvalidTokenException):
+        verifier.decode(TokenCodec("HS256", public_pem).encode(payload))
+
+
+@pytest.mark.anyio
+async def test_access_token_round_trip(monkeypatch):
+    monkeypatch.setattr(settings, "AUTH_CLAIMS_IN_TOKEN", True)
+    principal = Principal(id=uuid.uuid4(), is_active=True, is_verified=True, is_superuser=False)
+    access_token = AuthService._create_access_token(principal)
+
+    scheme, token = access_token.split(" ", 1)
+    assert scheme == "Bearer"
+    assert token_codec.decode(token)["sub"] == str(principal.id)
+    assert await get_current_user(token, session=None) == principal
+    with pytest.raises(InvalidTokenException):
+        await get_current_user(token[:-2], session=None)
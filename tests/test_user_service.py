@@ -0,0 +1,54 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import update
+
+from src.cache import invalidation_bus
+from src.users.dependencies import get_current_user, get_current_active_user
+from src.users.models import UserModel
+from src.users.schemas import Principal
+from src.users.service import AuthService, UserService, principal_cache
+from tests.test_order_service import create_users
+
+
+async def current_active_user(session, token: str) -> Principal:
+    return await get_current_active_user(await get_current_user(token, session=session))
+
+
+@pytest.mark.anyio
+async def test_deleted_user_is_rejected_at_once(db_session_maker):
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        await session.execute(update(UserModel).where(UserModel.id == user_id).values(is_verified=True))
+        await session.commit()
+        principal = await UserService.get_principal(session, user_id)
+        token = AuthService._create_access_token(principal).split(" ", 1)[1]
+
+        # Принципал уже в кэше - удаление должно его сбросить
+        assert (await current_active_user(session, token)).id == user_id
+        await UserService.delete_user(session, user_id)
+        with pytest.raises(HTTPException) as e:
+            await current_active_user(session, token)
+        assert e.value.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_principal_invalidation_reaches_other_workers(db_session_maker, monkeypatch):
+    published = []
+
+    async def publish(message: str) -> None:
+        published.append(message)
+
+    monkeypatch.setattr(invalidation_bus, "publish", publish)
+    async with db_session_maker() as session:
+        (user_id,) = await create_users(session, 1)
+        await session.commit()
+        await UserService.get_principal(session, user_id)
+        await UserService.delete_user(session, user_id)
+    assert published == [f"principal:{user_id}"]
+
+    # Сообщение от другого воркера сбрасывает принципал и в этом
+    async with db_session_maker() as session:
+        await UserService.get_principal(session, user_id)
+    assert principal_cache.get(str(user_id)) is not None
+    invalidation_bus._dispatch(f"principal:{user_id}")
+    assert principal_cache.get(str(user_id)) is None